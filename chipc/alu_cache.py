@@ -0,0 +1,32 @@
+"""Process-wide cache of parsed ALU files"""
+import hashlib
+from os import path
+
+from antlr4 import CommonTokenStream
+from antlr4 import InputStream
+
+from chipc.aluLexer import aluLexer
+from chipc.aluParser import aluParser
+
+# Maps (absolute alu filename, sha256 of its content) to the parse tree
+# returned by aluParser.alu(). Visitors only read the tree, so a single tree
+# can be shared by every ALU slot in the pipeline and across iterations.
+_parse_trees = {}
+
+
+def get_alu_parse_tree(alu_filename):
+    """Returns the parse tree for alu_filename, lexing and parsing the file
+    only if it hasn't been seen before with the same content."""
+    with open(alu_filename, 'rb') as f:
+        content = f.read()
+    key = (path.abspath(alu_filename), hashlib.sha256(content).hexdigest())
+    if key not in _parse_trees:
+        lexer = aluLexer(InputStream(content.decode('utf-8')))
+        parser = aluParser(CommonTokenStream(lexer))
+        _parse_trees[key] = parser.alu()
+    return _parse_trees[key]
+
+
+def clear_alu_cache():
+    """Drops all cached parse trees."""
+    _parse_trees.clear()
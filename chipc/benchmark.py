@@ -0,0 +1,319 @@
+"""Benchmarks of iterative_solver over a matrix of specs and pipelines"""
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from os import path
+from pathlib import Path
+
+from chipc.spec_generator import generate_spec
+from chipc.spec_generator import get_spec_name
+from chipc.trace import load_trace
+
+BASE_PATH = path.abspath(path.join(path.dirname(__file__), '..'))
+
+# Benchmarked by default, the cross product of all lists is run. Relative
+# paths are relative to the current directory or else to the repository.
+DEFAULT_MATRIX = OrderedDict([
+    ('specs', ['example_specs/simple.sk', 'example_specs/sampling.sk',
+               'example_specs/rcp.sk']),
+    ('stateful_alus', ['example_alus/stateful_alus/raw.alu',
+                       'example_alus/stateful_alus/if_else_raw.alu']),
+    ('stateless_alus', ['example_alus/stateless_alus/stateless_alu.alu']),
+    ('num_pipeline_stages', [2, 3]),
+    ('num_alus_per_stage', [2]),
+    # Keyword arguments of spec_generator.generate_spec, e.g.,
+    # {"num_fields": 2, "num_state_groups": 2, "depth": 2}. Each spec is
+    # generated in synthetic_spec_dir and benchmarked like those in specs.
+    ('synthetic_specs', []),
+    ('synthetic_spec_dir', 'synthetic_specs'),
+    ('constant_set', '0,1,2,3'),
+    ('max_input_bit', 10),
+    # Passed to iterative_solver for every cell, e.g., ['--parallel'].
+    ('extra_args', []),
+    # Seconds after which a cell is stopped, None for no limit.
+    ('timeout', None)])
+
+# Columns identifying a cell of the matrix in results.
+KEY_COLUMNS = ['spec', 'stateful_alu', 'stateless_alu',
+               'num_pipeline_stages', 'num_alus_per_stage']
+# Measurements compared with a relative threshold.
+TIME_COLUMNS = ['sketch_time', 'verify_time', 'total_time']
+# Measurements which are regressions whenever they grow.
+COUNT_COLUMNS = ['iterations', 'total_hole_bits', 'sketch_bytes']
+
+
+def load_matrix(matrix_filename=None):
+    """Returns DEFAULT_MATRIX updated with the JSON object in
+    matrix_filename, if given."""
+    matrix = OrderedDict(DEFAULT_MATRIX)
+    if matrix_filename is not None:
+        with open(matrix_filename) as matrix_file:
+            matrix.update(json.load(matrix_file))
+    return matrix
+
+
+def get_path(filename):
+    if path.exists(filename):
+        return path.abspath(filename)
+    return path.join(BASE_PATH, filename)
+
+
+def write_synthetic_specs(matrix):
+    """Writes the synthetic specs of matrix and returns an OrderedDict from
+    their paths to their generate_spec keyword arguments."""
+    specs = OrderedDict()
+    Path(matrix['synthetic_spec_dir']).mkdir(parents=True, exist_ok=True)
+    for params in matrix['synthetic_specs']:
+        spec_filename = path.join(matrix['synthetic_spec_dir'],
+                                  get_spec_name(**params) + '.sk')
+        Path(spec_filename).write_text(generate_spec(**params))
+        specs[spec_filename] = params
+    return specs
+
+
+def get_cells(matrix):
+    """Returns a list of dicts, one for each cell of the matrix, with the
+    KEY_COLUMNS values of the cell."""
+    return [OrderedDict(zip(KEY_COLUMNS, values)) for values in
+            itertools.product(matrix['specs'], matrix['stateful_alus'],
+                              matrix['stateless_alus'],
+                              matrix['num_pipeline_stages'],
+                              matrix['num_alus_per_stage'])]
+
+
+def summarize_trace(records):
+    """Returns a dict of the number of iterations, the largest number of
+    hole bits and size of a synthesis sketch, and the total time spent in
+    sketch synthesis and in verification in the span records of a
+    trace.Tracer. Spans may overlap, e.g., synthesize spans of the
+    parallel_codegen workers, so times are the lengths of the unions of the
+    spans rather than their sums."""
+    def total_time(names):
+        intervals = sorted((record['start'],
+                            record['start'] + record['wall_time'])
+                           for record in records if record['name'] in names)
+        total = 0.0
+        covered_until = None
+        for start, end in intervals:
+            if covered_until is not None:
+                start = max(start, covered_until)
+            if end > start:
+                total += end - start
+                covered_until = end
+        return total
+
+    def largest(arg):
+        values = [record['args'][arg] for record in records
+                  if record['name'] == 'synthesize']
+        return max(values) if values else None
+
+    return OrderedDict([
+        ('iterations', sum(record['name'] == 'iteration'
+                           for record in records)),
+        ('total_hole_bits', largest('hole_bits')),
+        ('sketch_bytes', largest('sketch_bytes')),
+        ('sketch_time', total_time(['synthesize'])),
+        ('verify_time', total_time(['screen', 'verify']))])
+
+
+def run_cell(cell, matrix):
+    """Runs iterative_solver on a cell in a temporary directory, so that its
+    files don't pile up, and returns the cell with its measurements."""
+    with tempfile.TemporaryDirectory() as work_dir:
+        trace_filename = path.join(work_dir, 'trace.jsonl')
+        command = [sys.executable, '-m', 'chipc.iterative_solver',
+                   get_path(cell['spec']), get_path(cell['stateful_alu']),
+                   get_path(cell['stateless_alu']),
+                   str(cell['num_pipeline_stages']),
+                   str(cell['num_alus_per_stage']), matrix['constant_set'],
+                   str(matrix['max_input_bit']),
+                   '--trace-file', trace_filename] + matrix['extra_args']
+        # Make chipc importable from work_dir also if it isn't installed.
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [BASE_PATH] + ([env['PYTHONPATH']] if 'PYTHONPATH' in env
+                           else []))
+        start = time.perf_counter()
+        try:
+            return_code = subprocess.run(
+                command, cwd=work_dir, env=env, stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=matrix['timeout']).returncode
+        except subprocess.TimeoutExpired:
+            return_code = None
+        result = OrderedDict(cell)
+        result['return_code'] = return_code
+        # There is no trace if iterative_solver failed early.
+        records = load_trace(trace_filename) \
+            if path.exists(trace_filename) else []
+        result.update(summarize_trace(records))
+        result['total_time'] = time.perf_counter() - start
+        return result
+
+
+def load_results(results_filename):
+    with open(results_filename) as results_file:
+        return [json.loads(line) for line in results_file if line.strip()]
+
+
+def get_key(result):
+    return tuple(result[column] for column in KEY_COLUMNS)
+
+
+def compare_results(baseline, results, threshold=1.2, min_seconds=0.5):
+    """Returns a list of strings describing the regressions of results
+    compared to baseline, both lists of results of run_cell. A time is a
+    regression if it grew by more than the factor threshold and by more
+    than min_seconds, which filters out noise in short runs. Iterations and
+    hole bits are regressions whenever they grow, and so is a cell which
+    doesn't compile anymore."""
+    baseline = {get_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = baseline.get(get_key(result))
+        if old is None:
+            continue
+        cell = ' '.join(str(value) for value in get_key(result))
+        if old['return_code'] == 0 and result['return_code'] != 0:
+            regressions.append(cell + ': failed with return code ' +
+                               str(result['return_code']))
+            continue
+        for column in COUNT_COLUMNS:
+            # Results of older versions may lack columns.
+            if old.get(column) is not None and \
+                    result.get(column) is not None and \
+                    result[column] > old[column]:
+                regressions.append('%s: %s %d -> %d' % (
+                    cell, column, old[column], result[column]))
+        for column in TIME_COLUMNS:
+            if result[column] > old[column] * threshold and \
+                    result[column] - old[column] > min_seconds:
+                regressions.append('%s: %s %.2fs -> %.2fs' % (
+                    cell, column, old[column], result[column]))
+    return regressions
+
+
+def get_curve(results, column, metrics):
+    """Returns a header row and a row for each result with column, e.g.,
+    the num_fields of synthetic specs. A row has the value of column, the
+    other KEY_COLUMNS except spec and the metrics."""
+    key_columns = [key_column for key_column in KEY_COLUMNS
+                   if key_column not in ['spec', column]]
+    rows = [[result.get(name) for name in [column] + key_columns + metrics]
+            for result in results if result.get(column) is not None]
+    # One curve after another, each sorted by column.
+    rows.sort(key=lambda row: ([str(value)
+                                for value in row[1:len(key_columns) + 1]],
+                               row[0]))
+    return [[column] + key_columns + metrics] + rows
+
+
+def run(args):
+    matrix = load_matrix(args.matrix)
+    synthetic_specs = write_synthetic_specs(matrix)
+    matrix['specs'] = matrix['specs'] + list(synthetic_specs)
+    cells = get_cells(matrix)
+    # Results are appended as soon as a cell is done, so that a long run
+    # which is interrupted still leaves its results behind.
+    open(args.results_filename, 'w').close()
+    for i, cell in enumerate(cells):
+        print('Running cell', i + 1, 'of', len(cells), ':',
+              ' '.join(str(value) for value in cell.values()))
+        result = run_cell(cell, matrix)
+        result.update(synthetic_specs.get(cell['spec'], {}))
+        print('  ' + ', '.join('%s=%s' % (column, result[column]) for column
+                               in ['return_code'] + COUNT_COLUMNS +
+                               TIME_COLUMNS))
+        with open(args.results_filename, 'a') as results_file:
+            results_file.write(json.dumps(result) + '\n')
+    return 0
+
+
+def compare(args):
+    regressions = compare_results(load_results(args.baseline_filename),
+                                  load_results(args.results_filename),
+                                  args.threshold, args.min_seconds)
+    for regression in regressions:
+        print('Regression', regression)
+    if regressions:
+        return 1
+    print('No regressions.')
+    return 0
+
+
+def curve(args):
+    for row in get_curve(load_results(args.results_filename), args.column,
+                         args.metrics):
+        print('\t'.join(str(value) for value in row))
+    return 0
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Benchmark iterative_solver and compare results.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser(
+        'run', help='Run iterative_solver on each cell of a matrix.')
+    run_parser.add_argument(
+        'results_filename', help='JSON lines file to write results to.')
+    run_parser.add_argument(
+        '--matrix',
+        type=str,
+        help='JSON file overriding keys of the default matrix, e.g., \
+              {"specs": ["example_specs/times_two.sk"], \
+              "num_pipeline_stages": [1, 2]}.')
+    run_parser.set_defaults(function=run)
+
+    compare_parser = subparsers.add_parser(
+        'compare', help='Compare results with a baseline and exit with 1 \
+                         if there are regressions.')
+    compare_parser.add_argument(
+        'baseline_filename', help='Results of an earlier run.')
+    compare_parser.add_argument(
+        'results_filename', help='Results to compare with the baseline.')
+    compare_parser.add_argument(
+        '--threshold',
+        type=float,
+        default=1.2,
+        help='Times growing by more than this factor are regressions.')
+    compare_parser.add_argument(
+        '--min-seconds',
+        type=float,
+        default=0.5,
+        help='Times growing by less than this many seconds are not \
+              regressions.')
+    compare_parser.set_defaults(function=compare)
+
+    curve_parser = subparsers.add_parser(
+        'curve', help='Print metrics against a column of results, e.g., a \
+                       generate_spec argument of synthetic specs, as \
+                       tab-separated values.')
+    curve_parser.add_argument(
+        'results_filename', help='Results of a run.')
+    curve_parser.add_argument(
+        'column', help='Column to sort by, e.g., num_fields or depth.')
+    curve_parser.add_argument(
+        '--metrics',
+        nargs='+',
+        default=['sketch_bytes', 'total_hole_bits', 'sketch_time'],
+        help='Columns to print for each value of column.')
+    curve_parser.set_defaults(function=curve)
+
+    args = parser.parse_args(argv[1:])
+    return args.function(args)
+
+
+def run_main():
+    sys.exit(main(sys.argv))
+
+
+if __name__ == '__main__':
+    run_main()
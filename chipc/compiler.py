@@ -2,19 +2,29 @@ import concurrent.futures as cf
 import itertools
 import os
 import signal
+import time
 from collections import OrderedDict
 from os import path
 from pathlib import Path
 
+import numpy as np
 import psutil
 from jinja2 import Environment
 from jinja2 import FileSystemLoader
 from jinja2 import StrictUndefined
 
+from chipc import sketch_dag
 from chipc import sketch_utils
+from chipc import z3_pipeline
 from chipc import z3_utils
 from chipc.mode import Mode
+from chipc.pipeline_simulator import get_counterexample
+from chipc.pipeline_simulator import PipelineSimulator
+from chipc.sketch_cache import SketchCache
 from chipc.sketch_code_generator import SketchCodeGenerator
+from chipc.spec_analysis import get_state_group_assignments
+from chipc.spec_interpreter import Spec
+from chipc.trace import Tracer
 from chipc.utils import get_hole_bit_width
 from chipc.utils import get_hole_value_assignments
 from chipc.utils import get_num_pkt_fields
@@ -37,6 +47,97 @@ def kill_child_processes(parent_pid, sig=signal.SIGTERM):
             print(e)
 
 
+def get_num_workers(num_jobs, cpu_budget, threads_per_job,
+                    memory_per_job_mb):
+    """Returns how many sketch jobs to run at the same time, so that all
+    running jobs fit in cpu_budget cores and in the currently available
+    memory. Remaining jobs are queued. At least one job is always run."""
+    num_workers = min(num_jobs, cpu_budget // threads_per_job)
+    available_memory_mb = psutil.virtual_memory().available // (1024 * 1024)
+    num_workers = min(num_workers, available_memory_mb // memory_per_job_mb)
+    return max(1, num_workers)
+
+
+# Ways verify_multiple builds z3 queries: from the pipeline and spec
+# directly, from the DAG sketch generates for a verify sketch, or both,
+# checking that they agree.
+VERIFY_MODES = ['direct', 'sketch', 'cross-check']
+
+# Default maximum number of inputs to verify exhaustively.
+EXHAUSTIVE_VERIFY_LIMIT = 2**20
+# Number of inputs checked at once by verify_input_range.
+EXHAUSTIVE_VERIFY_CHUNK_SIZE = 2**16
+
+
+# Default input bit widths candidates are verified at before the maximum.
+VERIFY_BIT_SCHEDULE = [3, 5, 8]
+
+
+def get_verify_bit_schedule(max_input_bit, verify_bits=VERIFY_BIT_SCHEDULE):
+    """Returns the increasing input bit widths to verify at, the ones in
+    verify_bits smaller than max_input_bit followed by max_input_bit."""
+    return sorted(set(bits for bits in verify_bits
+                      if bits < max_input_bit)) + [max_input_bit]
+
+
+def get_input_space_size(num_inputs, input_bits):
+    """Returns the number of different values of num_inputs variables of
+    input_bits bits each."""
+    return 2**(num_inputs * input_bits)
+
+
+def get_spread(items, n):
+    """Returns up to n items, evenly spread over items, so that
+    counterexamples aren't all neighbors."""
+    if len(items) <= n:
+        return list(items)
+    positions = np.linspace(0, len(items) - 1, n).round().astype(np.int64)
+    return [items[i] for i in sorted(set(positions))]
+
+
+def verify_input_range(simulator, spec, hole_assignments, constants,
+                       input_names, input_bits, start, stop,
+                       num_counterexamples):
+    """Checks the pipeline against the spec on the inputs with indices start
+    to stop - 1, where the value of the i-th variable in input_names is bits
+    i * input_bits to (i + 1) * input_bits - 1 of the index. Returns up to
+    num_counterexamples counterexample tuples. This is a module level
+    function, so that it can be run in other processes."""
+    indices = np.arange(start, stop, dtype=np.int64)
+    pkt_fields = OrderedDict()
+    state_vars = OrderedDict()
+    for i, name in enumerate(input_names):
+        values = pkt_fields if name.startswith('pkt_') else state_vars
+        values[name] = (indices >> (i * input_bits)) & (2**input_bits - 1)
+    expected_pkt_fields, expected_state_vars = spec.evaluate_batch(
+        pkt_fields, state_vars)
+    mismatches = simulator.get_mismatches(
+        hole_assignments, constants, pkt_fields, state_vars,
+        expected_pkt_fields, expected_state_vars)
+    return [get_counterexample(pkt_fields, state_vars, index)
+            for index in get_spread(mismatches, num_counterexamples)]
+
+
+class SketchBackend:
+    """Synthesizes hole values by running sketch on a codegen sketch, see
+    Compiler.sketch_codegen_run. Other synthesis backends, e.g.,
+    z3_synthesis.Z3Backend, implement the same methods."""
+
+    # Whether Compiler.parallel_codegen can run jobs in other processes.
+    parallel = True
+
+    def synthesize(self, compiler, compiler_input):
+        """Returns a tuple of the return code, 0 on success, the output and
+        the hole value assignments for a tuple of additional constraints on
+        holes, additional testcases and the sketch file name."""
+        return compiler.sketch_codegen_run(compiler_input)
+
+    def add_counterexamples(self, compiler, counterexamples):
+        # Counterexamples reach sketch as additional testcases in the sketch
+        # file instead.
+        pass
+
+
 class Compiler:
     def __init__(self, spec_filename, stateful_alu_filename,
                  stateless_alu_filename, num_pipeline_stages,
@@ -44,7 +145,24 @@ class Compiler:
                  constant_set, synthesized_allocation=False,
                  output_packet_fields=[],
                  output_state_groups=[],
-                 input_packet_fields=[]):
+                 input_packet_fields=[],
+                 shared_alu_definitions=False,
+                 sketch_cache_dir=None,
+                 sketch_cache_size_mb=1024,
+                 cpu_budget=None,
+                 sketch_threads=None,
+                 sketch_memory_mb=1024,
+                 prune_assignments=True,
+                 portfolio_seeds=[1],
+                 portfolio_bnd_inbits=[2],
+                 bv_width=None,
+                 num_counterexamples=1,
+                 num_screening_inputs=0,
+                 exhaustive_verify_limit=EXHAUSTIVE_VERIFY_LIMIT,
+                 verify_mode='direct',
+                 tracer=None,
+                 sketch_runner=None,
+                 synthesis_backend=None):
         self.spec_filename = spec_filename
         self.stateful_alu_filename = stateful_alu_filename
         self.stateless_alu_filename = stateless_alu_filename
@@ -54,10 +172,72 @@ class Compiler:
         self.parallel_sketch = parallel_sketch
         self.constant_set = constant_set
         self.synthesized_allocation = synthesized_allocation
+        # Number of cores parallel_codegen may keep busy at the same time.
+        self.cpu_budget = cpu_budget if cpu_budget is not None \
+            else os.cpu_count()
+        # Number of threads of each sketch process when parallel_sketch is
+        # set. If None, sketch picks it and uses all cores.
+        self.sketch_threads = sketch_threads
+        # Expected peak memory use of a single sketch process.
+        self.sketch_memory_mb = sketch_memory_mb
+        # Whether parallel_codegen skips state group assignments which can't
+        # work or are equivalent to others.
+        self.prune_assignments = prune_assignments
+        # Each synthesis job races sketch with every combination of these
+        # seeds and input bit widths.
+        self.portfolio_configs = list(itertools.product(portfolio_bnd_inbits,
+                                                        portfolio_seeds))
+        # If set, verify with bit vectors of this width instead of integers.
+        self.bv_width = bv_width
+        # Maximum number of counterexamples verify_multiple returns.
+        self.num_counterexamples = num_counterexamples
+        # Number of random inputs screen simulates candidates on. Screening
+        # is off if 0.
+        self.num_screening_inputs = num_screening_inputs
+        # verify enumerates all inputs instead of using sketch and z3 if there
+        # are at most this many.
+        self.exhaustive_verify_limit = exhaustive_verify_limit
+        # One of VERIFY_MODES. Direct verification needs a spec supported by
+        # the spec interpreter and falls back to sketch otherwise.
+        assert verify_mode in VERIFY_MODES, (
+            'Unknown verify mode ' + str(verify_mode))
+        self.verify_mode = verify_mode
+        # Tuples of the input bits, the direct and the sketch counterexamples
+        # of each candidate the two disagree on in cross-check mode.
+        self.verify_disagreements = []
+        # Records the time spent in each phase, nothing by default.
+        self.tracer = tracer if tracer is not None else Tracer()
+        # Runs sketch, or stands in for it, e.g., a sketch_utils.ReplayRunner.
+        self.sketch_runner = sketch_runner if sketch_runner is not None \
+            else sketch_utils.SKETCH_RUNNER
+        # Synthesizes hole values, with sketch by default.
+        self.synthesis_backend = synthesis_backend \
+            if synthesis_backend is not None else SketchBackend()
+        # A single z3 solver is used to verify candidates of all iterations.
+        self.verifier = z3_utils.IncrementalVerifier()
+        # Key and SketchDag of the last candidate verified with z3, so that
+        # checking it at another bit width doesn't run sketch again.
+        self.verify_dag_key = None
+        self.verify_dag = None
+        # Results of sketch invocations are cached on disk only if a cache
+        # directory is given.
+        self.sketch_cache = None
+        if sketch_cache_dir is not None:
+            self.sketch_cache = SketchCache(
+                sketch_cache_dir,
+                max_size_bytes=sketch_cache_size_mb * 1024 * 1024)
 
         program_content = Path(spec_filename).read_text()
         self.num_fields_in_prog = get_num_pkt_fields(program_content)
         self.num_state_groups = len(get_state_group_info(program_content))
+        # Executable spec for screening, exhaustive and direct verification,
+        # None if the spec isn't supported by the spec interpreter.
+        self.spec = None
+        try:
+            self.spec = Spec(program_content)
+        except ValueError as e:
+            print('Spec not supported, no screening, exhaustive or direct '
+                  'verification:', e)
 
         if not input_packet_fields:
             assert self.num_fields_in_prog <= num_alus_per_stage, (
@@ -119,9 +299,16 @@ class Compiler:
             stateless_alu_filename=stateless_alu_filename,
             constant_set=constant_set,
             synthesized_allocation=synthesized_allocation,
-            input_packet_fields=input_packet_fields)
+            input_packet_fields=input_packet_fields,
+            shared_alu_definitions=shared_alu_definitions)
+        self.pipeline_simulator = PipelineSimulator(
+            self.sketch_code_generator)
+        # Builds z3 formulas instead of simulating, for direct verification.
+        self.z3_pipeline_simulator = PipelineSimulator(
+            self.sketch_code_generator, z3_pipeline.Z3Operations(bv_width))
 
     def update_constants_for_synthesis(self, constant_set):
+        self.constant_set = constant_set
         # Join the values in constant_set to get constant_array in sketch.
         new_constant_set_str = '{' + ','.join(constant_set) + '}'
 
@@ -133,17 +320,26 @@ class Compiler:
             len(constant_set))
 
     def single_codegen_run(self, compiler_input):
+        return self.synthesis_backend.synthesize(self, compiler_input)
+
+    def add_counterexamples(self, counterexamples):
+        """Passes counterexample tuples like those of verify_multiple to the
+        synthesis backend for the next iterations."""
+        self.synthesis_backend.add_counterexamples(self, counterexamples)
+
+    def sketch_codegen_run(self, compiler_input):
         additional_constraints = compiler_input[0]
         additional_testcases = compiler_input[1]
         sketch_file_name = compiler_input[2]
 
         """Codegeneration"""
-        codegen_code = self.sketch_code_generator.generate_sketch(
-            spec_filename=self.spec_filename,
-            mode=Mode.CODEGEN,
-            synthesized_allocation=self.synthesized_allocation,
-            additional_constraints=additional_constraints,
-            additional_testcases=additional_testcases)
+        with self.tracer.span('generate_sketch', mode='codegen'):
+            codegen_code = self.sketch_code_generator.generate_sketch(
+                spec_filename=self.spec_filename,
+                mode=Mode.CODEGEN,
+                synthesized_allocation=self.synthesized_allocation,
+                additional_constraints=additional_constraints,
+                additional_testcases=additional_testcases)
 
         # Create file and write sketch_harness into it.
         with open(sketch_file_name, 'w') as sketch_file:
@@ -154,11 +350,36 @@ class Compiler:
               self.sketch_code_generator.total_hole_bits_)
         print('Sketch file is', sketch_file_name)
         assert (self.parallel_sketch in [True, False])
-        (ret_code, output) = sketch_utils.synthesize(
-            sketch_file_name,
-            bnd_inbits=2,
-            slv_seed=1,
-            slv_parallel=self.parallel_sketch)
+        slv_p_cpus = self.sketch_threads if self.parallel_sketch else None
+        with self.tracer.span(
+                'synthesize', sketch_file=sketch_file_name,
+                hole_bits=self.sketch_code_generator.total_hole_bits_,
+                sketch_bytes=len(codegen_code)):
+            if len(self.portfolio_configs) == 1:
+                bnd_inbits, slv_seed = self.portfolio_configs[0]
+                (ret_code, output) = sketch_utils.synthesize(
+                    sketch_file_name,
+                    bnd_inbits=bnd_inbits,
+                    slv_seed=slv_seed,
+                    slv_parallel=self.parallel_sketch,
+                    slv_p_cpus=slv_p_cpus,
+                    cache=self.sketch_cache,
+                    runner=self.sketch_runner)
+            else:
+                (ret_code, output, (bnd_inbits, slv_seed)) = \
+                    sketch_utils.synthesize_portfolio(
+                        sketch_file_name,
+                        self.portfolio_configs,
+                        slv_parallel=self.parallel_sketch,
+                        slv_p_cpus=slv_p_cpus,
+                        cache=self.sketch_cache,
+                        runner=self.sketch_runner)
+                # Record the winner, so that the run can be reproduced with
+                # a single seed.
+                winner = 'Portfolio winner: --bnd-inbits=' + \
+                    str(bnd_inbits) + ' --slv-seed=' + str(slv_seed)
+                print(winner)
+                output = winner + '\n' + output
 
         # Store sketch output
         with open(sketch_file_name[:sketch_file_name.find('.sk')] +
@@ -179,18 +400,35 @@ class Compiler:
                                         '_codegen_iteration_' +
                                         str(iter_cnt) + '.sk'))
 
+    def get_state_group_assignments(self):
+        """Returns tuples of pipeline stages, one for each state group, to
+        try in parallel_codegen."""
+        if not self.prune_assignments:
+            return list(itertools.product(range(self.num_pipeline_stages),
+                                          repeat=self.num_state_groups))
+        return get_state_group_assignments(
+            Path(self.spec_filename).read_text(),
+            self.num_pipeline_stages,
+            self.num_state_groups,
+            self.sketch_code_generator.output_packet_fields_,
+            self.sketch_code_generator.output_state_groups_)
+
     def parallel_codegen(self,
                          additional_constraints=[],
                          additional_testcases=''):
-        # For each state_group, pick a pipeline_stage exhaustively.
+        if not self.synthesis_backend.parallel:
+            return self.single_codegen_run((additional_constraints,
+                                            additional_testcases,
+                                            self.sketch_name + '_codegen.sk'))
+
+        # For each state_group, pick a pipeline_stage exhaustively, except for
+        # assignments that get_state_group_assignments pruned.
         # Note that some of these assignments might be infeasible, but that's
         # OK. Sketch will reject these anyway.
         count = 0
         compiler_output = None
         compiler_inputs = []
-        for assignment in itertools.product(list(
-            range(self.num_pipeline_stages)),
-                repeat=self.num_state_groups):
+        for assignment in self.get_state_group_assignments():
             constraint_list = additional_constraints.copy()
             count = count + 1
             print('Now in assignment # ', count, ' assignment is ', assignment)
@@ -212,7 +450,19 @@ class Compiler:
                  self.sketch_name + '_' + str(count) + '_codegen.sk')
             ]
 
-        with cf.ProcessPoolExecutor(max_workers=count) as executor:
+        if self.parallel_sketch:
+            threads_per_job = self.sketch_threads or os.cpu_count()
+        else:
+            threads_per_job = 1
+        # Each job runs one sketch process per portfolio config.
+        num_workers = get_num_workers(
+            count, self.cpu_budget,
+            threads_per_job * len(self.portfolio_configs),
+            self.sketch_memory_mb * len(self.portfolio_configs))
+        print('Running', count, 'sketch jobs with', num_workers, 'workers')
+
+        # The executor queues jobs beyond num_workers until a worker is free.
+        with cf.ProcessPoolExecutor(max_workers=num_workers) as executor:
             futures = []
             for compiler_input in compiler_inputs:
                 futures.append(
@@ -222,6 +472,9 @@ class Compiler:
                 compiler_output = f.result()
                 if (compiler_output[0] == 0):
                     print('Success')
+                    # Drop queued jobs which haven't started yet.
+                    for future in futures:
+                        future.cancel()
                     # TODO: Figure out the right way to do this in the future.
                     executor.shutdown(wait=False)
                     kill_child_processes(os.getpid())
@@ -230,6 +483,97 @@ class Compiler:
                     print('One run failed, waiting for others.')
         return compiler_output
 
+    def simulate(self, hole_assignments, pkt_fields, state_vars):
+        """Runs a batch of packets and states, given as dicts from names to
+        numpy arrays, through the pipeline with the hole value assignments.
+        See PipelineSimulator.simulate."""
+        return self.pipeline_simulator.simulate(
+            hole_assignments, self.constant_set, pkt_fields, state_vars)
+
+    def get_input_names(self):
+        """Returns the names of the packet fields and state variables the
+        pipeline and the spec read."""
+        input_names = ['pkt_' + str(field)
+                       for field in range(self.num_fields_in_prog)]
+        for group in range(self.num_state_groups):
+            input_names += self.pipeline_simulator.get_state_var_names(group)
+        if self.spec is not None:
+            input_names += [name for name in self.spec.variables
+                            if name not in input_names]
+        return input_names
+
+    def screen(self, hole_assignments, input_bits, iter_cnt=1,
+               num_counterexamples=None):
+        """Simulates the pipeline and the spec on self.num_screening_inputs
+        random inputs of input_bits bits and returns a list of up to
+        num_counterexamples, self.num_counterexamples by default,
+        counterexample tuples like verify_multiple. The list is empty if no
+        input shows a difference, or if screening is off, in which case the
+        hole value assignments still need to be verified."""
+        if self.spec is None or self.num_screening_inputs == 0:
+            return []
+        if num_counterexamples is None:
+            num_counterexamples = self.num_counterexamples
+
+        # Seed with the iteration, so that runs are reproducible.
+        random_state = np.random.RandomState(iter_cnt)
+        pkt_fields = OrderedDict()
+        state_vars = OrderedDict()
+        for name in self.get_input_names():
+            values = pkt_fields if name.startswith('pkt_') else state_vars
+            values[name] = random_state.randint(0, 2**input_bits,
+                                                self.num_screening_inputs)
+
+        with self.tracer.span('screen', input_bits=input_bits):
+            expected_pkt_fields, expected_state_vars = \
+                self.spec.evaluate_batch(pkt_fields, state_vars)
+            mismatches = self.pipeline_simulator.get_mismatches(
+                hole_assignments, self.constant_set, pkt_fields, state_vars,
+                expected_pkt_fields, expected_state_vars)
+        return [get_counterexample(pkt_fields, state_vars, index)
+                for index in mismatches[:num_counterexamples]]
+
+    def can_verify_exhaustively(self, input_bits):
+        """Returns whether verify enumerates all inputs of input_bits bits
+        rather than using sketch and z3. This is faster when there are few
+        inputs. Bit vector verification always uses z3, as the simulator
+        doesn't wrap around."""
+        return (self.spec is not None and self.bv_width is None and
+                get_input_space_size(len(self.get_input_names()),
+                                     input_bits) <=
+                self.exhaustive_verify_limit)
+
+    def verify_exhaustively(self, hole_assignments, input_bits,
+                            num_counterexamples,
+                            chunk_size=EXHAUSTIVE_VERIFY_CHUNK_SIZE):
+        """Simulates the pipeline and the spec on all inputs of input_bits
+        bits and returns a list of up to num_counterexamples counterexample
+        tuples like verify_multiple. Inputs are checked in chunks of
+        chunk_size, in parallel on up to self.cpu_budget cores if there is
+        more than one chunk."""
+        input_names = self.get_input_names()
+        num_inputs = get_input_space_size(len(input_names), input_bits)
+        constants = list(self.constant_set)
+        args = [(self.pipeline_simulator, self.spec, hole_assignments,
+                 constants, input_names, input_bits, start,
+                 min(start + chunk_size, num_inputs), num_counterexamples)
+                for start in range(0, num_inputs, chunk_size)]
+        print('Verifying exhaustively on', num_inputs, 'inputs in',
+              len(args), 'chunks')
+        with self.tracer.span('verify_exhaustively', input_bits=input_bits,
+                              num_inputs=num_inputs):
+            if len(args) == 1:
+                results = [verify_input_range(*args[0])]
+            else:
+                num_workers = min(len(args), self.cpu_budget)
+                with cf.ProcessPoolExecutor(
+                        max_workers=num_workers) as executor:
+                    results = list(executor.map(verify_input_range,
+                                                *zip(*args)))
+        counterexamples = [counterexample for result in results
+                           for counterexample in result]
+        return get_spread(counterexamples, num_counterexamples)
+
     def verify(self, hole_assignments, input_bits, iter_cnt=1):
         """Verify hole value assignments for the sketch with a specific input
         bit lengths with z3.
@@ -241,26 +585,157 @@ class Compiler:
             If the hole value assignments work for the input_bits, returns
             a tuple of two empty dicts.
         """
+        counterexamples = self.verify_multiple(hole_assignments, input_bits,
+                                               iter_cnt,
+                                               num_counterexamples=1)
+        if not counterexamples:
+            return (OrderedDict(), OrderedDict())
+        return counterexamples[0]
+
+    def verify_multiple(self, hole_assignments, input_bits, iter_cnt=1,
+                        num_counterexamples=None):
+        """Same as verify, but returns a list of up to num_counterexamples,
+        self.num_counterexamples by default, diverse counterexample tuples.
+        The list is empty if the hole value assignments work for the
+        input_bits."""
+        if num_counterexamples is None:
+            num_counterexamples = self.num_counterexamples
+
         # Check all holes have values.
         for hole in self.sketch_code_generator.hole_names_:
             assert hole in hole_assignments
 
-        # Generate a sketch file to verify the hole value assignments with
-        # the specified input bit lengths.
-        sketch_to_verify = self.sketch_code_generator.generate_sketch(
-            spec_filename=self.spec_filename,
-            mode=Mode.VERIFY,
-            synthesized_allocation=self.synthesized_allocation,
-            hole_assignments=hole_assignments
-        )
+        if self.can_verify_exhaustively(input_bits):
+            return self.verify_exhaustively(hole_assignments, input_bits,
+                                            num_counterexamples)
+
+        if self.verify_mode == 'sketch' or self.spec is None:
+            return self.verify_with_sketch(hole_assignments, input_bits,
+                                           iter_cnt, num_counterexamples)
+
+        counterexamples = self.verify_directly(hole_assignments, input_bits,
+                                               num_counterexamples)
+        if self.verify_mode == 'cross-check':
+            sketch_counterexamples = self.verify_with_sketch(
+                hole_assignments, input_bits, iter_cnt, num_counterexamples)
+            if bool(counterexamples) != bool(sketch_counterexamples):
+                print('Direct and sketch verification disagree at',
+                      input_bits, 'bits, direct counterexamples:',
+                      counterexamples, 'sketch counterexamples:',
+                      sketch_counterexamples)
+                self.verify_disagreements.append(
+                    (input_bits, counterexamples, sketch_counterexamples))
+                # Only candidates both accept are accepted.
+                counterexamples = counterexamples or sketch_counterexamples
+        return counterexamples
+
+    def verify_directly(self, hole_assignments, input_bits,
+                        num_counterexamples):
+        """Same as verify_multiple, but builds the z3 query from the ALUs,
+        the pipeline structure and the spec without running sketch. The spec
+        side of the query is asserted once per bit width, and only the
+        pipeline side is pushed and popped for each candidate."""
+        key = ('direct', input_bits)
+        with self.tracer.span('z3_query', mode='direct'):
+            spec_encoding = self.verifier.get_base(key)
+            if spec_encoding is None:
+                spec_encoding = z3_pipeline.SpecEncoding(
+                    self.spec, self.z3_pipeline_simulator.operations,
+                    self.get_input_names(), input_bits)
+                self.verifier.set_base(key, spec_encoding,
+                                       spec_encoding.constraints)
+            negated_query = spec_encoding.get_negated_query(
+                self.z3_pipeline_simulator, hole_assignments,
+                list(self.constant_set))
+        return self.check_negated_query(negated_query, num_counterexamples,
+                                        key)
+
+    def verify_with_sketch(self, hole_assignments, input_bits, iter_cnt,
+                           num_counterexamples):
+        """Same as verify_multiple, but builds the z3 query from the DAG
+        sketch generates for a verify sketch."""
+        verify_dag = self.get_verify_dag(hole_assignments, iter_cnt)
+        with self.tracer.span('z3_query', mode='sketch'):
+            negated_query = z3_utils.get_z3_negated_query(
+                verify_dag, input_bits, bv_width=self.bv_width)
+        return self.check_negated_query(negated_query, num_counterexamples)
+
+    def check_negated_query(self, negated_query, num_counterexamples,
+                            key=None):
+        with self.tracer.span('z3_check'):
+            return self.verifier.generate_multiple_counterexamples_from_query(
+                negated_query, num_counterexamples, key)
+
+    def verify_progressively(self, hole_assignments, bit_schedule,
+                             iter_cnt=1, num_counterexamples=None):
+        """Verifies hole value assignments at each input bit width in
+        bit_schedule in turn, stopping at the first one with counterexamples.
+        Wrong candidates usually fail at a small bit width, where
+        verification is much cheaper, so only correct candidates pay for
+        the last, largest one.
+
+        Returns:
+            A tuple of the counterexample list of verify_multiple, empty if
+            the hole value assignments work for all bit widths, and a list of
+            (input_bits, seconds) tuples for the bit widths checked.
+        """
+        timings = []
+        counterexamples = []
+        for input_bits in bit_schedule:
+            start = time.perf_counter()
+            with self.tracer.span('verify', input_bits=input_bits):
+                counterexamples = self.verify_multiple(
+                    hole_assignments, input_bits, iter_cnt=iter_cnt,
+                    num_counterexamples=num_counterexamples)
+            timings.append((input_bits, time.perf_counter() - start))
+            print('Verification with', input_bits, 'bits took',
+                  '%.3f' % timings[-1][1], 'seconds,',
+                  'failed' if counterexamples else 'passed')
+            if counterexamples:
+                break
+        return (counterexamples, timings)
+
+    def get_verify_dag(self, hole_assignments, iter_cnt=1):
+        """Returns the SketchDag of the pipeline with the hole value
+        assignments asserted to match the spec. The DAG doesn't depend on the
+        input bit width, so it is generated with sketch only once for the
+        last candidate and reused until the candidate or the constants
+        change."""
+        key = (tuple(sorted(hole_assignments.items())),
+               tuple(self.constant_set))
+        if key == self.verify_dag_key:
+            return self.verify_dag
+
+        # Generate a sketch file to verify the hole value assignments.
+        with self.tracer.span('generate_sketch', mode='verify'):
+            sketch_to_verify = self.sketch_code_generator.generate_sketch(
+                spec_filename=self.spec_filename,
+                mode=Mode.VERIFY,
+                synthesized_allocation=self.synthesized_allocation,
+                hole_assignments=hole_assignments
+            )
 
         # Write sketch to a file.
         file_basename = self.sketch_name + '_verify_iter_' + str(iter_cnt)
         sketch_filename = file_basename + '.sk'
         Path(sketch_filename).write_text(sketch_to_verify)
 
-        sketch_ir = sketch_utils.generate_ir(sketch_filename)
-
-        z3_formula = z3_utils.get_z3_formula(sketch_ir, input_bits)
+        with self.tracer.span('generate_ir'):
+            sketch_ir = sketch_utils.generate_ir(
+                sketch_filename, cache=self.sketch_cache,
+                runner=self.sketch_runner)
+        self.verify_dag = sketch_dag.parse_dag(sketch_ir)
+        self.verify_dag_key = key
+        return self.verify_dag
 
-        return z3_utils.generate_counterexamples(z3_formula)
+    def verify_at_bit_widths(self, hole_assignments, bit_widths, iter_cnt=1,
+                             num_counterexamples=None):
+        """Verifies hole value assignments at each input bit width in
+        bit_widths, generating the DAG with sketch at most once if sketch is
+        used. Returns an OrderedDict from bit width to the counterexample list
+        of verify_multiple."""
+        return OrderedDict(
+            (input_bits, self.verify_multiple(
+                hole_assignments, input_bits, iter_cnt=iter_cnt,
+                num_counterexamples=num_counterexamples))
+            for input_bits in bit_widths)
@@ -6,10 +6,22 @@ from pathlib import Path
 from ordered_set import OrderedSet
 
 from chipc.compiler import Compiler
+from chipc.compiler import EXHAUSTIVE_VERIFY_LIMIT
+from chipc.compiler import get_verify_bit_schedule
+from chipc.compiler import SketchBackend
+from chipc.compiler import VERIFY_BIT_SCHEDULE
+from chipc.compiler import VERIFY_MODES
+from chipc.sketch_utils import ReplayRunner
+from chipc.sketch_utils import SKETCH_RUNNER
+from chipc.trace import Tracer
+from chipc.trace import write_chrome_trace
 from chipc.utils import compilation_failure
 from chipc.utils import compilation_success
 from chipc.utils import get_num_pkt_fields
 from chipc.utils import get_state_group_info
+from chipc.z3_synthesis import Z3Backend
+
+SYNTHESIS_BACKENDS = ['sketch', 'z3']
 
 
 def generate_hole_elimination_assert(hole_assignments):
@@ -130,6 +142,47 @@ def generate_counterexample_asserts(pkt_fields, state_vars, num_fields_in_prog,
     return counterexample_defs + counterexample_asserts
 
 
+def print_sketch_cache_stats(compiler):
+    # Lookups made by parallel_codegen workers happen in other processes and
+    # are not counted here.
+    if compiler.sketch_cache is not None:
+        print('Sketch cache stats', compiler.sketch_cache.get_stats())
+    if isinstance(compiler.sketch_runner, ReplayRunner):
+        print('Sketch fixture stats', compiler.sketch_runner.get_stats())
+
+
+def print_verify_disagreements(compiler):
+    """Prints the candidates direct and sketch verification disagreed on in
+    cross-check mode and returns whether there were any."""
+    if not compiler.verify_disagreements:
+        return False
+    print('Direct and sketch verification disagreed on',
+          len(compiler.verify_disagreements), 'candidates:')
+    for input_bits, direct, sketch in compiler.verify_disagreements:
+        print('  at', input_bits, 'bits, direct counterexamples:', direct,
+              'sketch counterexamples:', sketch)
+    return True
+
+
+def get_synthesis_backend(name):
+    if name == 'z3':
+        return Z3Backend()
+    return SketchBackend()
+
+
+def get_sketch_runner(sketch_fixture_dir, record_sketch_fixtures):
+    if sketch_fixture_dir is None:
+        return SKETCH_RUNNER
+    return ReplayRunner(sketch_fixture_dir,
+                        SKETCH_RUNNER if record_sketch_fixtures else None)
+
+
+def finish_trace(trace_filename, chrome_trace_filename):
+    if chrome_trace_filename is not None:
+        write_chrome_trace(trace_filename, chrome_trace_filename)
+        print('Chrome trace written to', chrome_trace_filename)
+
+
 def main(argv):
     parser = argparse.ArgumentParser(description='Iterative solver.')
     parser.add_argument(
@@ -200,8 +253,159 @@ def main(argv):
               use canonical allocation, i.e, first state variable assigned \
               to first phv container.'
     )
+    parser.add_argument(
+        '--shared-alu-definitions',
+        action='store_true',
+        help='If set, emit one stateless and one stateful ALU definition \
+              in the sketch and pass the holes of each pipeline slot as \
+              arguments, instead of one ALU definition per slot.'
+    )
+    parser.add_argument(
+        '--sketch-cache-dir',
+        type=str,
+        help='If set, cache results of sketch invocations in this directory \
+              and reuse them for identical sketch files, also across runs.'
+    )
+    parser.add_argument(
+        '--sketch-cache-size-mb',
+        type=int,
+        default=1024,
+        help='Maximum size of the sketch cache in MB. Least recently used \
+              entries are evicted first.'
+    )
+    parser.add_argument(
+        '--cpu-budget',
+        type=int,
+        help='Maximum number of cores used by sketch processes at the same \
+              time with --parallel. Defaults to the number of cores.'
+    )
+    parser.add_argument(
+        '--sketch-threads',
+        type=int,
+        help='Number of threads of each sketch process with \
+              --parallel-sketch. Defaults to the number of cores.'
+    )
+    parser.add_argument(
+        '--sketch-memory-mb',
+        type=int,
+        default=1024,
+        help='Expected memory use of a sketch process in MB. With \
+              --parallel, no more sketch processes are run at the same time \
+              than fit in the available memory.'
+    )
+    parser.add_argument(
+        '--no-prune-assignments',
+        action='store_true',
+        help='With --parallel, try all assignments of state groups to \
+              pipeline stages instead of skipping those that violate \
+              dependencies between state groups or only swap \
+              interchangeable state groups.'
+    )
+    parser.add_argument(
+        '--seed-portfolio',
+        type=int,
+        default=1,
+        help='Number of sketch solver seeds, 1 to N, to race for each \
+              synthesis run. The first successful seed wins and the others \
+              are killed.'
+    )
+    parser.add_argument(
+        '--portfolio-bnd-inbits',
+        type=int,
+        nargs='+',
+        default=[2],
+        help='Input bit widths to race for each synthesis run, together \
+              with the seeds of --seed-portfolio.'
+    )
+    parser.add_argument(
+        '--bv-width',
+        type=int,
+        help='If set, verify with z3 bit vectors of this width, wrapping \
+              around on overflow, instead of unbounded integers. Must be \
+              larger than max_input_bit.'
+    )
+    parser.add_argument(
+        '--num-counterexamples',
+        type=int,
+        default=1,
+        help='Maximum number of diverse counterexamples to add as \
+              testcases after each failed verification.'
+    )
+    parser.add_argument(
+        '--screening-inputs',
+        type=int,
+        default=0,
+        help='If set, simulate each candidate on this many random inputs \
+              and only verify it if the pipeline matches the spec on all \
+              of them. Mismatching inputs are used as counterexamples.'
+    )
+    parser.add_argument(
+        '--exhaustive-verify-limit',
+        type=int,
+        default=EXHAUSTIVE_VERIFY_LIMIT,
+        help='Verify by simulating all inputs instead of with sketch and z3 \
+              if there are at most this many. 0 always uses z3.'
+    )
+    parser.add_argument(
+        '--verify-bit-schedule',
+        type=int,
+        nargs='*',
+        default=VERIFY_BIT_SCHEDULE,
+        help='Input bit widths smaller than max_input_bit to verify \
+              candidates at first, in increasing order. Verification stops \
+              at the first bit width with a counterexample. Pass no values \
+              to only verify at max_input_bit.'
+    )
+    parser.add_argument(
+        '--verify-mode',
+        choices=VERIFY_MODES,
+        default='direct',
+        help='How to build the z3 verification query: directly from the \
+              ALUs, the pipeline and the spec, from the DAG of a verify \
+              sketch, or both, reporting where they disagree and exiting \
+              with 1 if they did. Direct verification falls back to sketch \
+              if the spec is not supported.'
+    )
+    parser.add_argument(
+        '--trace-file',
+        type=str,
+        help='If set, write the wall time, child CPU time and peak child \
+              memory of each iteration and compilation phase to this file, \
+              one JSON object per line.'
+    )
+    parser.add_argument(
+        '--chrome-trace-file',
+        type=str,
+        help='If set, also write the trace of --trace-file in Chrome trace \
+              event format to this file, e.g., for chrome://tracing.'
+    )
+    parser.add_argument(
+        '--synthesis-backend',
+        choices=SYNTHESIS_BACKENDS,
+        default='sketch',
+        help='Synthesize hole values with sketch, or with z3 in this \
+              process, which needs a spec supported by the spec interpreter \
+              and does not support --synthesized-allocation.'
+    )
+    parser.add_argument(
+        '--sketch-fixture-dir',
+        type=str,
+        help='If set, replay sketch results recorded in this directory \
+              instead of running sketch, e.g., to benchmark chipc itself \
+              without sketch.'
+    )
+    parser.add_argument(
+        '--record-sketch-fixtures',
+        action='store_true',
+        help='If set, run sketch when --sketch-fixture-dir has no recorded \
+              result and record it there.'
+    )
 
     args = parser.parse_args(argv[1:])
+    if args.chrome_trace_file is not None and args.trace_file is None:
+        parser.error('--chrome-trace-file requires --trace-file')
+    if args.record_sketch_fixtures and args.sketch_fixture_dir is None:
+        parser.error('--record-sketch-fixtures requires --sketch-fixture-dir')
     # Use program_content to store the program file text rather than using it
     # twice
     program_content = Path(args.spec_filename).read_text()
@@ -243,7 +447,25 @@ def main(argv):
                         constant_set,
                         args.synthesized_allocation,
                         args.pkt_fields, args.state_groups,
-                        args.input_packet)
+                        args.input_packet,
+                        args.shared_alu_definitions,
+                        args.sketch_cache_dir,
+                        args.sketch_cache_size_mb,
+                        args.cpu_budget,
+                        args.sketch_threads,
+                        args.sketch_memory_mb,
+                        not args.no_prune_assignments,
+                        list(range(1, args.seed_portfolio + 1)),
+                        args.portfolio_bnd_inbits,
+                        args.bv_width,
+                        args.num_counterexamples,
+                        args.screening_inputs,
+                        args.exhaustive_verify_limit,
+                        args.verify_mode,
+                        Tracer(args.trace_file),
+                        get_sketch_runner(args.sketch_fixture_dir,
+                                          args.record_sketch_fixtures),
+                        get_synthesis_backend(args.synthesis_backend))
     # Repeatedly run synthesis at 2 bits and verification using all valid ints
     # until either verification succeeds or synthesis fails at 2 bits. Note
     # that the verification with all ints, might not work because sketch only
@@ -254,29 +476,54 @@ def main(argv):
     hole_elimination_assert = []
     additional_testcases = ''
     sol_verify_bit = args.max_input_bit
+    # Candidates are only verified at sol_verify_bit if they pass all
+    # smaller bit widths.
+    verify_bit_schedule = get_verify_bit_schedule(sol_verify_bit,
+                                                  args.verify_bit_schedule)
     while 1:
         print('Iteration #' + str(count))
-        (synthesis_ret_code, output, hole_assignments) = \
-            compiler.parallel_codegen(
+        with compiler.tracer.span('iteration', iteration=count):
+            (synthesis_ret_code, output, hole_assignments) = \
+                compiler.parallel_codegen(
+                    additional_constraints=hole_elimination_assert,
+                    additional_testcases=additional_testcases) \
+                if args.parallel else \
+                compiler.serial_codegen(
+                iter_cnt=count,
                 additional_constraints=hole_elimination_assert,
-                additional_testcases=additional_testcases) \
-            if args.parallel else \
-            compiler.serial_codegen(
-            iter_cnt=count,
-            additional_constraints=hole_elimination_assert,
-            additional_testcases=additional_testcases)
+                additional_testcases=additional_testcases)
+
+            if synthesis_ret_code == 0:
+                print('Synthesis succeeded with 2 bits, proceeding to '
+                      'verification.')
+                # Screening is much cheaper than verification and rejects
+                # most wrong candidates.
+                counterexamples = compiler.screen(
+                    hole_assignments, sol_verify_bit, iter_cnt=count)
+                if counterexamples:
+                    print('Screening found', len(counterexamples),
+                          'counterexamples, skipping verification.')
+                else:
+                    counterexamples, _ = compiler.verify_progressively(
+                        hole_assignments, verify_bit_schedule,
+                        iter_cnt=count
+                    )
 
         if synthesis_ret_code != 0:
             compilation_failure(sketch_name, output)
+            print_sketch_cache_stats(compiler)
+            print_verify_disagreements(compiler)
+            finish_trace(args.trace_file, args.chrome_trace_file)
             return 1
 
-        print('Synthesis succeeded with 2 bits, proceeding to verification.')
-        pkt_fields, state_vars = compiler.verify(
-            hole_assignments, sol_verify_bit, iter_cnt=count
-        )
-
-        if len(pkt_fields) == 0 and len(state_vars) == 0:
+        if all(len(pkt_fields) == 0 and len(state_vars) == 0
+               for pkt_fields, state_vars in counterexamples):
             compilation_success(sketch_name, hole_assignments, output)
+            print_sketch_cache_stats(compiler)
+            finish_trace(args.trace_file, args.chrome_trace_file)
+            # A bug in one of the verifiers, even if the candidate is right.
+            if print_verify_disagreements(compiler):
+                return 1
             return 0
 
         print('Verification failed.')
@@ -289,31 +536,40 @@ def main(argv):
                 hole_assignments)
             print(hole_elimination_assert)
         else:
-            print('Use returned counterexamples', pkt_fields, state_vars)
-
-            # compiler.constant_set will be in the form "0,1,2,3"
-
-            # Get the value of counterexample and add them into constant_set
-            for _, value in pkt_fields.items():
-                value_str = str(value)
-                constant_set.add(value_str)
-            for _, value in state_vars.items():
-                value_str = str(value)
-                constant_set.add(value_str)
+            # With --num-counterexamples, all counterexamples of this
+            # iteration become testcases for the next synthesis.
+            for i, (pkt_fields, state_vars) in enumerate(counterexamples):
+                print('Use returned counterexamples', pkt_fields, state_vars)
+
+                # compiler.constant_set will be in the form "0,1,2,3"
+
+                # Get the value of counterexample and add them into
+                # constant_set
+                for _, value in pkt_fields.items():
+                    value_str = str(value)
+                    constant_set.add(value_str)
+                for _, value in state_vars.items():
+                    value_str = str(value)
+                    constant_set.add(value_str)
+
+                pkt_fields, state_vars = set_default_values(
+                    pkt_fields, state_vars, num_fields_in_prog,
+                    state_group_info
+                )
+
+                # Testcase variables need unique names.
+                testcase_id = count if i == 0 else str(count) + '_' + str(i)
+                additional_testcases += generate_counterexample_asserts(
+                    pkt_fields, state_vars, num_fields_in_prog,
+                    state_group_info, testcase_id, args.pkt_fields,
+                    args.state_groups, group_size)
 
             # Print the updated constant_array just for debugging
             print('updated constant array', constant_set)
 
             # Add constant set to compiler for next synthesis.
             compiler.update_constants_for_synthesis(constant_set)
-
-            pkt_fields, state_vars = set_default_values(
-                pkt_fields, state_vars, num_fields_in_prog, state_group_info
-            )
-
-            additional_testcases += generate_counterexample_asserts(
-                pkt_fields, state_vars, num_fields_in_prog, state_group_info,
-                count, args.pkt_fields, args.state_groups, group_size)
+            compiler.add_counterexamples(counterexamples)
 
         count += 1
 
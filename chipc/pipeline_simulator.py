@@ -0,0 +1,612 @@
+"""Vectorized simulation of a pipeline with concrete hole values"""
+import operator
+from collections import OrderedDict
+
+import numpy as np
+from overrides import overrides
+
+from chipc.alu_cache import get_alu_parse_tree
+from chipc.aluParser import aluParser
+from chipc.aluVisitor import aluVisitor
+
+
+def to_int(value):
+    value = np.asarray(value)
+    if value.dtype == np.bool_:
+        return value.astype(np.int64)
+    return value
+
+
+def to_bool(value):
+    value = np.asarray(value)
+    if value.dtype == np.bool_:
+        return value
+    return value != 0
+
+
+def mux(inputs, ctrl):
+    """Same as the n-to-1 muxes in mux.j2, control values past the last input
+    pick the last input."""
+    return inputs[min(ctrl, len(inputs) - 1)]
+
+
+def divide(dividend, divisor):
+    # Sketch divides like C, rounding towards zero, while numpy rounds down.
+    # Division by zero yields zero instead of a warning.
+    dividend, divisor = to_int(dividend), to_int(divisor)
+    safe_divisor = np.where(divisor == 0, 1, divisor)
+    quotient = np.abs(dividend) // np.abs(safe_divisor)
+    quotient = quotient * np.sign(dividend) * np.sign(safe_divisor)
+    return np.where(divisor == 0, 0, quotient)
+
+
+def remainder(dividend, divisor):
+    # Takes the sign of the dividend like C.
+    return to_int(dividend) - divide(dividend, divisor) * to_int(divisor)
+
+
+class NumpyOperations:
+    """Operations on the values of a simulation, numpy arrays with one
+    element per input. Other implementations, e.g.,
+    z3_pipeline.Z3Operations, evaluate the same ALUs and specs on other
+    kinds of values."""
+    to_int = staticmethod(to_int)
+    to_bool = staticmethod(to_bool)
+    where = staticmethod(np.where)
+    logical_not = staticmethod(np.logical_not)
+    logical_and = staticmethod(np.logical_and)
+    logical_or = staticmethod(np.logical_or)
+    logical_xor = staticmethod(np.logical_xor)
+    divide = staticmethod(divide)
+    remainder = staticmethod(remainder)
+    mux = staticmethod(mux)
+    get_hole_value = staticmethod(int)
+
+    def get_constants(self, constants):
+        return [int(c) for c in constants]
+
+    def get_batch_size(self, values):
+        return np.broadcast(*(list(values) + [np.zeros(1)])).size
+
+    def broadcast(self, value, batch_size):
+        """Returns the integer value, or array of values, for each input."""
+        return np.broadcast_to(np.asarray(to_int(value), dtype=np.int64),
+                               (batch_size,))
+
+    def full(self, value, batch_size):
+        """Returns an array of batch_size elements, all set to the int or
+        bool value."""
+        return np.full(batch_size, value)
+
+
+NUMPY_OPERATIONS = NumpyOperations()
+
+
+def get_seq_names(seq_ctx):
+    """Returns the comma separated names in a state_var_seq, hole_seq or
+    packet_field_seq."""
+    text = seq_ctx.getText()
+    return text.split(',') if text else []
+
+
+class AluSimulator(aluVisitor):
+    """Evaluates an ALU file on a batch of inputs at once. By default every
+    value is a numpy array with one element per input, other operations
+    give other kinds of values, e.g., z3 expressions. Branches are evaluated
+    for all inputs, and assignments only take effect for the inputs whose
+    conditions hold, so every expression is visited exactly once per
+    evaluation. This is also the order in which the sketch ALU visitors
+    number holes, so holes are found under the same names.
+
+    Only the ALU filename is kept between evaluations, so that instances can
+    be pickled along with the Compiler."""
+
+    def __init__(self, alu_filename, operations=NUMPY_OPERATIONS):
+        self.alu_filename = alu_filename
+        self.operations = operations
+        tree = get_alu_parse_tree(alu_filename)
+        self.is_stateful = \
+            tree.state_indicator().getChild(2).getText() == 'stateful'
+        self.state_vars = get_seq_names(tree.state_var_def().state_var_seq())
+        self.hole_vars = get_seq_names(tree.hole_def().hole_seq())
+        self.packet_fields = get_seq_names(
+            tree.packet_field_def().packet_field_seq())
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Drop whatever is left of the last evaluation.
+        return {key: state[key] for key in
+                ['alu_filename', 'operations', 'is_stateful', 'state_vars',
+                 'hole_vars', 'packet_fields']}
+
+    def evaluate(self, get_hole, constants, packet_operands, state_operands,
+                 batch_size):
+        """Evaluates the ALU and returns a tuple of its return value and the
+        list of its updated state variables. Afterwards, failed is whether
+        each input reached assert(false).
+
+        Args:
+            get_hole: A function returning the value of a hole given its name
+                local to the ALU, e.g., opcode or Mux3_0.
+            constants: The constant vector, indexed by C() and
+                immediate_operand holes.
+            packet_operands: Values of the packet fields of the ALU.
+            state_operands: Values of the state variables of the ALU.
+        """
+        assert len(packet_operands) == len(self.packet_fields)
+        assert len(state_operands) == len(self.state_vars)
+        ops = self.operations
+        self.get_hole = get_hole
+        self.constants = constants
+        self.counts = {}
+        self.env = {}
+        for name, value in zip(self.packet_fields + self.state_vars,
+                               list(packet_operands) + list(state_operands)):
+            self.env[name] = ops.broadcast(value, batch_size)
+        for name in self.hole_vars:
+            value = get_hole(name)
+            if name == 'immediate_operand':
+                value = constants[value]
+            self.env[name] = value
+        self.mask = ops.full(True, batch_size)
+        self.returned = ops.full(False, batch_size)
+        self.failed = ops.full(False, batch_size)
+        self.return_value = ops.full(0, batch_size)
+        # State variables are only written back by return statements, like
+        # in the sketch stateful ALU.
+        self.returned_state = [self.env[name] for name in self.state_vars]
+
+        self.visit(get_alu_parse_tree(self.alu_filename).alu_body())
+        return (self.return_value, self.returned_state)
+
+    def next_hole(self, kind):
+        """Returns the value of the next hole of kind, e.g., Mux3 or
+        rel_op."""
+        count = self.counts.get(kind, 0)
+        self.counts[kind] = count + 1
+        return self.get_hole(kind + '_' + str(count))
+
+    def get_active(self):
+        """Returns whether assignments take effect for each input."""
+        ops = self.operations
+        return ops.logical_and(self.mask, ops.logical_not(self.returned))
+
+    def assign(self, name, value):
+        ops = self.operations
+        self.env[name] = ops.where(self.get_active(), ops.to_int(value),
+                                   ops.to_int(self.env.get(name, 0)))
+
+    def visit_operands(self, ctx):
+        return [self.visit(child) for child in ctx.getTypedRuleContexts(
+            aluParser.ExprContext)]
+
+    @overrides
+    def visitAlu_body(self, ctx):
+        for statement in ctx.statement():
+            self.visit(statement)
+
+    @overrides
+    def visitStmtUpdateExpr(self, ctx):
+        self.assign(ctx.variable().getText(), self.visit(ctx.expr()))
+
+    @overrides
+    def visitStmtUpdateTempInt(self, ctx):
+        self.assign(ctx.temp_var().getText(), self.visit(ctx.expr()))
+
+    @overrides
+    def visitStmtUpdateTempBit(self, ctx):
+        self.assign(ctx.temp_var().getText(),
+                    self.operations.to_bool(self.visit(ctx.expr())))
+
+    @overrides
+    def visitStmtReturn(self, ctx):
+        self.visit(ctx.return_statement())
+
+    @overrides
+    def visitReturn_statement(self, ctx):
+        ops = self.operations
+        value = self.visit(ctx.expr())
+        active = self.get_active()
+        self.return_value = ops.where(active, ops.to_int(value),
+                                      self.return_value)
+        self.returned_state = [
+            ops.where(active, self.env[name], old_value)
+            for name, old_value in zip(self.state_vars, self.returned_state)]
+        self.returned = ops.logical_or(self.returned, active)
+
+    @overrides
+    def visitStmtIfElseIfElse(self, ctx):
+        ops = self.operations
+        outer_mask = self.mask
+        remaining = outer_mask
+        for block in ctx.condition_block():
+            condition = ops.to_bool(self.visit(block.expr()))
+            self.mask = ops.logical_and(remaining, condition)
+            self.visit(block.alu_body())
+            remaining = ops.logical_and(remaining, ops.logical_not(condition))
+        if ctx.else_body is not None:
+            self.mask = remaining
+            self.visit(ctx.else_body)
+        self.mask = outer_mask
+
+    @overrides
+    def visitAssertFalse(self, ctx):
+        # Like a failing assert in sketch, this rejects the candidate for
+        # the inputs reaching it.
+        self.failed = self.operations.logical_or(self.failed,
+                                                 self.get_active())
+
+    @overrides
+    def visitVar(self, ctx):
+        return self.env[ctx.getText()]
+
+    @overrides
+    def visitNum(self, ctx):
+        return int(ctx.getText())
+
+    @overrides
+    def visitTrue(self, ctx):
+        return True
+
+    @overrides
+    def visitExprWithParen(self, ctx):
+        return self.visit(ctx.expr())
+
+    @overrides
+    def visitExprWithOp(self, ctx):
+        operand1, operand2 = self.visit_int_operands(ctx)
+        op = ctx.op.text
+        if op == '+':
+            return operand1 + operand2
+        elif op == '-':
+            return operand1 - operand2
+        elif op == '*':
+            return operand1 * operand2
+        else:
+            return self.operations.divide(operand1, operand2)
+
+    def visit_int_operands(self, ctx):
+        return [self.operations.to_int(x) for x in self.visit_operands(ctx)]
+
+    def visit_bool_operands(self, ctx):
+        return [self.operations.to_bool(x) for x in self.visit_operands(ctx)]
+
+    def compare(self, ctx, compare_function):
+        operand1, operand2 = self.visit_int_operands(ctx)
+        return compare_function(operand1, operand2)
+
+    @overrides
+    def visitEquals(self, ctx):
+        return self.compare(ctx, operator.eq)
+
+    @overrides
+    def visitGreater(self, ctx):
+        return self.compare(ctx, operator.gt)
+
+    @overrides
+    def visitGreaterEqual(self, ctx):
+        return self.compare(ctx, operator.ge)
+
+    @overrides
+    def visitLess(self, ctx):
+        return self.compare(ctx, operator.lt)
+
+    @overrides
+    def visitLessEqual(self, ctx):
+        return self.compare(ctx, operator.le)
+
+    @overrides
+    def visitNotEqual(self, ctx):
+        return self.compare(ctx, operator.ne)
+
+    @overrides
+    def visitAnd(self, ctx):
+        return self.operations.logical_and(*self.visit_bool_operands(ctx))
+
+    @overrides
+    def visitOr(self, ctx):
+        return self.operations.logical_or(*self.visit_bool_operands(ctx))
+
+    @overrides
+    def visitNOT(self, ctx):
+        return self.operations.logical_not(
+            self.operations.to_bool(self.visit(ctx.expr())))
+
+    @overrides
+    def visitTernary(self, ctx):
+        ops = self.operations
+        condition, yes_val, no_val = self.visit_operands(ctx)
+        return ops.where(ops.to_bool(condition), ops.to_int(yes_val),
+                         ops.to_int(no_val))
+
+    def visit_mux(self, ctx, kind):
+        inputs = self.visit_operands(ctx)
+        return self.operations.mux(inputs, self.next_hole(kind))
+
+    @overrides
+    def visitMux2(self, ctx):
+        return self.visit_mux(ctx, 'Mux2')
+
+    @overrides
+    def visitMux3(self, ctx):
+        return self.visit_mux(ctx, 'Mux3')
+
+    @overrides
+    def visitMux3WithNum(self, ctx):
+        # The constant is the third input, see SketchStatefulAluVisitor.
+        inputs = self.visit_operands(ctx) + [int(ctx.getChild(6).getText())]
+        return self.operations.mux(inputs, self.next_hole('Mux3'))
+
+    @overrides
+    def visitMux4(self, ctx):
+        return self.visit_mux(ctx, 'Mux4')
+
+    @overrides
+    def visitMux5(self, ctx):
+        return self.visit_mux(ctx, 'Mux5')
+
+    @overrides
+    def visitOpt(self, ctx):
+        operand = self.visit(ctx.expr())
+        # Any value but 0 zeroes the operand.
+        return self.operations.mux([operand, 0], self.next_hole('Opt'))
+
+    @overrides
+    def visitConstant(self, ctx):
+        return self.constants[self.next_hole('const')]
+
+    @overrides
+    def visitRelOp(self, ctx):
+        operand1, operand2 = self.visit_int_operands(ctx)
+        return self.operations.mux(
+            [operand1 != operand2, operand1 < operand2, operand1 > operand2,
+             operand1 == operand2], self.next_hole('rel_op'))
+
+    @overrides
+    def visitBoolOp(self, ctx):
+        ops = self.operations
+        op1, op2 = self.visit_bool_operands(ctx)
+        not_ = ops.logical_not
+        and_ = ops.logical_and
+        or_ = ops.logical_or
+        xor = ops.logical_xor
+        # Same truth tables as generateBoolOp in SketchStatefulAluVisitor.
+        results = [and_(op1, False), not_(or_(op1, op2)), and_(not_(op1), op2),
+                   not_(op1), and_(op1, not_(op2)), not_(op2), xor(op1, op2),
+                   not_(and_(op1, op2)), and_(op1, op2), not_(xor(op1, op2)),
+                   op2, or_(not_(op1), op2), op1, or_(op1, not_(op2)),
+                   or_(op1, op2), or_(op1, True)]
+        return ops.mux(results, self.next_hole('bool_op'))
+
+    @overrides
+    def visitArithOp(self, ctx):
+        operand1, operand2 = self.visit_int_operands(ctx)
+        return self.operations.mux([operand1 + operand2, operand1 - operand2],
+                                   self.next_hole('arith_op'))
+
+    @overrides
+    def visitComputeAlu(self, ctx):
+        op1, op2 = self.visit_int_operands(ctx)
+        return self.operations.mux([op1 + op2, op1 - op2, op2 - op1, op2, op1,
+                                    0, 1], self.next_hole('compute_alu'))
+
+
+class PipelineSimulator:
+    """Simulates the pipeline generated by a SketchCodeGenerator, i.e., the
+    pipeline function in router_data_path_sketch.j2, for concrete hole value
+    assignments on a batch of packets and states at once. This is much
+    cheaper than running sketch and z3, so candidates can be screened on many
+    inputs before they are verified. With other operations, values can also
+    be, e.g., z3 expressions, see AluSimulator, and so can holes whose values
+    are still to be synthesized, see z3_synthesis.Z3Backend."""
+
+    def __init__(self, sketch_code_generator, operations=NUMPY_OPERATIONS):
+        generator = sketch_code_generator
+        self.operations = operations
+        self.sketch_name = generator.sketch_name_
+        self.num_pipeline_stages = generator.num_pipeline_stages_
+        self.num_alus_per_stage = generator.num_alus_per_stage_
+        self.num_phv_containers = generator.num_phv_containers_
+        self.num_state_groups = generator.num_state_groups_
+        self.input_packet_fields = generator.input_packet_fields_
+        self.output_packet_fields = generator.output_packet_fields_
+        self.output_state_groups = generator.output_state_groups_
+        self.synthesized_allocation = generator.synthesized_allocation_
+        self.stateless_alu = AluSimulator(generator.stateless_alu_filename_,
+                                          operations)
+        self.stateful_alu = AluSimulator(generator.stateful_alu_filename_,
+                                         operations)
+        self.num_state_slots = len(self.stateful_alu.state_vars)
+
+    def get_state_var_names(self, state_group):
+        return ['state_group_' + str(state_group) + '_state_' + str(slot)
+                for slot in range(self.num_state_slots)]
+
+    def simulate(self, hole_assignments, constants, pkt_fields, state_vars):
+        """Runs a batch of packets through the pipeline.
+
+        Args:
+            hole_assignments: A dict from hole names to values, as returned
+                by Compiler.single_codegen_run.
+            constants: The constant vector of the sketch.
+            pkt_fields: A dict from packet field names, e.g., pkt_0, to
+                arrays of their values.
+            state_vars: A dict from state variable names, e.g.,
+                state_group_0_state_0, to arrays of their values.
+
+        Returns:
+            A tuple of two dicts like pkt_fields and state_vars with the
+            values after the pipeline.
+        """
+        pkt_fields, state_vars, _ = self.simulate_with_failures(
+            hole_assignments, constants, pkt_fields, state_vars)
+        return (pkt_fields, state_vars)
+
+    def simulate_with_failures(self, hole_assignments, constants, pkt_fields,
+                               state_vars):
+        """Same as simulate, but also returns whether each input reached
+        assert(false) in an ALU as the third element of the tuple."""
+        ops = self.operations
+        constants = ops.get_constants(constants)
+        batch_size = ops.get_batch_size(list(pkt_fields.values()) +
+                                        list(state_vars.values()))
+        zeros = ops.full(0, batch_size)
+        failed = ops.full(False, batch_size)
+
+        def get_hole(name):
+            return ops.get_hole_value(
+                hole_assignments[self.sketch_name + '_' + name])
+
+        pkt_fields = OrderedDict(
+            (name, ops.broadcast(value, batch_size))
+            for name, value in pkt_fields.items())
+        state_vars = OrderedDict(
+            (name, ops.broadcast(value, batch_size))
+            for name, value in state_vars.items())
+
+        inputs = [zeros] * self.num_phv_containers
+        for index, field in enumerate(self.input_packet_fields):
+            value = pkt_fields['pkt_' + str(field)]
+            if not self.synthesized_allocation:
+                inputs[index] = value
+                continue
+            for container in range(self.num_phv_containers):
+                # phv_config holes don't have the sketch name prefix.
+                if int(hole_assignments['phv_config_' + str(field) + '_' +
+                                        str(container)]) == 1:
+                    inputs[container] = value
+
+        if self.synthesized_allocation:
+            num_stateful_alus = self.num_phv_containers
+        else:
+            num_stateful_alus = self.num_state_groups
+
+        # Inputs of each stage are the outputs of the previous one.
+        outputs = inputs
+        for stage in range(self.num_pipeline_stages):
+            inputs = outputs
+            destinations = []
+            for alu in range(self.num_alus_per_stage):
+                destinations.append(self.simulate_stateless_alu(
+                    'stateless_alu_' + str(stage) + '_' + str(alu), get_hole,
+                    constants, inputs, batch_size))
+                failed = ops.logical_or(failed, self.stateless_alu.failed)
+
+            # State groups each stateful ALU may read, if any, and whether it
+            # does, which is a formula if the salu_config holes are unknowns.
+            allocated_groups = [None] * num_stateful_alus
+            allocated = [False] * num_stateful_alus
+            for group in range(self.num_state_groups):
+                if self.synthesized_allocation:
+                    for container in range(self.num_phv_containers):
+                        if get_hole('salu_config_' + str(group) + '_' +
+                                    str(stage) + '_' + str(container)) == 1:
+                            allocated_groups[container] = group
+                            allocated[container] = True
+                else:
+                    allocated_groups[group] = group
+                    allocated[group] = get_hole('salu_config_' + str(stage) +
+                                                '_' + str(group)) == 1
+
+            returned_values = []
+            returned_states = []
+            for salu in range(num_stateful_alus):
+                salu_name = 'stateful_alu_' + str(stage) + '_' + str(salu)
+                packet_operands = [
+                    ops.mux(inputs, get_hole(salu_name + '_operand_mux_' +
+                                             str(operand) + '_ctrl'))
+                    for operand in range(
+                        len(self.stateful_alu.packet_fields))]
+                if allocated_groups[salu] is None:
+                    state_operands = [zeros] * self.num_state_slots
+                else:
+                    state_operands = [
+                        self.choose(allocated[salu], state_vars[name], zeros)
+                        for name in
+                        self.get_state_var_names(allocated_groups[salu])]
+                returned_value, returned_state = self.stateful_alu.evaluate(
+                    lambda hole: get_hole(salu_name + '_' + hole + '_global'),
+                    constants, packet_operands, state_operands, batch_size)
+                returned_values.append(returned_value)
+                returned_states.append(returned_state)
+                failed = ops.logical_or(failed, self.stateful_alu.failed)
+
+            outputs = []
+            for container in range(self.num_phv_containers):
+                mux_inputs = [value for value in returned_values
+                              for _ in range(self.num_state_slots)]
+                mux_inputs.append(destinations[container])
+                outputs.append(ops.mux(
+                    mux_inputs,
+                    get_hole('output_mux_phv_' + str(stage) + '_' +
+                             str(container) + '_ctrl')))
+
+            for salu, group in enumerate(allocated_groups):
+                if group is None:
+                    continue
+                for name, value in zip(self.get_state_var_names(group),
+                                       returned_states[salu]):
+                    state_vars[name] = self.choose(allocated[salu], value,
+                                                   state_vars[name])
+
+        for index, field in enumerate(self.output_packet_fields):
+            name = 'pkt_' + str(field)
+            if not self.synthesized_allocation:
+                pkt_fields[name] = outputs[index]
+                continue
+            for container in range(self.num_phv_containers):
+                if int(hole_assignments['phv_config_' + str(field) + '_' +
+                                        str(container)]) == 1:
+                    pkt_fields[name] = outputs[container]
+
+        return (pkt_fields, state_vars, failed)
+
+    def choose(self, condition, yes_val, no_val):
+        # Conditions on concrete holes are decided right away.
+        if isinstance(condition, bool):
+            return yes_val if condition else no_val
+        return self.operations.where(condition, yes_val, no_val)
+
+    def simulate_stateless_alu(self, alu_name, get_hole, constants, inputs,
+                               batch_size):
+        packet_operands = [
+            self.operations.mux(inputs, get_hole(
+                alu_name + '_operand_mux_' + str(index) + '_ctrl'))
+            for index in range(len(self.stateless_alu.packet_fields))]
+        return_value, _ = self.stateless_alu.evaluate(
+            lambda hole: get_hole(alu_name + '_' + hole),
+            constants, packet_operands, [], batch_size)
+        return return_value
+
+    def get_mismatches(self, hole_assignments, constants, pkt_fields,
+                       state_vars, expected_pkt_fields, expected_state_vars):
+        """Simulates the pipeline and returns the indices of the inputs for
+        which an output packet field or output state group differs from the
+        expected values, e.g., computed by the spec, or which reach
+        assert(false) in an ALU."""
+        result_pkt_fields, result_state_vars, failed = \
+            self.simulate_with_failures(hole_assignments, constants,
+                                        pkt_fields, state_vars)
+        mismatch = np.zeros(1, dtype=np.bool_) | failed
+        for field in self.output_packet_fields:
+            name = 'pkt_' + str(field)
+            mismatch = mismatch | (result_pkt_fields[name] !=
+                                   expected_pkt_fields[name])
+        for group in self.output_state_groups:
+            for name in self.get_state_var_names(group):
+                mismatch = mismatch | (result_state_vars[name] !=
+                                       expected_state_vars[name])
+        return np.flatnonzero(mismatch)
+
+
+def get_counterexample(pkt_fields, state_vars, index):
+    """Returns the input at index of a batch as a counterexample tuple, like
+    Compiler.verify does."""
+    def get_value(value):
+        value = np.asarray(value)
+        return int(value if value.ndim == 0 else value[index])
+
+    return (OrderedDict((name, get_value(value))
+                        for name, value in pkt_fields.items()),
+            OrderedDict((name, get_value(value))
+                        for name, value in state_vars.items()))
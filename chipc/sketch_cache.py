@@ -0,0 +1,105 @@
+"""Content-addressed on-disk cache for sketch results"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+
+
+@lru_cache(maxsize=None)
+def get_sketch_version():
+    """Returns a string identifying the sketch installation in PATH. We use
+    the resolved path, size and modification time of the sketch executable
+    instead of asking sketch itself, which would start a JVM."""
+    sketch_binary = shutil.which('sketch')
+    if sketch_binary is None:
+        return 'sketch-not-found'
+    sketch_binary = os.path.realpath(sketch_binary)
+    stat = os.stat(sketch_binary)
+    return '%s:%d:%d' % (sketch_binary, stat.st_size, stat.st_mtime)
+
+
+class SketchCache:
+    """Stores results of sketch invocations in cache_dir, one JSON file per
+    key. Keys are hashes of the sketch file content, the sketch flags and the
+    sketch version, so identical sketch files are only run once across
+    iterations, parallel workers and separate runs.
+
+    The total size of the cache is bounded by max_size_bytes. When it is
+    exceeded, least recently used entries are evicted first. Use is tracked
+    with file modification times, which are updated on every hit.
+    """
+
+    def __init__(self, cache_dir, max_size_bytes=1024 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size_bytes = max_size_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_key(self, sketch_file_name, flags):
+        """Returns the cache key for running sketch with the given flags on
+        sketch_file_name."""
+        sha = hashlib.sha256()
+        sha.update(Path(sketch_file_name).read_bytes())
+        for item in [get_sketch_version()] + [str(flag) for flag in flags]:
+            sha.update(b'\0' + item.encode('utf-8'))
+        return sha.hexdigest()
+
+    def get_entry_path(self, key):
+        return self.cache_dir / (key + '.json')
+
+    def get(self, key):
+        """Returns the cached value for key, or None if there is none."""
+        entry_path = self.get_entry_path(key)
+        try:
+            value = json.loads(entry_path.read_text())
+            # Mark the entry as recently used.
+            os.utime(str(entry_path))
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Stores value, which must be serializable to JSON, for key."""
+        # Write to a temporary file first and rename it, so that concurrent
+        # readers never see a partially written entry.
+        fd, tmp_name = tempfile.mkstemp(dir=str(self.cache_dir),
+                                        suffix='.tmp')
+        with os.fdopen(fd, 'w') as tmp_file:
+            json.dump(value, tmp_file)
+        os.replace(tmp_name, str(self.get_entry_path(key)))
+        self.evict()
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits in
+        max_size_bytes."""
+        entries = []
+        total_size = 0
+        for entry_path in self.cache_dir.glob('*.json'):
+            try:
+                stat = entry_path.stat()
+            except OSError:
+                # Removed by another process in the meantime.
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+            total_size += stat.st_size
+
+        for _, size, entry_path in sorted(entries, key=lambda x: x[0]):
+            if total_size <= self.max_size_bytes:
+                break
+            try:
+                entry_path.unlink()
+                self.evictions += 1
+            except OSError:
+                pass
+            total_size -= size
+
+    def get_stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
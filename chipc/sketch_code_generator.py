@@ -1,11 +1,9 @@
+import re
 from collections import OrderedDict
+from functools import partial
 from pathlib import Path
 
-from antlr4 import CommonTokenStream
-from antlr4 import FileStream
-
-from chipc.aluLexer import aluLexer
-from chipc.aluParser import aluParser
+from chipc.alu_cache import get_alu_parse_tree
 from chipc.mode import Mode
 from chipc.sketch_stateful_alu_visitor import SketchStatefulAluVisitor
 from chipc.sketch_stateless_alu_visitor import SketchStatelessAluVisitor
@@ -22,6 +20,22 @@ def add_prefix_suffix(text, prefix_string, suffix_string):
     return prefix_string + str(text) + suffix_string
 
 
+# Attributes filled in by add_hole and add_assert. They are saved along with
+# the cached hardware definitions and restored on a cache hit.
+HOLE_AND_ASSERT_ATTRIBUTES = ['total_hole_bits_', 'hole_names_',
+                              'hole_preamble_', 'hole_arguments_', 'holes_',
+                              'asserts_', 'constraints_']
+
+# Template arguments that change between iterations. Cached sketches are
+# rendered with these placeholders, which are then replaced by actual values.
+PER_ITERATION_PLACEHOLDERS = OrderedDict([
+    ('hole_definitions', '__chipc_hole_definitions__'),
+    ('hole_assignments', '__chipc_hole_assignments__'),
+    ('additional_constraints', '__chipc_additional_constraints__'),
+    ('additional_testcases', '__chipc_additional_testcases__'),
+])
+
+
 # Sketch Generator class
 class SketchCodeGenerator:
     def __init__(self, sketch_name, num_phv_containers, num_state_groups,
@@ -29,7 +43,8 @@ class SketchCodeGenerator:
                  output_packet_fields, output_state_groups,
                  jinja2_env, stateful_alu_filename,
                  stateless_alu_filename, constant_set,
-                 synthesized_allocation, input_packet_fields):
+                 synthesized_allocation, input_packet_fields,
+                 shared_alu_definitions=False):
         self.sketch_name_ = sketch_name
         self.total_hole_bits_ = 0
         self.hole_names_ = []
@@ -63,6 +78,19 @@ class SketchCodeGenerator:
         self.num_state_slots_ = 0
         self.synthesized_allocation_ = synthesized_allocation
         self.input_packet_fields_ = input_packet_fields
+        # If set, emit a single definition for the stateless ALU and a single
+        # one for the stateful ALU, and pass each slot's holes as arguments
+        # instead of emitting one copy of the ALU per pipeline slot.
+        self.shared_alu_definitions_ = shared_alu_definitions
+        # Only the constant vector, additional constraints and testcases
+        # change between iterations. Cache the generated hardware, keyed by
+        # the constant array hole width, and the rendered sketch with
+        # placeholders for the per-iteration parts.
+        self.hardware_cache_ = {}
+        # Numbers of inputs of all muxes used in the sketch. A single mux
+        # function is emitted per number of inputs.
+        self.mux_arities_ = set()
+        self.rendered_sketch_cache_ = {}
 
     def reset_holes_and_asserts(self):
         self.total_hole_bits_ = 0
@@ -92,22 +120,18 @@ class SketchCodeGenerator:
         self.asserts_ += 'assert(' + assert_predicate + ');\n'
         self.constraints_ += [assert_predicate]
 
-    # Generate Sketch code for a simple stateless alu (+,-,*,/)
-    def generate_stateless_alu(self, alu_name, potential_operands):
-        # Grab the stateless alu file name by using
-        input_stream = FileStream(self.stateless_alu_filename_)
-        lexer = aluLexer(input_stream)
-        stream = CommonTokenStream(lexer)
-        parser = aluParser(stream)
-        tree = parser.alu()
+    # Run the stateless ALU visitor for alu_name, generate_stateless_mux is
+    # called back for each operand mux inside the ALU.
+    def visit_stateless_alu(self, alu_name, potential_operands,
+                            generate_stateless_mux):
+        # The parse tree is shared across all stateless ALUs and iterations.
+        tree = get_alu_parse_tree(self.stateless_alu_filename_)
 
         sketch_stateless_alu_visitor = \
             SketchStatelessAluVisitor(
-                self.stateless_alu_filename_, self.sketch_name_ + '_' +
-                alu_name, potential_operands, self.generate_mux,
-                self.constant_arr_size_)
+                self.stateless_alu_filename_, alu_name, potential_operands,
+                generate_stateless_mux, self.constant_arr_size_)
         sketch_stateless_alu_visitor.visit(tree)
-        self.add_holes(sketch_stateless_alu_visitor.global_holes)
         self.stateless_alu_hole_arguments_ = [
             x for x in sorted(
                 sketch_stateless_alu_visitor.stateless_alu_args
@@ -116,23 +140,23 @@ class SketchCodeGenerator:
         self.num_stateless_muxes_ = \
             len(sketch_stateless_alu_visitor.packet_fields)
 
+        return sketch_stateless_alu_visitor
+
+    # Generate Sketch code for a simple stateless alu (+,-,*,/)
+    def generate_stateless_alu(self, alu_name, potential_operands):
+        sketch_stateless_alu_visitor = self.visit_stateless_alu(
+            self.sketch_name_ + '_' + alu_name, potential_operands,
+            self.generate_mux)
+        self.add_holes(sketch_stateless_alu_visitor.global_holes)
+
         return (sketch_stateless_alu_visitor.helper_function_strings +
                 sketch_stateless_alu_visitor.main_function)
 
-    # Generate Sketch code for a simple stateful alu (+,-,*,/)
-    # Takes one state and one packet operand (or immediate operand) as inputs
-    # Updates the state in place and returns the old value of the state
-    def generate_stateful_alu(self, alu_name):
-        input_stream = FileStream(self.stateful_alu_filename_)
-        lexer = aluLexer(input_stream)
-        stream = CommonTokenStream(lexer)
-        parser = aluParser(stream)
-        tree = parser.alu()
+    def visit_stateful_alu(self, alu_name):
+        tree = get_alu_parse_tree(self.stateful_alu_filename_)
         sketch_stateful_alu_visitor = SketchStatefulAluVisitor(
-            self.sketch_name_ + '_' + alu_name,
-            self.constant_arr_size_)
+            alu_name, self.constant_arr_size_, self.get_mux_function)
         sketch_stateful_alu_visitor.visit(tree)
-        self.add_holes(sketch_stateful_alu_visitor.global_holes)
         self.stateful_alu_hole_arguments_ = [
             x for x in sorted(sketch_stateful_alu_visitor.alu_args)
         ]
@@ -140,6 +164,16 @@ class SketchCodeGenerator:
             sketch_stateful_alu_visitor.packet_fields)
         self.num_state_slots_ = len(sketch_stateful_alu_visitor.state_vars)
 
+        return sketch_stateful_alu_visitor
+
+    # Generate Sketch code for a simple stateful alu (+,-,*,/)
+    # Takes one state and one packet operand (or immediate operand) as inputs
+    # Updates the state in place and returns the old value of the state
+    def generate_stateful_alu(self, alu_name):
+        sketch_stateful_alu_visitor = self.visit_stateful_alu(
+            self.sketch_name_ + '_' + alu_name)
+        self.add_holes(sketch_stateful_alu_visitor.global_holes)
+
         return (sketch_stateful_alu_visitor.helper_function_strings +
                 sketch_stateful_alu_visitor.main_function)
 
@@ -230,22 +264,34 @@ class SketchCodeGenerator:
             assert_predicate += '0) <= 1'
             self.add_assert(assert_predicate)
 
-    # Sketch code for an n-to-1 mux
-    def generate_mux(self, n, mux_name):
+    # Name of the n-to-1 mux function shared by all muxes with n inputs. Its
+    # definition is emitted once by generate_mux_definitions.
+    def get_mux_function(self, n):
         assert (n >= 1)
-        num_bits = get_hole_bit_width(n)
-        operand_mux_template = self.jinja2_env_.get_template('mux.j2')
-        mux_code = operand_mux_template.render(
-            mux_name=mux_name,
-            operand_list=['input' + str(i) for i in range(0, n)],
-            arg_list=['int input' + str(i) for i in range(0, n)],
-            num_operands=n)
-        self.add_hole(mux_name + '_ctrl', num_bits)
-        return mux_code
+        self.mux_arities_.add(n)
+        return self.sketch_name_ + '_mux' + str(n)
+
+    # Sketch code for all n-to-1 muxes used in the sketch, one per n
+    def generate_mux_definitions(self):
+        mux_template = self.jinja2_env_.get_template('mux.j2')
+        ret = ''
+        for n in sorted(self.mux_arities_):
+            ret += mux_template.render(
+                mux_name=self.get_mux_function(n),
+                operand_list=['input' + str(i) for i in range(0, n)],
+                arg_list=['int input' + str(i) for i in range(0, n)],
+                num_operands=n) + '\n'
+        return ret
+
+    # Add the control hole for an n-to-1 mux instance and return the name of
+    # the mux function to call with it
+    def generate_mux(self, n, mux_name, add_ctrl_hole=True):
+        if add_ctrl_hole:
+            self.add_hole(mux_name + '_ctrl', get_hole_bit_width(n))
+        return self.get_mux_function(n)
 
     # Stateful operand muxes, stateless ones are part of generate_stateless_alu
     def generate_stateful_operand_muxes(self):
-        ret = ''
         # Generate one mux for inputs: num_phv_containers+1 to 1. The +1 is to
         # support constant/immediate operands.
         assert (self.num_operands_to_stateful_alu_ > 0)
@@ -254,20 +300,19 @@ class SketchCodeGenerator:
             if self.synthesized_allocation_:
                 for l in range(self.num_phv_containers_):
                     for k in range(self.num_operands_to_stateful_alu_):
-                        ret += self.generate_mux(
+                        self.generate_mux(
                             self.num_phv_containers_,
                             self.sketch_name_ + '_stateful_alu_' + str(i) +
                             '_' + str(l) + '_' + 'operand_mux_' +
-                            str(k)) + '\n'
+                            str(k))
             else:
                 for l in range(self.num_state_groups_):
                     for k in range(self.num_operands_to_stateful_alu_):
-                        ret += self.generate_mux(
+                        self.generate_mux(
                             self.num_phv_containers_,
                             self.sketch_name_ + '_stateful_alu_' + str(i) +
-                            '_' + str(l) + '_' + 'operand_mux_' + str(k)) +\
-                            '\n'
-        return ret
+                            '_' + str(l) + '_' + 'operand_mux_' + str(k))
+        return self.get_mux_function(self.num_phv_containers_)
 
     # Output muxes to pick between stateful ALUs and stateless ALU
     def generate_output_muxes(self):
@@ -280,25 +325,66 @@ class SketchCodeGenerator:
         # It also doesn't affect the correctness of modeling the output mux
         # because the virtual output mux setting can be translated into the
         # physical output mux setting during post processing.
-        ret = ''
+        if self.synthesized_allocation_:
+            num_mux_inputs = \
+                self.num_phv_containers_ * self.num_state_slots_ + 1
+        else:
+            num_mux_inputs = \
+                self.num_state_groups_ * self.num_state_slots_ + 1
         for i in range(self.num_pipeline_stages_):
             for k in range(self.num_phv_containers_):
                 # synthesized_allocation we give num_phv_containers virtual
                 # stateful alus per stage
-                if self.synthesized_allocation_:
-                    ret += self.generate_mux(
-                        self.num_phv_containers_ * self.num_state_slots_
-                        + 1,
-                        self.sketch_name_ + '_output_mux_phv_' +
-                        str(i) + '_' + str(k)) + '\n'
-                else:
-                    ret += self.generate_mux(
-                        self.num_state_groups_ * self.num_state_slots_ + 1,
-                        self.sketch_name_ + '_output_mux_phv_' +
-                        str(i) + '_' + str(k)) + '\n'
-        return ret
+                self.generate_mux(
+                    num_mux_inputs,
+                    self.sketch_name_ + '_output_mux_phv_' +
+                    str(i) + '_' + str(k))
+        return self.get_mux_function(num_mux_inputs)
+
+    def generate_shared_alus(self):
+        # Generate one stateless and one stateful ALU definition, then add the
+        # holes of every slot under the same names generate_alus would use.
+        potential_operands = [
+            'input' + str(k) for k in range(0, self.num_phv_containers_)]
+        stateless_alu_name = self.sketch_name_ + '_stateless_alu'
+        stateless_alu_visitor = self.visit_stateless_alu(
+            stateless_alu_name, potential_operands,
+            partial(self.generate_mux, add_ctrl_hole=False))
+        stateful_alu_name = self.sketch_name_ + '_stateful_alu'
+        stateful_alu_visitor = self.visit_stateful_alu(stateful_alu_name)
+
+        def add_slot_holes(alu_name, slot_name, global_holes):
+            self.add_holes(OrderedDict(
+                (slot_name + hole[len(alu_name):], width)
+                for hole, width in global_holes.items()))
+
+        if self.synthesized_allocation_:
+            num_stateful_alus = self.num_phv_containers_
+        else:
+            num_stateful_alus = self.num_state_groups_
+        for i in range(self.num_pipeline_stages_):
+            for j in range(self.num_alus_per_stage_):
+                slot_name = stateless_alu_name + '_' + str(i) + '_' + str(j)
+                for k in range(self.num_stateless_muxes_):
+                    self.add_hole(
+                        slot_name + '_operand_mux_' + str(k) + '_ctrl',
+                        get_hole_bit_width(len(potential_operands)))
+                add_slot_holes(stateless_alu_name, slot_name,
+                               stateless_alu_visitor.global_holes)
+            for alu in range(num_stateful_alus):
+                add_slot_holes(stateful_alu_name,
+                               stateful_alu_name + '_' + str(i) + '_' +
+                               str(alu), stateful_alu_visitor.global_holes)
+
+        return (stateless_alu_visitor.helper_function_strings +
+                stateless_alu_visitor.main_function + '\n' +
+                stateful_alu_visitor.helper_function_strings +
+                stateful_alu_visitor.main_function + '\n')
 
     def generate_alus(self):
+        if self.shared_alu_definitions_:
+            return self.generate_shared_alus()
+
         # Generate sketch code for alus and immediate operands in each stage
         ret = ''
         for i in range(self.num_pipeline_stages_):
@@ -319,20 +405,31 @@ class SketchCodeGenerator:
                                                       + '_' + str(l)) + '\n'
         return ret
 
-    def generate_sketch(self, spec_filename, mode, synthesized_allocation,
-                        additional_constraints=[],
-                        hole_assignments=OrderedDict(),
-                        additional_testcases=''):
-        self.reset_holes_and_asserts()
-        assert(mode in [Mode.CODEGEN, Mode.VERIFY])
-        template = self.jinja2_env_.get_template('code_generator.j2')
+    def generate_hardware(self):
+        """Generates ALUs, operand and output muxes, and allocator asserts,
+        which only depend on the pipeline shape and the width of holes
+        indexing the constant vector. The result is cached, so that later
+        calls only restore holes and asserts.
+
+        Returns:
+            A tuple of ALU definitions, mux definitions, and names of the mux
+            functions used for stateful operand muxes and output muxes.
+        """
+        key = self.constant_arr_size_
+        if key in self.hardware_cache_:
+            definitions, saved_attributes = self.hardware_cache_[key]
+            for attribute, value in saved_attributes.items():
+                setattr(self, attribute, value.copy()
+                        if isinstance(value, list) else value)
+            return definitions
 
+        self.reset_holes_and_asserts()
+        self.mux_arities_ = set()
         # Create stateless and stateful ALUs, operand muxes for stateful ALUs,
         # and output muxes.
         alu_definitions = self.generate_alus()
-        stateful_operand_mux_definitions = (
-            self.generate_stateful_operand_muxes())
-        output_mux_definitions = self.generate_output_muxes()
+        stateful_operand_mux = self.generate_stateful_operand_muxes()
+        output_mux = self.generate_output_muxes()
 
         # Create allocator to ensure each state var is assigned to exactly
         # stateful ALU and vice versa.
@@ -342,35 +439,74 @@ class SketchCodeGenerator:
         else:
             self.generate_state_allocator_canonicalized()
 
-        return template.render(
-            mode=mode,
-            synthesized_allocation=synthesized_allocation,
-            sketch_name=self.sketch_name_,
-            spec_filename=spec_filename,
-            num_pipeline_stages=self.num_pipeline_stages_,
-            num_alus_per_stage=self.num_alus_per_stage_,
-            num_phv_containers=self.num_phv_containers_,
+        definitions = (alu_definitions, self.generate_mux_definitions(),
+                       stateful_operand_mux, output_mux)
+        saved_attributes = OrderedDict()
+        for attribute in HOLE_AND_ASSERT_ATTRIBUTES:
+            value = getattr(self, attribute)
+            saved_attributes[attribute] = value.copy() if isinstance(
+                value, list) else value
+        self.hardware_cache_[key] = (definitions, saved_attributes)
+        return definitions
+
+    def generate_sketch(self, spec_filename, mode, synthesized_allocation,
+                        additional_constraints=[],
+                        hole_assignments=OrderedDict(),
+                        additional_testcases=''):
+        assert(mode in [Mode.CODEGEN, Mode.VERIFY])
+        (alu_definitions, mux_definitions, stateful_operand_mux,
+         output_mux) = self.generate_hardware()
+
+        spec_as_sketch = Path(spec_filename).read_text()
+        key = (mode, synthesized_allocation, spec_filename, spec_as_sketch,
+               self.constant_arr_size_)
+        if key not in self.rendered_sketch_cache_:
+            template = self.jinja2_env_.get_template('code_generator.j2')
+            self.rendered_sketch_cache_[key] = template.render(
+                mode=mode,
+                synthesized_allocation=synthesized_allocation,
+                sketch_name=self.sketch_name_,
+                spec_filename=spec_filename,
+                num_pipeline_stages=self.num_pipeline_stages_,
+                num_alus_per_stage=self.num_alus_per_stage_,
+                num_phv_containers=self.num_phv_containers_,
+                mux_definitions=mux_definitions,
+                stateful_operand_mux=stateful_operand_mux,
+                num_stateless_muxes=self.num_stateless_muxes_,
+                output_mux=output_mux,
+                alu_definitions=alu_definitions,
+                num_fields_in_prog=self.num_fields_in_prog_,
+                output_packet_fields=self.output_packet_fields_,
+                output_state_groups=self.output_state_groups_,
+                num_state_groups=self.num_state_groups_,
+                spec_as_sketch=spec_as_sketch,
+                all_assertions=self.asserts_,
+                hole_arguments=self.hole_arguments_,
+                stateful_alu_hole_arguments=self.stateful_alu_hole_arguments_,
+                num_operands_to_stateful_alu=(
+                    self.num_operands_to_stateful_alu_),
+                num_state_slots=self.num_state_slots_,
+                input_packet_fields=self.input_packet_fields_,
+                shared_alu_definitions=self.shared_alu_definitions_,
+                **PER_ITERATION_PLACEHOLDERS)
+
+        per_iteration_values = {
             # Add constant_arr_def to hole_definitions
-            hole_definitions=self.constant_arr_def_ + self.hole_preamble_,
-            stateful_operand_mux_definitions=stateful_operand_mux_definitions,
-            num_stateless_muxes=self.num_stateless_muxes_,
-            output_mux_definitions=output_mux_definitions,
-            alu_definitions=alu_definitions,
-            num_fields_in_prog=self.num_fields_in_prog_,
-            output_packet_fields=self.output_packet_fields_,
-            output_state_groups=self.output_state_groups_,
-            num_state_groups=self.num_state_groups_,
-            spec_as_sketch=Path(spec_filename).read_text(),
-            all_assertions=self.asserts_,
-            hole_arguments=self.hole_arguments_,
-            stateful_alu_hole_arguments=self.stateful_alu_hole_arguments_,
-            num_operands_to_stateful_alu=self.num_operands_to_stateful_alu_,
-            num_state_slots=self.num_state_slots_,
-            additional_constraints='\n'.join(
-                ['assert(' + str(x) + ');' for x in additional_constraints]),
+            'hole_definitions': self.constant_arr_def_ + self.hole_preamble_,
             # Add constant_arr_def to hole_assignments
-            hole_assignments=self.constant_arr_def_ + '\n'.join(
+            'hole_assignments': self.constant_arr_def_ + '\n'.join(
                 ['int ' + str(hole) + ' = ' + str(value) + ';'
                     for hole, value in hole_assignments.items()]),
-            additional_testcases=additional_testcases,
-            input_packet_fields=self.input_packet_fields_)
+            'additional_constraints': '\n'.join(
+                ['assert(' + str(x) + ');' for x in additional_constraints]),
+            'additional_testcases': additional_testcases,
+        }
+        values_by_placeholder = {
+            placeholder: per_iteration_values[name]
+            for name, placeholder in PER_ITERATION_PLACEHOLDERS.items()}
+        # Substitute all placeholders in a single pass, so that values
+        # containing a placeholder by accident are left alone.
+        return re.sub(
+            '|'.join(values_by_placeholder),
+            lambda match: values_by_placeholder[match.group(0)],
+            self.rendered_sketch_cache_[key])
@@ -0,0 +1,142 @@
+"""Compact representation of the sketch DAG intermediate representation"""
+from array import array
+
+# Operations in the sketch IR. Nodes store the index of their operation.
+OPERATIONS = ['S', 'CONST', 'ASSERT', 'NEG', 'NOT', 'AND', 'OR', 'XOR',
+              'PLUS', 'TIMES', 'DIV', 'MOD', 'LT', 'EQ', 'ARRACC', 'ARRASS']
+OPERATION_IDS = {operation: i for i, operation in enumerate(OPERATIONS)}
+
+S = OPERATION_IDS['S']
+CONST = OPERATION_IDS['CONST']
+ASSERT = OPERATION_IDS['ASSERT']
+NEG = OPERATION_IDS['NEG']
+NOT = OPERATION_IDS['NOT']
+AND = OPERATION_IDS['AND']
+OR = OPERATION_IDS['OR']
+XOR = OPERATION_IDS['XOR']
+PLUS = OPERATION_IDS['PLUS']
+TIMES = OPERATION_IDS['TIMES']
+DIV = OPERATION_IDS['DIV']
+MOD = OPERATION_IDS['MOD']
+LT = OPERATION_IDS['LT']
+EQ = OPERATION_IDS['EQ']
+ARRACC = OPERATION_IDS['ARRACC']
+ARRASS = OPERATION_IDS['ARRASS']
+
+UNARY_OPERATIONS = [NEG, NOT]
+BINARY_OPERATIONS = [AND, OR, XOR, PLUS, TIMES, DIV, MOD, LT, EQ]
+
+TYPES = ['INT', 'BOOL']
+TYPE_IDS = {type_name: i for i, type_name in enumerate(TYPES)}
+INT = TYPE_IDS['INT']
+BOOL = TYPE_IDS['BOOL']
+
+# Number of operand slots per node, unused slots are -1.
+NUM_OPERANDS = 3
+
+
+class SketchDag:
+    """Node table of a sketch DAG. Node i's operation, type and constant value
+    are the i-th elements of operations, types and values, and its operands
+    are operands[i * NUM_OPERANDS:(i + 1) * NUM_OPERANDS], as indices of
+    other nodes.
+
+    For CONST nodes the value is the constant, for ARRASS nodes the value the
+    first operand is compared with. Operands of ARRACC nodes are the
+    predicate, the value if false and the value if true. Operands of ARRASS
+    nodes are the compared node, the value if not equal and the value if
+    equal.
+    """
+
+    def __init__(self):
+        self.operations = array('B')
+        self.types = array('B')
+        self.operands = array('l')
+        self.values = array('q')
+        # Node ids of source nodes and their variable names.
+        self.sources = array('l')
+        self.source_names = []
+        # Node ids of the asserted nodes.
+        self.asserts = array('l')
+
+    def __len__(self):
+        return len(self.operations)
+
+    def get_operands(self, node):
+        start = node * NUM_OPERANDS
+        return self.operands[start:start + NUM_OPERANDS]
+
+    def add_node(self, operation, node_type, operands=(), value=0):
+        node = len(self)
+        self.operations.append(operation)
+        self.types.append(node_type)
+        self.operands.extend(list(operands) +
+                             [-1] * (NUM_OPERANDS - len(operands)))
+        self.values.append(value)
+        return node
+
+    def add_line(self, line):
+        """Parses a line of the sketch IR and adds the node in it, if any."""
+        records = line.split()
+        if not records or records[0] in ['dag', 'TUPLE_DEF']:
+            return
+        node = int(records[0])
+        assert node == len(self), (
+            'Expected node', len(self), 'found', line)
+        assert records[2] in OPERATION_IDS, ('Unknown operation:', line)
+        operation = OPERATION_IDS[records[2]]
+
+        if operation == ASSERT:
+            self.add_node(operation, BOOL, [int(records[3])])
+            self.asserts.append(int(records[3]))
+            return
+
+        assert records[3] in TYPE_IDS, ('Type', records[3], 'not supported')
+        node_type = TYPE_IDS[records[3]]
+        if operation == S:
+            assert node_type == INT, (
+                'Unexpected variable type found in sketch IR:', line)
+            self.add_node(operation, node_type)
+            self.sources.append(node)
+            self.source_names.append(records[4])
+        elif operation == CONST:
+            if node_type == BOOL:
+                assert records[4] in ['0', '1']
+            self.add_node(operation, node_type, value=int(records[4]))
+        elif operation in UNARY_OPERATIONS:
+            self.add_node(operation, node_type, [int(records[4])])
+        elif operation in BINARY_OPERATIONS:
+            self.add_node(operation, node_type,
+                          [int(records[4]), int(records[5])])
+        elif operation == ARRACC:
+            # The operation has the form
+            # <predicate> <number of values> <value if 0> <value if 1>.
+            assert records[5] == '2', ('Unsupported ARRACC:', line)
+            self.add_node(operation, node_type,
+                          [int(records[4]), int(records[6]),
+                           int(records[7])])
+        elif operation == ARRASS:
+            # The operation has the form
+            # <node> == <constant> <value if not equal> <value if equal>.
+            self.add_node(operation, node_type,
+                          [int(records[4]), int(records[7]),
+                           int(records[8])],
+                          value=int(records[6]))
+
+
+def parse_dag(lines):
+    """Returns a SketchDag for the sketch IR given either as a string or as an
+    iterable of lines, e.g., an open file."""
+    if isinstance(lines, str):
+        lines = lines.splitlines()
+    dag = SketchDag()
+    for line in lines:
+        dag.add_line(line)
+    return dag
+
+
+def load_dag(dag_filename):
+    """Returns a SketchDag for the sketch IR in dag_filename, reading the file
+    line by line."""
+    with open(dag_filename) as dag_file:
+        return parse_dag(dag_file)
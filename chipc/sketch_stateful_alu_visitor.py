@@ -8,9 +8,11 @@ from chipc.aluVisitor import aluVisitor
 
 
 class SketchStatefulAluVisitor(aluVisitor):
-    def __init__(self, alu_name, constant_arr_size):
+    def __init__(self, alu_name, constant_arr_size, get_mux_function):
         self.alu_name = alu_name
         self.constant_arr_size = constant_arr_size
+        # Returns the name of the shared n-to-1 mux function given n.
+        self.get_mux_function = get_mux_function
         self.mux5_count = 0
         self.mux4_count = 0
         self.mux3_count = 0
@@ -221,8 +223,7 @@ class SketchStatefulAluVisitor(aluVisitor):
 
     @overrides
     def visitMux5(self, ctx):
-        self.main_function += self.alu_name + '_' + 'Mux5_' + str(
-            self.mux5_count) + '('
+        self.main_function += self.get_mux_function(5) + '('
         self.visit(ctx.getChild(0, aluParser.ExprContext))
         self.main_function += ','
         self.visit(ctx.getChild(1, aluParser.ExprContext))
@@ -238,8 +239,7 @@ class SketchStatefulAluVisitor(aluVisitor):
 
     @overrides
     def visitMux4(self, ctx):
-        self.main_function += self.alu_name + '_' + 'Mux4_' + str(
-            self.mux4_count) + '('
+        self.main_function += self.get_mux_function(4) + '('
         self.visit(ctx.getChild(0, aluParser.ExprContext))
         self.main_function += ','
         self.visit(ctx.getChild(1, aluParser.ExprContext))
@@ -253,8 +253,7 @@ class SketchStatefulAluVisitor(aluVisitor):
 
     @overrides
     def visitMux3(self, ctx):
-        self.main_function += self.alu_name + '_' + 'Mux3_' + str(
-            self.mux3_count) + '('
+        self.main_function += self.get_mux_function(3) + '('
         self.visit(ctx.getChild(0, aluParser.ExprContext))
         self.main_function += ','
         self.visit(ctx.getChild(1, aluParser.ExprContext))
@@ -266,24 +265,23 @@ class SketchStatefulAluVisitor(aluVisitor):
 
     @overrides
     def visitMux3WithNum(self, ctx):
-        self.main_function += self.alu_name + '_Mux3_' + str(
-            self.mux3_count) + '('
+        self.main_function += self.get_mux_function(3) + '('
         self.visit(ctx.getChild(0, aluParser.ExprContext))
         self.main_function += ','
         self.visit(ctx.getChild(1, aluParser.ExprContext))
-        self.main_function += ',' + 'Mux3_' + str(self.mux3_count) + ')'
         # Here it's the child with index 6. The grammar parse for this
         # expression as whole is following, NUM '(' expr ',' expr ',' NUM ')'
         # Where NUM is not considered as an expr. Consider parsing NUM as expr
         # so we could simply do ctx.getChild(2, stateful_aluParser.ExprContext)
         # below.
-        self.generateMux3WithNum(ctx.getChild(6).getText())
+        self.main_function += ',' + ctx.getChild(6).getText()
+        self.main_function += ',' + 'Mux3_' + str(self.mux3_count) + ')'
+        self.generateMux3WithNum()
         self.mux3_count += 1
 
     @overrides
     def visitMux2(self, ctx):
-        self.main_function += self.alu_name + '_' + 'Mux2_' + str(
-            self.mux2_count) + '('
+        self.main_function += self.get_mux_function(2) + '('
         self.visit(ctx.getChild(0, aluParser.ExprContext))
         self.main_function += ','
         self.visit(ctx.getChild(1, aluParser.ExprContext))
@@ -356,72 +354,23 @@ class SketchStatefulAluVisitor(aluVisitor):
         self.generateComputeAlu()
         self.compute_alu_count += 1
 
+    # Muxes call the n-to-1 mux function shared by the whole sketch, so only
+    # their control holes need to be added here.
     def generateMux5(self):
-        function_str = """\
-int {alu_name}_Mux5_{mux5_count}(int op1, int op2, int op3, int op4, int op5,
-                                 int opcode) {{
-    if (opcode == 0) return op1;
-    else if (opcode == 1) return op2;
-    else if (opcode == 2) return op3;
-    else if (opcode == 3) return op4;
-    else return op5;
-}}
-"""
-        self.helper_function_strings += dedent(
-            function_str.format(
-                alu_name=self.alu_name,
-                mux5_count=str(self.mux5_count)))
         self.add_hole('Mux5_' + str(self.mux5_count), 3)
 
     def generateMux4(self):
-        function_str = """\
-int {alu_name}_Mux4_{mux4_count}(int op1, int op2, int op3, int op4,
-                                 int opcode) {{
-    if (opcode == 0) return op1;
-    else if (opcode == 1) return op2;
-    else if (opcode == 2) return op3;
-    else return op4;
-}}
-"""
-        self.helper_function_strings += dedent(
-            function_str.format(
-                alu_name=self.alu_name,
-                mux4_count=str(self.mux4_count)))
         self.add_hole('Mux4_' + str(self.mux4_count), 2)
 
     def generateMux3(self):
-        self.helper_function_strings += 'int ' + self.alu_name + '_' + \
-            'Mux3_' + str(self.mux3_count) + \
-            """(int op1, int op2, int op3, int choice) {
-    if (choice == 0) return op1;
-    else if (choice == 1) return op2;
-    else return op3;
-    } \n\n"""
         self.add_hole('Mux3_' + str(self.mux3_count), 2)
 
-    def generateMux3WithNum(self, num):
-        # NOTE: To escape curly brace, use double curly brace.
-        function_str = """\
-            int {0}_Mux3_{1}(int op1, int op2, int choice) {{
-                if (choice == 0) return op1;
-                else if (choice == 1) return op2;
-                else return {2};
-            }}\n
-        """
-        self.helper_function_strings += dedent(
-            function_str.format(self.alu_name, str(self.mux3_count),
-                                num))
-        # Add two bit width hole, to express 3 possible values for choice in
-        # the above code.
+    def generateMux3WithNum(self):
+        # Add two bit width hole, to express 3 possible values for choice. The
+        # constant is passed in as the third input of the mux.
         self.add_hole('Mux3_' + str(self.mux3_count), 2)
 
     def generateMux2(self):
-        self.helper_function_strings += 'int ' + self.alu_name + '_' + \
-            'Mux2_' + str(self.mux2_count) + \
-            """(int op1, int op2, int choice) {
-    if (choice == 0) return op1;
-    else return op2;
-    } \n\n"""
         self.add_hole('Mux2_' + str(self.mux2_count), 1)
     # TODO: return the member of the vector
 
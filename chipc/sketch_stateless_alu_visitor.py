@@ -86,14 +86,14 @@ class SketchStatelessAluVisitor (aluVisitor):
         for i, p in enumerate(self.packet_fields):
             assert(i == mux_index)
             mux_ctrl = 'operand_mux_' + str(mux_index) + '_ctrl_hole_local'
+            full_name = self.alu_name + '_operand_mux_' + str(mux_index)
+            # generate_stateless_mux returns the name of the mux function
+            # shared by all muxes with the same number of inputs.
+            mux_function = self.generate_stateless_mux(
+                len(self.potential_operands), full_name)
             self.main_function += '\tint ' + p + ' = ' + \
-                self.alu_name + '_operand_mux_' + \
-                str(mux_index) + '(' + mux_input_str + \
+                mux_function + '(' + mux_input_str + \
                 mux_ctrl + ');\n'
-            full_name = self.alu_name + '_operand_mux_' + str(mux_index)
-            self.helper_function_strings += \
-                self.generate_stateless_mux(
-                    len(self.potential_operands), full_name)
 
             mux_index += 1
 
@@ -252,6 +252,10 @@ class SketchStatelessAluVisitor (aluVisitor):
         self.visit(ctx.getChild(0, aluParser.ExprContext))
         self.main_function += ';'
 
+    @overrides
+    def visitAssertFalse(self, ctx):
+        self.main_function += ctx.getChild(0).getText()
+
     @overrides
     def visitReturn_statement(self, ctx):
         self.main_function += '\t\treturn '
@@ -1,8 +1,148 @@
+import hashlib
+import json
+import os
 import re
+import signal
 import subprocess
+import tempfile
+import time
+from collections import OrderedDict
 from pathlib import Path
 
 SLV_TIMEOUT_MINS = 0.1
+PORTFOLIO_POLL_INTERVAL_SECS = 0.1
+
+
+class SketchRunner:
+    """Runs the sketch executable. synthesize, synthesize_portfolio and
+    generate_ir run sketch through a runner, so that it can be replaced, e.g.,
+    by a ReplayRunner.
+
+    Runners implement synthesize and generate_ir, and set concurrent.
+    Concurrent runners also implement start, which synthesize_portfolio
+    races several runs with. It runs the configs of other runners, e.g., a
+    ReplayRunner, one after another with synthesize instead."""
+
+    # Whether the runner implements start.
+    concurrent = True
+
+    def synthesize(self, sketch_file_name, flags):
+        """Returns a tuple of the return code and output of sketch."""
+        # Consider switching to subprocess.run as subprocess.getstatusoutput
+        # is considered legacy.
+        # https://docs.python.org/3.5/library/subprocess.html#legacy-shell-invocation-functions
+        return subprocess.getstatusoutput(
+            get_synthesis_command(sketch_file_name, flags))
+
+    def start(self, sketch_file_name, flags, output_file):
+        """Starts sketch in the background with its output written to
+        output_file and returns its subprocess.Popen."""
+        # Start a new session so that sketch, a child of the shell, can be
+        # killed together with the shell.
+        return subprocess.Popen(
+            get_synthesis_command(sketch_file_name, flags), shell=True,
+            stdout=output_file, stderr=subprocess.STDOUT,
+            universal_newlines=True, start_new_session=True)
+
+    def generate_ir(self, sketch_file_name, flags, dag_file_name):
+        """Writes the IR of sketch_file_name to dag_file_name and returns a
+        tuple of the return code and output of sketch."""
+        # flags[0:2] are -V 3, which come before the file name.
+        completed_process = subprocess.run(
+            ['sketch'] + flags[:2] +
+            [sketch_file_name, '--debug-output-dag', dag_file_name] +
+            flags[2:],
+            # Sketch output is only used to look for syntax errors.
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True)
+        return (completed_process.returncode, completed_process.stdout)
+
+
+class ReplayRunner:
+    """Stands in for sketch by replaying results recorded in fixture_dir,
+    one JSON file per sketch invocation. Keys are hashes of the sketch file
+    content and the sketch flags, like SketchCache keys but without the
+    sketch version, so that fixtures can be replayed where sketch isn't
+    installed. This makes benchmarks of chipc itself fast and deterministic.
+
+    If runner is given, invocations without a fixture are run with it and
+    recorded, otherwise they raise an exception."""
+
+    # Replayed runs finish immediately, so there is nothing to race, and
+    # fixtures are recorded through synthesize.
+    concurrent = False
+
+    def __init__(self, fixture_dir, runner=None):
+        self.fixture_dir = fixture_dir
+        self.runner = runner
+        self.replays = 0
+        self.recordings = 0
+
+    def get_fixture_path(self, sketch_file_name, flags):
+        sha = hashlib.sha256()
+        sha.update(Path(sketch_file_name).read_bytes())
+        for flag in flags:
+            sha.update(b'\0' + str(flag).encode('utf-8'))
+        return Path(self.fixture_dir) / (sha.hexdigest() + '.json')
+
+    def replay(self, sketch_file_name, flags, record):
+        """Returns the fixture of running sketch with flags on
+        sketch_file_name, calling record to create it if there is none."""
+        fixture_path = self.get_fixture_path(sketch_file_name, flags)
+        if fixture_path.exists():
+            self.replays += 1
+            return json.loads(fixture_path.read_text())
+        if self.runner is None:
+            raise Exception(
+                'No recorded sketch run for ' + sketch_file_name + ' with ' +
+                ' '.join(str(flag) for flag in flags) + ' in ' +
+                str(self.fixture_dir) + '.')
+        fixture = record()
+        fixture_path.parent.mkdir(parents=True, exist_ok=True)
+        fixture_path.write_text(json.dumps(fixture))
+        self.recordings += 1
+        return fixture
+
+    def synthesize(self, sketch_file_name, flags):
+        def record():
+            return_code, output = self.runner.synthesize(sketch_file_name,
+                                                         flags)
+            return {'return_code': return_code, 'output': output}
+
+        fixture = self.replay(sketch_file_name, ['synthesize'] + flags,
+                              record)
+        return (fixture['return_code'], fixture['output'])
+
+    def generate_ir(self, sketch_file_name, flags, dag_file_name):
+        def record():
+            return_code, output = self.runner.generate_ir(
+                sketch_file_name, flags, dag_file_name)
+            return {'return_code': return_code, 'output': output,
+                    'dag': Path(dag_file_name).read_text()}
+
+        fixture = self.replay(sketch_file_name, ['generate_ir'] + flags,
+                              record)
+        # Leave the .dag file around as if sketch had generated it.
+        Path(dag_file_name).write_text(fixture['dag'])
+        return (fixture['return_code'], fixture['output'])
+
+    def get_stats(self):
+        return {'replays': self.replays, 'recordings': self.recordings}
+
+
+# Runs sketch unless another runner is given.
+SKETCH_RUNNER = SketchRunner()
+
+
+def raise_on_syntax_error(sketch_file_name, output):
+    """Raises an exception if the given sketch output reports a parse error.
+    Sketch parses its input before doing anything else, so the output of any
+    sketch invocation can be used instead of a separate syntax check."""
+    if (output.rfind('Program Parse Error:') != -1):
+        raise Exception(
+            sketch_file_name + ' contains a syntax error.' +
+            'Output pasted below:\n\n' + output)
 
 
 def check_syntax(sketch_file_name):
@@ -13,33 +153,167 @@ def check_syntax(sketch_file_name):
         print(sketch_file_name + ' passed syntax check. ')
         assert(output.rfind('Program Parse Error:') == -1)
     else:
-        if (output.rfind('Program Parse Error:') != -1):
-            raise Exception(
-                sketch_file_name + ' contains a syntax error.' +
-                'Output pasted below:\n\n' + output)
+        raise_on_syntax_error(sketch_file_name, output)
 
 
-def synthesize(sketch_file_name, bnd_inbits, slv_seed, slv_parallel=False):
+def get_synthesis_flags(bnd_inbits, slv_seed, slv_parallel, slv_p_cpus):
     assert(slv_parallel in [True, False])
-    check_syntax(sketch_file_name)
-    par_string = ' --slv-parallel' if slv_parallel else ''
-    # Consider switching to subprocess.run as subprocess.getstatusoutput is
-    # considered legacy.
-    # https://docs.python.org/3.5/library/subprocess.html#legacy-shell-invocation-functions
-    (return_code, output) = subprocess.getstatusoutput('time sketch -V 12 ' +
-                                                       '--slv-nativeints ' +
-                                                       sketch_file_name +
-                                                       ' --bnd-inbits=' +
-                                                       str(bnd_inbits) +
-                                                       ' --slv-seed=' +
-                                                       str(slv_seed) +
-                                                       par_string)
-    assert(output.rfind('Program Parse Error:') == -1)
+    flags = ['-V 12', '--slv-nativeints', '--bnd-inbits=' + str(bnd_inbits),
+             '--slv-seed=' + str(slv_seed)]
+    if slv_parallel:
+        flags.append('--slv-parallel')
+        # Limits the number of threads sketch uses.
+        if slv_p_cpus is not None:
+            flags.append('--slv-p-cpus ' + str(slv_p_cpus))
+    return flags
+
+
+def get_synthesis_command(sketch_file_name, flags):
+    # flags[0:2] are -V 12 and --slv-nativeints, which come before the file
+    # name.
+    return ' '.join(['time sketch'] + flags[:2] + [sketch_file_name] +
+                    flags[2:])
+
+
+def get_cached_synthesis_result(cache, sketch_file_name, flags):
+    """Returns a tuple of the cache key and the cached (return_code, output)
+    tuple, or None if there is none."""
+    key = cache.get_key(sketch_file_name, ['synthesize'] + flags)
+    cached_result = cache.get(key)
+    if cached_result is None:
+        return (key, None)
+    return (key, (cached_result['return_code'], cached_result['output']))
+
+
+def put_synthesis_result(cache, key, return_code, output):
+    # Don't cache runs terminated by a signal, e.g., when parallel_codegen
+    # kills the remaining sketch processes.
+    if 0 <= return_code < 128:
+        cache.put(key, {'return_code': return_code, 'output': output})
+
+
+def synthesize(sketch_file_name, bnd_inbits, slv_seed, slv_parallel=False,
+               slv_p_cpus=None, cache=None, runner=SKETCH_RUNNER):
+    """Runs sketch on sketch_file_name and returns a tuple of sketch's return
+    code and output. slv_p_cpus limits the number of threads sketch uses with
+    slv_parallel. If cache, a SketchCache, is given, results of earlier runs
+    on the same sketch file with the same flags are reused. runner, a
+    SketchRunner, runs sketch."""
+    flags = get_synthesis_flags(bnd_inbits, slv_seed, slv_parallel,
+                                slv_p_cpus)
+    if cache is not None:
+        key, cached_result = get_cached_synthesis_result(
+            cache, sketch_file_name, flags)
+        if cached_result is not None:
+            return cached_result
+
+    (return_code, output) = runner.synthesize(sketch_file_name, flags)
+    # Syntax errors are detected from the output of this run rather than by
+    # running sketch once more beforehand.
+    raise_on_syntax_error(sketch_file_name, output)
+    if cache is not None:
+        put_synthesis_result(cache, key, return_code, output)
     return (return_code, output)
 
 
+def kill_run(process, output_file):
+    """Kills a sketch run started by SketchRunner.start."""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    process.wait()
+    output_file.close()
+
+
+def synthesize_portfolio(sketch_file_name, configs, slv_parallel=False,
+                         slv_p_cpus=None, cache=None, runner=SKETCH_RUNNER):
+    """Races sketch runs on sketch_file_name, one for each (bnd_inbits,
+    slv_seed) tuple in configs, and returns a tuple of the return code and
+    output of the first successful run and its config. The other runs are
+    killed.
+
+    A run failing with bnd_inbits b, e.g., because there is no candidate,
+    would fail with more input bits as well, so the runs of all configs
+    with at least b input bits are dropped then. If no config is left,
+    returns the result of the first failed run and its config.
+
+    Sketch run times vary a lot between seeds, so the first of several seeds
+    to finish is usually much faster than a single seed. If runner isn't
+    concurrent, the configs are run one after another instead."""
+    flags_list = [get_synthesis_flags(bnd_inbits, slv_seed, slv_parallel,
+                                      slv_p_cpus)
+                  for bnd_inbits, slv_seed in configs]
+    keys = [None] * len(configs)
+    # Indices of the configs that may still succeed.
+    pending = list(range(len(configs)))
+    failures = []
+
+    def fail(i, result):
+        failures.append(result + (configs[i],))
+        pending[:] = [j for j in pending if configs[j][0] < configs[i][0]]
+
+    if cache is not None:
+        for i, flags in enumerate(flags_list):
+            keys[i], result = get_cached_synthesis_result(
+                cache, sketch_file_name, flags)
+            if result is None:
+                continue
+            if result[0] == 0:
+                return result + (configs[i],)
+            fail(i, result)
+
+    if not runner.concurrent:
+        while pending:
+            i = pending.pop(0)
+            result = runner.synthesize(sketch_file_name, flags_list[i])
+            raise_on_syntax_error(sketch_file_name, result[1])
+            if cache is not None:
+                put_synthesis_result(cache, keys[i], *result)
+            if result[0] == 0:
+                return result + (configs[i],)
+            fail(i, result)
+        return failures[0]
+
+    processes = OrderedDict()
+    for i in pending:
+        # sketch output can be large, so write it to a file rather than a
+        # pipe, which would block sketch when it is full.
+        output_file = tempfile.TemporaryFile(mode='w+')
+        processes[i] = (runner.start(sketch_file_name, flags_list[i],
+                                     output_file),
+                        output_file)
+
+    try:
+        while processes:
+            for i, (process, output_file) in list(processes.items()):
+                if i not in processes or process.poll() is None:
+                    continue
+                del processes[i]
+                output_file.seek(0)
+                output = output_file.read()
+                output_file.close()
+                # Same as subprocess.getstatusoutput.
+                if output.endswith('\n'):
+                    output = output[:-1]
+                raise_on_syntax_error(sketch_file_name, output)
+                result = (process.returncode, output)
+                if cache is not None:
+                    put_synthesis_result(cache, keys[i], *result)
+                if process.returncode == 0:
+                    return result + (configs[i],)
+                fail(i, result)
+                for j in list(processes):
+                    if j not in pending:
+                        kill_run(*processes.pop(j))
+            time.sleep(PORTFOLIO_POLL_INTERVAL_SECS)
+    finally:
+        for process, output_file in processes.values():
+            kill_run(process, output_file)
+    return failures[0]
+
+
 def generate_smt2_formula(sketch_file_name, smt_file_name, bit_range):
-    check_syntax(sketch_file_name)
     (return_code, output) = subprocess.getstatusoutput('sketch ' +
                                                        sketch_file_name +
                                                        ' --bnd-inbits=' +
@@ -48,28 +322,34 @@ def generate_smt2_formula(sketch_file_name, smt_file_name, bit_range):
                                                        str(SLV_TIMEOUT_MINS) +
                                                        ' --beopt:writeSMT ' +
                                                        smt_file_name)
+    raise_on_syntax_error(sketch_file_name, output)
 
 
-def generate_ir(sketch_file_name):
+def generate_ir(sketch_file_name, cache=None, runner=SKETCH_RUNNER):
     """Given a sketch file, returns its IR (intermediate representation).
 
     This function calls sketch and generates a .dag file having IR for the
-    sketch file. Then reads the .dag file and returns its content."""
-    check_syntax(sketch_file_name)
+    sketch file. Then reads the .dag file and returns its content. If cache,
+    a SketchCache, is given, the IR of an identical sketch file is reused.
+    runner, a SketchRunner, runs sketch."""
     # Generate the dag filename by replacing sk extension with dag.
     dag_file_name = re.sub('sk$', 'dag', sketch_file_name)
-    subprocess.run([
-        'sketch',
-        '-V', '3',
-        sketch_file_name,
-        '--debug-output-dag', dag_file_name,
-        # We only want the dag and sketch output is irrelevant here. So quickly
-        # return from it using --slv-timeout.
-        '--slv-seed', '1',
-        '--slv-timeout', str(SLV_TIMEOUT_MINS)
-    ],
-        # Pipe stdout and stderr to /dev/null as we don't need them.
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL)
-
-    return Path(dag_file_name).read_text()
+    # We only want the dag and sketch output is irrelevant here. So quickly
+    # return from it using --slv-timeout.
+    flags = ['-V', '3', '--slv-seed', '1',
+             '--slv-timeout', str(SLV_TIMEOUT_MINS)]
+    if cache is not None:
+        key = cache.get_key(sketch_file_name, ['generate_ir'] + flags)
+        cached_result = cache.get(key)
+        if cached_result is not None:
+            # Leave the .dag file around as if sketch had generated it.
+            Path(dag_file_name).write_text(cached_result['dag'])
+            return cached_result['dag']
+
+    _, output = runner.generate_ir(sketch_file_name, flags, dag_file_name)
+    raise_on_syntax_error(sketch_file_name, output)
+
+    sketch_ir = Path(dag_file_name).read_text()
+    if cache is not None:
+        cache.put(key, {'dag': sketch_ir})
+    return sketch_ir
@@ -0,0 +1,231 @@
+"""Dependency analysis of program specifications"""
+import itertools
+import re
+from collections import OrderedDict
+
+STATE_VAR_PATTERN = re.compile(r'state_group_(\d+)_state_\d+')
+PKT_FIELD_PATTERN = re.compile(r'pkt_(\d+)')
+
+
+def get_program_body(program):
+    """Returns the body of the program function in a spec, without the
+    trailing return statement, or None if it can't be found."""
+    # Drop comments, which contain the original domino program.
+    program = re.sub(r'/\*.*?\*/', '', program, flags=re.DOTALL)
+    program = re.sub(r'//[^\n]*', '', program)
+    match = re.search(r'program\s*\([^)]*\)\s*\{(.*)\}', program, re.DOTALL)
+    if match is None:
+        return None
+    body = match.group(1)
+    return body[:body.rfind('return')]
+
+
+def read_balanced_parens(text, pos):
+    """Given text[pos] is '(', returns the text within the matching
+    parentheses and the position right after the closing one."""
+    assert text[pos] == '('
+    depth = 0
+    for end in range(pos, len(text)):
+        if text[end] == '(':
+            depth += 1
+        elif text[end] == ')':
+            depth -= 1
+            if depth == 0:
+                return (text[pos + 1:end], end + 1)
+    raise ValueError('Unbalanced parentheses in program body')
+
+
+def get_statements(body):
+    """Returns a list of (conditions, statement) tuples for each assignment in
+    body, where conditions is a list of the conditions of all if statements
+    enclosing the assignment. The condition of an else branch is the
+    condition of its if statement, as both depend on the same variables."""
+    statements = []
+    conditions = []
+    # Conditions of if statements that were closed last at each depth, for
+    # else branches.
+    last_closed = []
+    pos = 0
+    while True:
+        match = re.compile(r'\s*').match(body, pos)
+        pos = match.end()
+        if pos >= len(body):
+            break
+        if re.compile(r'if\s*\(').match(body, pos):
+            cond, pos = read_balanced_parens(body, body.index('(', pos))
+            pos = body.index('{', pos) + 1
+            conditions.append(cond)
+        elif re.compile(r'else\s+if\s*\(').match(body, pos):
+            cond, pos = read_balanced_parens(body, body.index('(', pos))
+            pos = body.index('{', pos) + 1
+            conditions.append(last_closed.pop() + ' && ' + cond)
+        elif re.compile(r'else\s*\{').match(body, pos):
+            pos = body.index('{', pos) + 1
+            conditions.append(last_closed.pop())
+        elif body[pos] == '}':
+            pos += 1
+            last_closed.append(conditions.pop())
+        else:
+            end = body.index(';', pos)
+            statements.append((list(conditions), ' '.join(
+                body[pos:end].split())))
+            pos = end + 1
+    if conditions:
+        raise ValueError('Unbalanced braces in program body')
+    return statements
+
+
+def get_read_groups(text, pkt_deps):
+    """Returns the state groups whose values text reads, either directly or
+    through packet fields computed from them."""
+    groups = set(int(g) for g in STATE_VAR_PATTERN.findall(text))
+    for field in PKT_FIELD_PATTERN.findall(text):
+        groups |= pkt_deps.get(int(field), set())
+    return groups
+
+
+def get_dependencies(statements):
+    """Returns a tuple of two dicts. The first one maps each state group to
+    the other state groups it reads and must thus be placed after. The
+    second one maps each packet field to the state groups its final value
+    may depend on."""
+    group_deps = OrderedDict()
+    pkt_deps = {}
+    for conditions, statement in statements:
+        match = re.match(r'state_and_packet\.(\w+)\s*([-+*/]?=)(.*)',
+                         statement)
+        if match is None:
+            raise ValueError('Unexpected statement: ' + statement)
+        lhs, op, rhs = match.groups()
+        read_text = ' '.join(conditions + [rhs])
+        if op != '=':
+            read_text += ' ' + lhs
+        read_groups = get_read_groups(read_text, pkt_deps)
+
+        state_var = STATE_VAR_PATTERN.fullmatch(lhs)
+        pkt_field = PKT_FIELD_PATTERN.fullmatch(lhs)
+        if state_var is not None:
+            group = int(state_var.group(1))
+            group_deps.setdefault(group, set())
+            group_deps[group] |= read_groups - {group}
+        elif pkt_field is not None:
+            field = int(pkt_field.group(1))
+            if conditions:
+                # The field keeps its old value if the condition is false.
+                read_groups |= pkt_deps.get(field, set())
+            pkt_deps[field] = read_groups
+        else:
+            raise ValueError('Unexpected variable: ' + lhs)
+    return (group_deps, pkt_deps)
+
+
+def has_cycle(group_deps):
+    visited = set()
+    on_path = set()
+
+    def visit(group):
+        if group in on_path:
+            return True
+        if group in visited:
+            return False
+        visited.add(group)
+        on_path.add(group)
+        if any(visit(dep) for dep in group_deps.get(group, set())):
+            return True
+        on_path.remove(group)
+        return False
+
+    return any(visit(group) for group in group_deps)
+
+
+def get_interchangeable_groups(statements, group_deps, output_state_groups):
+    """Returns lists of state groups which can be swapped with each other
+    without changing the program, i.e., groups that only depend on packet
+    fields, are read by nothing else and are updated by the same statements
+    up to renaming."""
+    signatures = OrderedDict()
+    for group in sorted(group_deps):
+        if group_deps[group]:
+            continue
+        name = 'state_group_' + str(group) + '_'
+        signature = []
+        read_by_others = False
+        for conditions, statement in statements:
+            lhs = statement.split('=')[0]
+            text = ' '.join(conditions + [statement])
+            if name in lhs:
+                signature.append(text.replace(name, 'self_'))
+            elif name in text:
+                read_by_others = True
+        if read_by_others:
+            continue
+        key = (tuple(signature), group in output_state_groups)
+        signatures.setdefault(key, []).append(group)
+    return [groups for groups in signatures.values() if len(groups) > 1]
+
+
+def get_state_group_assignments(program, num_pipeline_stages,
+                                num_state_groups, output_packet_fields,
+                                output_state_groups):
+    """Returns tuples of pipeline stages for each state group, like
+    itertools.product(range(num_pipeline_stages), repeat=num_state_groups),
+    but without the assignments that can't work or are equivalent to another
+    one.
+
+    A state group which reads another state group, directly or through a
+    packet field, must be placed in a later stage. This is only enforced for
+    state groups that the checked outputs depend on. Out of assignments that
+    only differ by swapping interchangeable state groups, only the one with
+    these groups in non-decreasing stages is kept.
+
+    Falls back to all assignments if the program can't be analyzed or if no
+    assignment would be left."""
+    all_assignments = list(itertools.product(range(num_pipeline_stages),
+                                             repeat=num_state_groups))
+    body = get_program_body(program)
+    if body is None:
+        return all_assignments
+    try:
+        statements = get_statements(body)
+        group_deps, pkt_deps = get_dependencies(statements)
+    except (IndexError, ValueError) as e:
+        print('Not pruning state group assignments:', e)
+        return all_assignments
+
+    output_state_groups = set(int(g) for g in output_state_groups)
+    if has_cycle(group_deps):
+        print('Not pruning state group assignments, cyclic dependencies')
+        return all_assignments
+
+    # Only the state groups the checked outputs depend on need to be placed
+    # in dependency order.
+    relevant_groups = set(output_state_groups)
+    for field in output_packet_fields:
+        relevant_groups |= pkt_deps.get(int(field), set())
+    worklist = list(relevant_groups)
+    while worklist:
+        for dep in group_deps.get(worklist.pop(), set()):
+            if dep not in relevant_groups:
+                relevant_groups.add(dep)
+                worklist.append(dep)
+
+    ordering = [(group, dep) for group in sorted(relevant_groups)
+                for dep in group_deps.get(group, set())]
+    interchangeable_groups = get_interchangeable_groups(
+        statements, group_deps, output_state_groups)
+
+    assignments = []
+    for assignment in all_assignments:
+        if any(assignment[group] <= assignment[dep]
+               for group, dep in ordering):
+            continue
+        if any(assignment[a] > assignment[b]
+               for groups in interchangeable_groups
+               for a, b in zip(groups, groups[1:])):
+            continue
+        assignments.append(assignment)
+
+    if not assignments:
+        print('No state group assignment satisfies dependencies, trying all')
+        return all_assignments
+    return assignments
@@ -0,0 +1,185 @@
+"""Synthetic specs of a given size for scaling studies"""
+import argparse
+import random
+import sys
+from collections import OrderedDict
+from pathlib import Path
+
+# Operators of the expressions in generated specs. 'if' makes the update of
+# a state group conditional instead.
+ARITHMETIC_OPERATORS = OrderedDict([('add', '+'), ('sub', '-'),
+                                    ('mul', '*')])
+CONDITION_OPERATORS = ['<', '>', '==']
+OPERATORS = list(ARITHMETIC_OPERATORS) + ['if']
+DEFAULT_OPERATORS = ['add', 'sub', 'if']
+
+
+def get_field(index):
+    return 'state_and_packet.pkt_' + str(index)
+
+
+def get_state_var(group, index):
+    return 'state_and_packet.state_group_%d_state_%d' % (group, index)
+
+
+class SpecGenerator:
+    """Generates the statements of a spec. The statements are grouped in
+    depth levels. Each level after the first computes a packet field from
+    the one of the previous level, so that the last level depends on all
+    earlier ones, and state groups are spread over the levels, each updated
+    from the packet field of its level. If there is no state group at the
+    last level, level 0 computes a packet field too."""
+
+    def __init__(self, num_fields, num_state_groups, group_size, depth,
+                 operators, seed):
+        assert num_fields > 0 and group_size > 0 and depth > 0, (
+            'Number of fields, group size and depth must be positive')
+        for operator in operators:
+            assert operator in OPERATORS, 'Unknown operator ' + operator
+        self.num_fields = num_fields
+        self.num_state_groups = num_state_groups
+        self.group_size = group_size
+        self.depth = depth
+        self.arithmetic_operators = [
+            ARITHMETIC_OPERATORS[operator] for operator in operators
+            if operator in ARITHMETIC_OPERATORS] or ['+']
+        # Fraction of state group updates which are conditional.
+        self.if_fraction = operators.count('if') / len(operators) \
+            if operators else 0
+        self.random = random.Random(seed)
+        self.used_fields = set()
+        self.lines = []
+
+    def field(self, index):
+        self.used_fields.add(index)
+        return get_field(index)
+
+    def constant(self):
+        # Small enough to be in the constant set of most runs.
+        return str(self.random.randint(1, 3))
+
+    def binary(self, operand1, operand2):
+        return '%s %s %s' % (operand1,
+                             self.random.choice(self.arithmetic_operators),
+                             operand2)
+
+    def emit(self, line, indent):
+        self.lines.append('  ' * indent + line)
+
+    def emit_state_group(self, group, value):
+        indent = 1
+        if self.random.random() < self.if_fraction:
+            self.emit('if (%s %s %s) {' % (
+                value, self.random.choice(CONDITION_OPERATORS),
+                self.constant()), indent)
+            indent += 1
+        for index in range(self.group_size):
+            # Later state variables of a group depend on earlier ones, like
+            # in pair ALUs.
+            operand = value if index == 0 else get_state_var(group,
+                                                             index - 1)
+            state_var = get_state_var(group, index)
+            self.emit('%s = %s;' % (state_var,
+                                    self.binary(state_var, operand)), indent)
+        if indent > 1:
+            self.emit('}', 1)
+
+    def generate(self):
+        for level in range(self.depth):
+            current = level % self.num_fields
+            if level > 0:
+                previous = (level - 1) % self.num_fields
+                others = [index for index in range(self.num_fields)
+                          if index != previous]
+                if not others or self.random.random() < 0.5:
+                    operand = self.constant()
+                else:
+                    operand = self.field(self.random.choice(others))
+                self.emit('%s = %s;' % (
+                    get_field(current),
+                    self.binary(self.field(previous), operand)), 1)
+            for group in range(level, self.num_state_groups, self.depth):
+                # Without a chain, spread the state groups over the fields.
+                field = current if level > 0 else group % self.num_fields
+                self.emit_state_group(group, self.field(field))
+            if level == 0 and self.depth > self.num_state_groups:
+                # No state group ends the chain at the last level, so the
+                # chain of packet fields starts at level 0 instead.
+                self.emit('%s = %s;' % (
+                    get_field(current),
+                    self.binary(self.field(current), self.constant())), 1)
+        # Make sure that the spec has num_fields packet fields.
+        for index in range(self.num_fields):
+            if index not in self.used_fields:
+                self.emit('%s = %s;' % (
+                    get_field(index),
+                    self.binary(self.field(index), self.constant())), 1)
+        return self.lines
+
+
+def generate_spec(num_fields, num_state_groups, group_size=1, depth=1,
+                  operators=DEFAULT_OPERATORS, seed=1):
+    """Returns the text of a spec in the program(state_and_packet) style
+    with num_fields packet fields and num_state_groups state groups of
+    group_size state variables each. depth is the length of the longest
+    chain of dependent statements. operators is a list of names in
+    OPERATORS to draw operators from, where repeated names are drawn more
+    often. Specs with the same arguments are the same."""
+    lines = SpecGenerator(num_fields, num_state_groups, group_size, depth,
+                          operators, seed).generate()
+    return '\n'.join(
+        ['// Generated by chipc.spec_generator with ' +
+         get_spec_name(num_fields, num_state_groups, group_size, depth,
+                       operators, seed),
+         '',
+         '| StateAndPacket | program(| StateAndPacket | state_and_packet) {'] +
+        lines + ['  return state_and_packet;', '}', ''])
+
+
+def get_spec_name(num_fields, num_state_groups, group_size=1, depth=1,
+                  operators=DEFAULT_OPERATORS, seed=1):
+    """Returns a name for the spec of generate_spec with these arguments,
+    e.g., synthetic_f2_g1_s1_d1_add_sub_if_1."""
+    return 'synthetic_f%d_g%d_s%d_d%d_%s_%d' % (
+        num_fields, num_state_groups, group_size, depth, '_'.join(operators),
+        seed)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic spec.')
+    parser.add_argument(
+        'spec_filename', help='File to write the spec to.')
+    parser.add_argument(
+        '--fields', type=int, default=2, help='Number of packet fields.')
+    parser.add_argument(
+        '--state-groups', type=int, default=1,
+        help='Number of state groups.')
+    parser.add_argument(
+        '--group-size', type=int, default=1,
+        help='Number of state variables in each state group.')
+    parser.add_argument(
+        '--depth', type=int, default=1,
+        help='Length of the longest chain of dependent statements.')
+    parser.add_argument(
+        '--operators', nargs='+', choices=OPERATORS,
+        default=DEFAULT_OPERATORS,
+        help='Operators to draw from. Repeat an operator to draw it more \
+              often.')
+    parser.add_argument(
+        '--seed', type=int, default=1,
+        help='Seed of the random choices of operators and operands.')
+
+    args = parser.parse_args(argv[1:])
+    Path(args.spec_filename).write_text(generate_spec(
+        args.fields, args.state_groups, args.group_size, args.depth,
+        args.operators, args.seed))
+    return 0
+
+
+def run_main():
+    sys.exit(main(sys.argv))
+
+
+if __name__ == '__main__':
+    run_main()
@@ -0,0 +1,386 @@
+"""Executable form of program specifications"""
+import re
+from collections import OrderedDict
+
+import numpy as np
+
+from chipc.pipeline_simulator import NUMPY_OPERATIONS
+from chipc.pipeline_simulator import to_int
+from chipc.spec_analysis import get_program_body
+
+# Numbers, variables, operators and keywords.
+TOKEN_PATTERN = re.compile(
+    r'\s*(?:(\d+)|state_and_packet\.(\w+)|'
+    r'(\|\||&&|==|!=|<=|>=|[-+*/%]=|[-+*/%<>!?:=;(){}])|(if|else)\b)')
+
+# Binary operators from lowest to highest precedence, as in C.
+BINARY_OPERATORS = [['||'], ['&&'], ['==', '!='], ['<', '>', '<=', '>='],
+                    ['+', '-'], ['*', '/', '%']]
+
+# Functions of operations the source of get_vector_expression calls.
+OPERATION_NAMES = ['to_int', 'to_bool', 'where', 'logical_not', 'logical_and',
+                   'logical_or', 'divide', 'remainder']
+
+
+def tokenize(body):
+    tokens = []
+    pos = 0
+    body = body.rstrip()
+    while pos < len(body):
+        match = TOKEN_PATTERN.match(body, pos)
+        if match is None:
+            raise ValueError('Unexpected text in program body: ' +
+                             body[pos:pos + 20])
+        num, var, op, keyword = match.groups()
+        if num is not None:
+            tokens.append(('num', int(num)))
+        elif var is not None:
+            tokens.append(('var', var))
+        else:
+            tokens.append(('op', op if op is not None else keyword))
+        pos = match.end()
+    return tokens
+
+
+class SpecParser:
+    """Recursive descent parser for the statements of a program() function.
+    Statements are ('assign', variable, expression) and ('if', condition,
+    then statements, else statements) tuples. Expressions are ('num',
+    value), ('var', name), ('unary', op, operand), ('binary', op, operand1,
+    operand2) and ('ternary', condition, value if true, value if false)
+    tuples."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def accept(self, op):
+        if self.peek() == ('op', op):
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, op):
+        if not self.accept(op):
+            raise ValueError('Expected ' + op + ', found ' +
+                             str(self.peek()[1]))
+
+    def parse_statements(self):
+        statements = []
+        while self.pos < len(self.tokens) and self.peek() != ('op', '}'):
+            statements.append(self.parse_statement())
+        return statements
+
+    def parse_block(self):
+        self.expect('{')
+        statements = self.parse_statements()
+        self.expect('}')
+        return statements
+
+    def parse_statement(self):
+        if self.accept('if'):
+            self.expect('(')
+            condition = self.parse_expression()
+            self.expect(')')
+            then_statements = self.parse_block()
+            else_statements = []
+            if self.accept('else'):
+                if self.peek() == ('op', 'if'):
+                    else_statements = [self.parse_statement()]
+                else:
+                    else_statements = self.parse_block()
+            return ('if', condition, then_statements, else_statements)
+
+        kind, name = self.peek()
+        if kind != 'var':
+            raise ValueError('Unexpected statement starting with ' +
+                             str(name))
+        self.pos += 1
+        kind, op = self.peek()
+        self.pos += 1
+        if op not in ['=', '+=', '-=', '*=', '/=', '%=']:
+            raise ValueError('Unexpected assignment operator ' + str(op))
+        value = self.parse_expression()
+        if op != '=':
+            # a += b is a = a + b.
+            value = ('binary', op[0], ('var', name), value)
+        self.expect(';')
+        return ('assign', name, value)
+
+    def parse_expression(self):
+        condition = self.parse_binary(0)
+        if not self.accept('?'):
+            return condition
+        yes_val = self.parse_expression()
+        self.expect(':')
+        no_val = self.parse_expression()
+        return ('ternary', condition, yes_val, no_val)
+
+    def parse_binary(self, level):
+        if level == len(BINARY_OPERATORS):
+            return self.parse_unary()
+        operand = self.parse_binary(level + 1)
+        while self.peek()[0] == 'op' and \
+                self.peek()[1] in BINARY_OPERATORS[level]:
+            op = self.peek()[1]
+            self.pos += 1
+            operand = ('binary', op, operand, self.parse_binary(level + 1))
+        return operand
+
+    def parse_unary(self):
+        for op in ['!', '-']:
+            if self.accept(op):
+                return ('unary', op, self.parse_unary())
+        kind, value = self.peek()
+        if kind in ['num', 'var']:
+            self.pos += 1
+            return (kind, value)
+        self.expect('(')
+        expression = self.parse_expression()
+        self.expect(')')
+        return expression
+
+
+def c_divide(dividend, divisor):
+    # Rounds towards zero like sketch, see pipeline_simulator.divide.
+    if divisor == 0:
+        return 0
+    quotient = abs(dividend) // abs(divisor)
+    return quotient if (dividend < 0) == (divisor < 0) else -quotient
+
+
+def c_remainder(dividend, divisor):
+    return dividend - c_divide(dividend, divisor) * divisor
+
+
+def get_scalar_expression(expression):
+    """Returns Python source evaluating expression on ints."""
+    kind = expression[0]
+    if kind == 'num':
+        return str(expression[1])
+    elif kind == 'var':
+        return 'v[' + repr(expression[1]) + ']'
+    elif kind == 'unary':
+        operand = get_scalar_expression(expression[2])
+        if expression[1] == '!':
+            return '(not ' + operand + ')'
+        return '(-' + operand + ')'
+    elif kind == 'ternary':
+        condition, yes_val, no_val = [get_scalar_expression(e)
+                                      for e in expression[1:]]
+        return '(' + yes_val + ' if ' + condition + ' else ' + no_val + ')'
+    op, operand1, operand2 = expression[1], \
+        get_scalar_expression(expression[2]), \
+        get_scalar_expression(expression[3])
+    if op == '/':
+        return 'c_divide(' + operand1 + ', ' + operand2 + ')'
+    elif op == '%':
+        return 'c_remainder(' + operand1 + ', ' + operand2 + ')'
+    elif op in ['&&', '||']:
+        op = 'and' if op == '&&' else 'or'
+        return '(bool(' + operand1 + ') ' + op + ' bool(' + operand2 + '))'
+    # Comparisons are parenthesized, so that they aren't chained.
+    return '(' + operand1 + ' ' + op + ' ' + operand2 + ')'
+
+
+def get_vector_expression(expression):
+    """Returns Python source evaluating expression with the functions of
+    operations, e.g., pipeline_simulator.NumpyOperations, on numpy
+    arrays."""
+    kind = expression[0]
+    if kind == 'num':
+        return str(expression[1])
+    elif kind == 'var':
+        return 'v[' + repr(expression[1]) + ']'
+    elif kind == 'unary':
+        operand = get_vector_expression(expression[2])
+        if expression[1] == '!':
+            return 'logical_not(to_bool(' + operand + '))'
+        return '(-to_int(' + operand + '))'
+    elif kind == 'ternary':
+        condition, yes_val, no_val = [get_vector_expression(e)
+                                      for e in expression[1:]]
+        return 'where(to_bool(' + condition + '), to_int(' + yes_val + \
+            '), to_int(' + no_val + '))'
+    op, operand1, operand2 = expression[1], \
+        get_vector_expression(expression[2]), \
+        get_vector_expression(expression[3])
+    if op == '/':
+        return 'divide(' + operand1 + ', ' + operand2 + ')'
+    elif op == '%':
+        return 'remainder(' + operand1 + ', ' + operand2 + ')'
+    elif op in ['&&', '||']:
+        function = 'logical_and' if op == '&&' else 'logical_or'
+        return function + '(to_bool(' + operand1 + '), to_bool(' + \
+            operand2 + '))'
+    return '(to_int(' + operand1 + ') ' + op + ' to_int(' + operand2 + '))'
+
+
+def get_scalar_source(statements, indent='    '):
+    lines = []
+    for statement in statements:
+        if statement[0] == 'assign':
+            # Comparisons are bools in Python, but ints in sketch.
+            lines.append(indent + 'v[' + repr(statement[1]) + '] = int(' +
+                         get_scalar_expression(statement[2]) + ')')
+            continue
+        _, condition, then_statements, else_statements = statement
+        lines.append(indent + 'if ' + get_scalar_expression(condition) + ':')
+        lines += get_scalar_source(then_statements, indent + '    ') or \
+            [indent + '    pass']
+        if else_statements:
+            lines.append(indent + 'else:')
+            lines += get_scalar_source(else_statements, indent + '    ')
+    return lines
+
+
+def get_vector_source(statements, mask=None, counter=None):
+    """Conditional statements are executed for all inputs, and assignments
+    only take effect where mask, the name of a boolean array, is set."""
+    if counter is None:
+        counter = [0]
+    lines = []
+    for statement in statements:
+        if statement[0] == 'assign':
+            name = 'v[' + repr(statement[1]) + ']'
+            value = get_vector_expression(statement[2])
+            if mask is None:
+                lines.append('    ' + name + ' = to_int(' + value + ')')
+            else:
+                lines.append('    ' + name + ' = where(' + mask +
+                             ', to_int(' + value + '), ' + name + ')')
+            continue
+        _, condition, then_statements, else_statements = statement
+        # Evaluate the condition before either branch changes variables.
+        counter[0] += 1
+        condition_name = 'c' + str(counter[0])
+        lines.append('    ' + condition_name + ' = to_bool(' +
+                     get_vector_expression(condition) + ')')
+        for branch_statements, branch_mask in [
+                (then_statements, condition_name),
+                (else_statements,
+                 'logical_not(' + condition_name + ')')]:
+            if not branch_statements:
+                continue
+            counter[0] += 1
+            mask_name = 'm' + str(counter[0])
+            if mask is None:
+                lines.append('    ' + mask_name + ' = ' + branch_mask)
+            else:
+                lines.append('    ' + mask_name + ' = logical_and(' + mask +
+                             ', ' + branch_mask + ')')
+            lines += get_vector_source(branch_statements, mask_name, counter)
+    return lines
+
+
+def get_variables(statements):
+    """Returns the names of the variables read or written by statements."""
+    variables = set()
+
+    def visit(node):
+        if isinstance(node, tuple):
+            if node[0] in ['var', 'assign']:
+                variables.add(node[1])
+            for child in node[1:]:
+                visit(child)
+        elif isinstance(node, list):
+            for child in node:
+                visit(child)
+
+    visit(statements)
+    return variables
+
+
+class Spec:
+    """A program specification compiled to Python functions. evaluate runs
+    the program on ints, and evaluate_batch runs it on numpy arrays, one
+    element per input, without a loop over the inputs.
+
+    Supports assignments, including +=, -=, *=, /= and %=, if and else, and
+    expressions with integers, packet fields, state variables, arithmetic,
+    comparisons, logical operators and ternaries."""
+
+    def __init__(self, program):
+        body = get_program_body(program)
+        if body is None:
+            raise ValueError('No program function found')
+        parser = SpecParser(tokenize(body))
+        self.statements = parser.parse_statements()
+        if parser.pos != len(parser.tokens):
+            raise ValueError('Unexpected } in program body')
+        self.variables = sorted(get_variables(self.statements))
+        self.scalar_source = '\n'.join(
+            ['def program(v):'] + get_scalar_source(self.statements) +
+            ['    return v'])
+        self.vector_source = '\n'.join(
+            ['def program(v):'] + get_vector_source(self.statements) +
+            ['    return v'])
+        self.compile()
+
+    def compile(self):
+        scalar_namespace = {'c_divide': c_divide, 'c_remainder': c_remainder}
+        exec(self.scalar_source, scalar_namespace)
+        self.scalar_function = scalar_namespace['program']
+        self.vector_function = self.get_function(NUMPY_OPERATIONS)
+
+    def get_function(self, operations):
+        """Returns the program as a function from a dict of variable values
+        to a dict of their values after the program, computed with the
+        functions of operations, e.g., z3_pipeline.Z3Operations."""
+        namespace = {name: getattr(operations, name)
+                     for name in OPERATION_NAMES}
+        exec(self.vector_source, namespace)
+        return namespace['program']
+
+    def __getstate__(self):
+        # Compiled functions can't be pickled, they are compiled again from
+        # their sources.
+        state = self.__dict__.copy()
+        del state['scalar_function']
+        del state['vector_function']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.compile()
+
+    def split_result(self, values):
+        pkt_fields = OrderedDict()
+        state_vars = OrderedDict()
+        for name, value in values.items():
+            if name.startswith('pkt_'):
+                pkt_fields[name] = value
+            else:
+                state_vars[name] = value
+        return (pkt_fields, state_vars)
+
+    def evaluate(self, pkt_fields, state_vars):
+        """Given dicts from packet field and state variable names to ints,
+        returns a tuple of two such dicts with the values after the program.
+        Variables the program doesn't use are passed through, and those it
+        uses must be given."""
+        values = OrderedDict(pkt_fields)
+        values.update(state_vars)
+        return self.split_result(self.scalar_function(values))
+
+    def evaluate_batch(self, pkt_fields, state_vars):
+        """Same as evaluate, but with numpy arrays instead of ints."""
+        values = OrderedDict(
+            (name, to_int(value)) for name, value in
+            list(pkt_fields.items()) + list(state_vars.items()))
+        values = self.vector_function(values)
+        # Variables set to constants are broadcast to the batch size.
+        shape = np.broadcast(*(list(values.values()) + [0])).shape
+        return self.split_result(OrderedDict(
+            (name, np.broadcast_to(value, shape))
+            for name, value in values.items()))
+
+
+def load_spec(spec_filename):
+    with open(spec_filename) as spec_file:
+        return Spec(spec_file.read())
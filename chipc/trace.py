@@ -0,0 +1,103 @@
+"""Timing and resource use of the phases of a compilation"""
+import json
+import os
+import resource
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+def get_child_usage():
+    """Returns a tuple of the CPU time in seconds used by terminated child
+    processes, e.g., sketch, and the largest resident set size in KB of any
+    of them."""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    max_rss_kb = usage.ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB elsewhere.
+    if sys.platform == 'darwin':
+        max_rss_kb //= 1024
+    return (usage.ru_utime + usage.ru_stime, max_rss_kb)
+
+
+class Tracer:
+    """Records spans, i.e., timed phases of a compilation like sketch
+    synthesis or a z3 check, which can be nested. Each finished span is
+    appended to trace_filename as a line of JSON with its name, start time,
+    wall time, the CPU time used by child processes which terminated during
+    the span and their peak resident set size.
+
+    The peak resident set size is only known for all terminated child
+    processes so far, not per span. It is recorded if a child process which
+    terminated during the span set a new peak, and is null otherwise, e.g.,
+    if sketch used less memory than in an earlier span.
+
+    Spans of other processes, e.g., parallel_codegen workers, are appended
+    to the same file. A Tracer without trace_filename records nothing."""
+
+    def __init__(self, trace_filename=None):
+        self.trace_filename = trace_filename
+        self.depth = 0
+        if trace_filename is not None:
+            # Start a new trace.
+            open(trace_filename, 'w').close()
+
+    @contextmanager
+    def span(self, name, **args):
+        """Records the code in a with block as a span with name. args are
+        recorded with the span, e.g., the iteration or input bits."""
+        if self.trace_filename is None:
+            yield
+            return
+
+        start = time.time()
+        wall_start = time.perf_counter()
+        child_cpu_start, child_rss_start_kb = get_child_usage()
+        self.depth += 1
+        try:
+            yield
+        finally:
+            self.depth -= 1
+            wall_time = time.perf_counter() - wall_start
+            child_cpu_end, child_rss_end_kb = get_child_usage()
+            peak_child_rss_kb = child_rss_end_kb \
+                if child_rss_end_kb > child_rss_start_kb else None
+            record = OrderedDict([
+                ('name', name),
+                ('start', start),
+                ('wall_time', wall_time),
+                ('child_cpu_time', child_cpu_end - child_cpu_start),
+                ('peak_child_rss_kb', peak_child_rss_kb),
+                ('pid', os.getpid()),
+                ('depth', self.depth),
+                ('args', args)])
+            with open(self.trace_filename, 'a') as trace_file:
+                trace_file.write(json.dumps(record) + '\n')
+
+
+def load_trace(trace_filename):
+    """Returns the list of span records in a trace file of a Tracer."""
+    with open(trace_filename) as trace_file:
+        return [json.loads(line) for line in trace_file if line.strip()]
+
+
+def write_chrome_trace(trace_filename, chrome_trace_filename):
+    """Converts a trace file of a Tracer to the Chrome trace event format,
+    which can be loaded in chrome://tracing or Perfetto."""
+    events = []
+    for record in load_trace(trace_filename):
+        args = OrderedDict(record['args'])
+        args['child_cpu_time'] = record['child_cpu_time']
+        args['peak_child_rss_kb'] = record['peak_child_rss_kb']
+        # Complete events with times in microseconds.
+        events.append(OrderedDict([
+            ('name', record['name']),
+            ('cat', 'chipc'),
+            ('ph', 'X'),
+            ('ts', record['start'] * 1e6),
+            ('dur', record['wall_time'] * 1e6),
+            ('pid', record['pid']),
+            ('tid', record['pid']),
+            ('args', args)]))
+    with open(chrome_trace_filename, 'w') as chrome_trace_file:
+        json.dump({'traceEvents': events}, chrome_trace_file)
@@ -0,0 +1,225 @@
+"""Direct z3 encoding of a pipeline with concrete hole values"""
+from collections import OrderedDict
+
+import z3
+
+
+class Z3Operations:
+    """Same as pipeline_simulator.NumpyOperations, but on z3 expressions, so
+    that simulating a pipeline or evaluating a spec builds their formulas.
+    Integers are unbounded z3.Int by default, or signed bit vectors of
+    bv_width bits, like in z3_utils.get_z3_constraints."""
+
+    def __init__(self, bv_width=None):
+        self.bv_width = bv_width
+
+    def to_int(self, value):
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, int):
+            if self.bv_width is not None:
+                return z3.BitVecVal(value, self.bv_width)
+            return z3.IntVal(value)
+        if z3.is_bool(value):
+            return z3.If(value, self.to_int(1), self.to_int(0))
+        return value
+
+    def to_bool(self, value):
+        if isinstance(value, (bool, int)):
+            return z3.BoolVal(value != 0)
+        if z3.is_bool(value):
+            return value
+        return value != 0
+
+    def where(self, condition, yes_val, no_val):
+        return z3.If(self.to_bool(condition), self.to_int(yes_val),
+                     self.to_int(no_val))
+
+    def logical_not(self, value):
+        return z3.Not(self.to_bool(value))
+
+    def logical_and(self, operand1, operand2):
+        return z3.And(self.to_bool(operand1), self.to_bool(operand2))
+
+    def logical_or(self, operand1, operand2):
+        return z3.Or(self.to_bool(operand1), self.to_bool(operand2))
+
+    def logical_xor(self, operand1, operand2):
+        return z3.Xor(self.to_bool(operand1), self.to_bool(operand2))
+
+    def divide(self, dividend, divisor):
+        # Rounds towards zero, and division by zero yields zero, like
+        # pipeline_simulator.divide.
+        dividend, divisor = self.to_int(dividend), self.to_int(divisor)
+        if self.bv_width is not None:
+            # / is signed division rounding towards zero for bit vectors.
+            quotient = dividend / divisor
+        else:
+            # Integer division in z3 only rounds towards zero if both
+            # operands are non-negative.
+            quotient = self.absolute(dividend) / self.absolute(divisor)
+            quotient = z3.If((dividend < 0) == (divisor < 0), quotient,
+                             -quotient)
+        return z3.If(divisor == 0, self.to_int(0), quotient)
+
+    def absolute(self, value):
+        return z3.If(value < 0, -value, value)
+
+    def remainder(self, dividend, divisor):
+        dividend, divisor = self.to_int(dividend), self.to_int(divisor)
+        return dividend - self.divide(dividend, divisor) * divisor
+
+    def mux(self, inputs, ctrl):
+        """Same as pipeline_simulator.mux, also for a z3 expression ctrl,
+        e.g., a hole to be synthesized."""
+        if not z3.is_expr(ctrl):
+            return inputs[min(ctrl, len(inputs) - 1)]
+        if all(isinstance(value, bool) or z3.is_bool(value)
+               for value in inputs):
+            convert = self.to_bool
+        else:
+            convert = self.to_int
+        result = convert(inputs[-1])
+        for index in reversed(range(len(inputs) - 1)):
+            result = z3.If(ctrl == index, convert(inputs[index]), result)
+        return result
+
+    def get_hole_value(self, value):
+        return value if z3.is_expr(value) else int(value)
+
+    def get_constants(self, constants):
+        if isinstance(constants, SymbolicConstants):
+            return constants
+        return [int(c) for c in constants]
+
+    def get_batch_size(self, values):
+        # Each value is a single expression.
+        return 1
+
+    def broadcast(self, value, batch_size):
+        return self.to_int(value)
+
+    def full(self, value, batch_size):
+        if isinstance(value, bool):
+            return z3.BoolVal(value)
+        return self.to_int(value)
+
+
+class SymbolicConstants:
+    """The constant vector of a sketch as a z3 function from indices to
+    constants, so that holes indexing it, e.g., const and immediate_operand
+    holes, can be unknowns. Formulas using it stay valid when constants are
+    appended to the vector, only get_definitions has to be asserted for the
+    new ones."""
+
+    def __init__(self, bv_width=None):
+        sort = z3.IntSort() if bv_width is None else z3.BitVecSort(bv_width)
+        self.operations = Z3Operations(bv_width)
+        self.function = z3.Function('constant_vector', sort, sort)
+
+    def __getitem__(self, index):
+        return self.function(self.operations.to_int(index))
+
+    def get_definitions(self, constants, start=0):
+        """Returns formulas setting the function to constants, from index
+        start on."""
+        return [self.function(self.operations.to_int(index)) ==
+                self.operations.to_int(int(constants[index]))
+                for index in range(start, len(constants))]
+
+
+def get_inputs(input_names, input_bits, bv_width=None):
+    """Returns a tuple of dicts from packet field and state variable names
+    to z3 variables, and the list of z3 formulas restricting them to
+    input_bits bits. The variables are named like the source variables of
+    sketch, so that z3_utils.get_counterexamples_from_model finds them."""
+    pkt_fields = OrderedDict()
+    state_vars = OrderedDict()
+    variable_ranges = []
+    for name in input_names:
+        values = pkt_fields if name.startswith('pkt_') else state_vars
+        if bv_width is None:
+            values[name] = z3.Int(name)
+            variable_ranges += [0 <= values[name],
+                                values[name] < 2**input_bits]
+        else:
+            # Bit vector variables can't be out of range.
+            assert input_bits < bv_width, (
+                'Bit vector width %d must be larger than input bits %d' % (
+                    bv_width, input_bits))
+            values[name] = z3.ZeroExt(bv_width - input_bits,
+                                      z3.BitVec(name, input_bits))
+    return (pkt_fields, state_vars, variable_ranges)
+
+
+class SpecEncoding:
+    """The inputs of input_bits bits and what the spec outputs for them, as
+    z3 constants defined by constraints. The constraints are the same for
+    all candidates, so z3_utils.IncrementalVerifier asserts them once, and
+    only get_negated_query is checked per candidate.
+
+    Args:
+        spec: A spec_interpreter.Spec.
+        operations: The Z3Operations of the pipeline simulator.
+        input_names: The names of the packet fields and state variables the
+            pipeline and the spec read.
+        input_bits: The number of bits of the inputs.
+    """
+
+    def __init__(self, spec, operations, input_names, input_bits):
+        self.pkt_fields, self.state_vars, self.constraints = get_inputs(
+            input_names, input_bits, operations.bv_width)
+        values = OrderedDict(self.pkt_fields)
+        values.update(self.state_vars)
+        expected_values = OrderedDict()
+        for name, value in spec.get_function(operations)(values).items():
+            # Not named like a source variable of sketch, so that
+            # z3_utils.get_counterexamples_from_model skips it.
+            expected_values[name] = z3.Const('spec_' + name,
+                                             operations.to_int(0).sort())
+            self.constraints.append(
+                expected_values[name] == operations.to_int(value))
+        self.expected_pkt_fields, self.expected_state_vars = \
+            spec.split_result(expected_values)
+
+    def get_negated_query(self, pipeline_simulator, hole_assignments,
+                          constants):
+        """Returns a z3 formula whose models, together with the constraints,
+        are inputs for which the pipeline with the hole value assignments
+        and the spec differ in an output packet field or output state group,
+        or for which an ALU reaches assert(false), like
+        z3_utils.get_z3_negated_query of the DAG of a verify sketch.
+
+        Args:
+            pipeline_simulator: A pipeline_simulator.PipelineSimulator with
+                the Z3Operations of the encoding.
+            hole_assignments: A dict from hole names to values.
+            constants: The constant vector of the sketch.
+        """
+        result_pkt_fields, result_state_vars, failed = \
+            pipeline_simulator.simulate_with_failures(
+                hole_assignments, constants, self.pkt_fields,
+                self.state_vars)
+        return z3.Or(failed, z3.Not(z3.And(
+            [z3.BoolVal(True)] + get_output_equalities(
+                pipeline_simulator, result_pkt_fields, result_state_vars,
+                self.expected_pkt_fields, self.expected_state_vars))))
+
+
+def get_output_equalities(pipeline_simulator, result_pkt_fields,
+                          result_state_vars, expected_pkt_fields,
+                          expected_state_vars):
+    """Returns the list of z3 formulas stating that the output packet fields
+    and output state groups of the pipeline have the expected values."""
+    operations = pipeline_simulator.operations
+    equalities = []
+    for field in pipeline_simulator.output_packet_fields:
+        name = 'pkt_' + str(field)
+        equalities.append(operations.to_int(result_pkt_fields[name]) ==
+                          operations.to_int(expected_pkt_fields[name]))
+    for group in pipeline_simulator.output_state_groups:
+        for name in pipeline_simulator.get_state_var_names(group):
+            equalities.append(
+                operations.to_int(result_state_vars[name]) ==
+                operations.to_int(expected_state_vars[name]))
+    return equalities
@@ -0,0 +1,200 @@
+"""Synthesis of hole values with z3 instead of sketch"""
+import itertools
+import random
+import re
+from collections import OrderedDict
+
+import z3
+
+from chipc.compiler import get_input_space_size
+from chipc.pipeline_simulator import PipelineSimulator
+from chipc.spec_interpreter import get_vector_expression
+from chipc.spec_interpreter import OPERATION_NAMES
+from chipc.spec_interpreter import SpecParser
+from chipc.spec_interpreter import tokenize
+from chipc.z3_pipeline import get_output_equalities
+from chipc.z3_pipeline import SymbolicConstants
+from chipc.z3_pipeline import Z3Operations
+
+# Candidates of the first iteration are correct on all inputs of
+# Z3Backend.input_bits bits if there are at most this many, and on this many
+# random ones otherwise.
+NUM_INITIAL_INPUTS = 16
+
+# Holes whose values are indices into the constant vector.
+CONSTANT_INDEX_PATTERN = re.compile(
+    r'_(immediate_operand|const_\d+(_global)?)$')
+
+
+def get_predicate(predicate, values, operations):
+    """Returns a z3 formula for a predicate on holes in sketch syntax, e.g.,
+    an assert of SketchCodeGenerator.constraints_ or a hole elimination
+    assert, given a dict from hole names to z3 variables."""
+    # The spec parser only reads variables of state_and_packet.
+    tokens = tokenize(re.sub(r'\b([A-Za-z_]\w*)', r'state_and_packet.\1',
+                             predicate))
+    parser = SpecParser(tokens)
+    expression = parser.parse_expression()
+    if parser.pos != len(tokens):
+        raise ValueError('Unexpected text in predicate ' + predicate)
+    namespace = {name: getattr(operations, name) for name in OPERATION_NAMES}
+    namespace['v'] = values
+    return operations.to_bool(eval(get_vector_expression(expression),
+                                   namespace))
+
+
+class Z3Backend:
+    """Synthesizes hole values with z3 in the compiler process instead of
+    running sketch, see compiler.SketchBackend. Candidates are correct on the
+    counterexamples of all earlier iterations and on inputs of input_bits
+    bits, see NUM_INITIAL_INPUTS, like sketch candidates are correct on all
+    inputs of --bnd-inbits bits.
+
+    Holes are z3 variables, or bit vectors with bv_width of the Compiler, and
+    each counterexample is the pipeline simulated on them with
+    z3_pipeline.Z3Operations. Counterexamples are asserted once in a solver
+    kept across iterations, so that z3 reuses what it learned, while hole
+    ranges and constraints, which change with the constants, are asserted
+    for a single check.
+
+    Needs a spec supported by the spec interpreter for the expected outputs,
+    and doesn't support synthesized allocation."""
+
+    # Everything happens in this process.
+    parallel = False
+
+    def __init__(self, input_bits=2, num_initial_inputs=NUM_INITIAL_INPUTS,
+                 seed=1):
+        self.input_bits = input_bits
+        self.num_initial_inputs = num_initial_inputs
+        self.seed = seed
+        self.solver = None
+
+    def setup(self, compiler):
+        assert compiler.spec is not None, (
+            'The z3 backend needs a spec supported by the spec interpreter')
+        assert not compiler.synthesized_allocation, (
+            'The z3 backend does not support synthesized allocation')
+        self.bv_width = compiler.bv_width
+        self.operations = Z3Operations(compiler.bv_width)
+        self.pipeline_simulator = PipelineSimulator(
+            compiler.sketch_code_generator, self.operations)
+        self.holes = OrderedDict()
+        self.constants = SymbolicConstants(compiler.bv_width)
+        self.constant_values = []
+        self.testcases = []
+        self.solver = z3.Solver()
+        self.add_counterexamples(compiler, self.get_initial_inputs(compiler))
+
+    def get_initial_inputs(self, compiler):
+        input_names = compiler.get_input_names()
+        values = range(2**self.input_bits)
+        if get_input_space_size(len(input_names), self.input_bits) <= \
+                self.num_initial_inputs:
+            inputs = list(itertools.product(values, repeat=len(input_names)))
+        else:
+            rng = random.Random(self.seed)
+            inputs = [[rng.choice(values) for _ in input_names]
+                      for _ in range(self.num_initial_inputs)]
+        return [
+            (OrderedDict((name, value) for name, value in zip(
+                input_names, input_values) if name.startswith('pkt_')),
+             OrderedDict((name, value) for name, value in zip(
+                 input_names, input_values) if not name.startswith('pkt_')))
+            for input_values in inputs]
+
+    def update_holes(self, compiler):
+        """Creates variables for new holes and returns the holes of the
+        current hardware, whose ranges depend on the constants."""
+        generator = compiler.sketch_code_generator
+        generator.generate_hardware()
+        for hole in generator.holes_:
+            if hole.name not in self.holes:
+                self.holes[hole.name] = z3.Int(hole.name) \
+                    if self.bv_width is None \
+                    else z3.BitVec(hole.name, self.bv_width)
+        return generator.holes_
+
+    def get_hole_range(self, hole, num_constants):
+        max_value = hole.max
+        if CONSTANT_INDEX_PATTERN.search(hole.name):
+            max_value = min(max_value, num_constants - 1)
+        var = self.holes[hole.name]
+        if self.bv_width is not None:
+            return z3.ULE(var, max_value)
+        return z3.And(0 <= var, var <= max_value)
+
+    def add_counterexamples(self, compiler, counterexamples):
+        if self.solver is None:
+            self.setup(compiler)
+        self.update_holes(compiler)
+        for pkt_fields, state_vars in counterexamples:
+            # Inputs missing in counterexamples can be anything.
+            values = OrderedDict(
+                (name, 0) for name in compiler.get_input_names())
+            values.update(pkt_fields)
+            values.update(state_vars)
+            values = OrderedDict((name, int(value))
+                                 for name, value in values.items())
+            pkt_fields, state_vars = compiler.spec.split_result(values)
+            expected_pkt_fields, expected_state_vars = \
+                compiler.spec.evaluate(pkt_fields, state_vars)
+            result_pkt_fields, result_state_vars, failed = \
+                self.pipeline_simulator.simulate_with_failures(
+                    self.holes, self.constants, pkt_fields, state_vars)
+            # Like in sketch, candidates may not reach assert(false).
+            testcase = z3.And([z3.Not(failed)] + get_output_equalities(
+                self.pipeline_simulator, result_pkt_fields,
+                result_state_vars, expected_pkt_fields, expected_state_vars))
+            self.testcases.append(testcase)
+            self.solver.add(testcase)
+
+    def update_constants(self, constants):
+        constants = [int(c) for c in constants]
+        if constants[:len(self.constant_values)] != self.constant_values:
+            # Constants were replaced rather than appended, start over with
+            # the same testcases.
+            self.solver = z3.Solver()
+            self.solver.add(self.testcases)
+            self.constant_values = []
+        self.solver.add(self.constants.get_definitions(
+            constants, len(self.constant_values)))
+        self.constant_values = constants
+
+    def synthesize(self, compiler, compiler_input):
+        additional_constraints = compiler_input[0]
+        if self.solver is None:
+            self.setup(compiler)
+        holes = self.update_holes(compiler)
+        self.update_constants(compiler.constant_set)
+        generator = compiler.sketch_code_generator
+        print('Total number of hole bits is', generator.total_hole_bits_)
+        print('Synthesizing with z3 from', len(self.testcases), 'testcases')
+
+        hole_assignments = OrderedDict()
+        with compiler.tracer.span('synthesize', backend='z3',
+                                  hole_bits=generator.total_hole_bits_):
+            self.solver.push()
+            try:
+                self.solver.add([
+                    self.get_hole_range(hole, len(self.constant_values))
+                    for hole in holes])
+                self.solver.add([
+                    get_predicate(predicate, self.holes, self.operations)
+                    for predicate in generator.constraints_ +
+                    list(additional_constraints)])
+                result = self.solver.check()
+                if result == z3.sat:
+                    model = self.solver.model()
+                    for hole in holes:
+                        hole_assignments[hole.name] = str(model.eval(
+                            self.holes[hole.name],
+                            model_completion=True).as_long())
+            finally:
+                self.solver.pop()
+
+        if result != z3.sat:
+            return (1, 'z3 returned ' + str(result) + ' for ' +
+                    str(len(self.testcases)) + ' testcases', hole_assignments)
+        return (0, '\n'.join(name + ' = ' + value for name, value in
+                             hole_assignments.items()), hole_assignments)
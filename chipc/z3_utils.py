@@ -3,6 +3,9 @@ import re
 
 import z3
 
+from chipc import sketch_dag
+from chipc.z3_pipeline import Z3Operations
+
 
 def parse_smt2_file(smt2_filename):
     """Reads a smt2 file and returns the first formula.
@@ -24,7 +27,7 @@ def parse_smt2_file(smt2_filename):
 
 
 def negated_body(formula):
-    """Given a z3.QuantiferRef formula with z3.Int variables,
+    """Given a z3.QuantiferRef formula with z3.Int or z3.BitVec variables,
     return negation of the body.
 
     Returns:
@@ -32,8 +35,9 @@ def negated_body(formula):
     """
     assert z3.is_quantifier(formula), ('Formula is not a quantifier:\n',
                                        formula)
-    var_names = [formula.var_name(i) for i in range(formula.num_vars())]
-    vs = [z3.Int(n) for n in var_names]
+    # Bound variables are either z3.Int or z3.BitVec, see get_z3_formula.
+    vs = [z3.Const(formula.var_name(i), formula.var_sort(i))
+          for i in range(formula.num_vars())]
 
     # Here simply doing z3.Not(formula.body()) doesn't work. formula.body()
     # returns an expression without any bounded variable, i.e., it refers
@@ -44,39 +48,34 @@ def negated_body(formula):
     return z3.Not(z3.substitute_vars(formula.body(), *reversed(vs)))
 
 
-def generate_counterexamples(formula):
-    """Given a z3 formula generated from a sketch, returns counterexample
-    values for the formula.
+def create_solver():
+    z3_slv = z3.Solver()
+    # Random seed is set for determinism. Counterexamples come from models,
+    # which need neither proofs nor unsat cores.
+    z3_slv.set(random_seed=1)
+    return z3_slv
 
-    Returns:
-        A tuple of two dicts from string to ints, where the first one
-        represents counterexamples for packet variables and the second for
-        state group variables.
-    """
-    # We negate the body of formula, and check whether the new formula is
-    # satisfiable. If so, we extract the input values and they are
-    # counterexamples for the original formula. Otherwise, the original formula
-    # is satisfiable and there is no counterexample.
-    new_formula = negated_body(formula)
 
-    z3_slv = z3.Solver()
-    # To get counterexamples we need to set proof and unsat_core. Random seed
-    # is set for determinism.
-    z3_slv.set(proof=True, unsat_core=True, random_seed=1)
-    z3_slv.add(new_formula)
+def get_input_values(model):
+    """Returns a list of (variable, value) tuples for the packet and state
+    group variables in model."""
+    input_values = []
+    for var in model.decls():
+        if re.match(r'(pkt_\d+|state_group_\d+_state_\d+)', var.name()):
+            input_values.append((var, model.get_interp(var)))
+    return input_values
 
+
+def get_counterexamples_from_model(model):
+    """Returns a tuple of two dicts from string to ints, where the first one
+    represents counterexamples for packet variables and the second for state
+    group variables in model."""
     # Use OrderedDict here for deterministic compilation results. We can also
     # use built-in dict() for Python versions 3.6 and later, as it's inherently
     # ordered.
     pkt_fields = collections.OrderedDict()
     state_vars = collections.OrderedDict()
 
-    result = z3_slv.check()
-    if result != z3.sat:
-        print('Failed to generate counterexamples, z3 returned', result)
-        return (pkt_fields, state_vars)
-
-    model = z3_slv.model()
     for var in model.decls():
         value = model.get_interp(var).as_long()
         match_object = re.match(r'pkt_\d+', var.name())
@@ -93,20 +92,173 @@ def generate_counterexamples(formula):
     return (pkt_fields, state_vars)
 
 
+def get_counterexamples_from_solver(z3_slv):
+    """Checks the formulas asserted in z3_slv and returns counterexample values
+    from its model, if any.
+
+    Returns:
+        A tuple of two dicts from string to ints, where the first one
+        represents counterexamples for packet variables and the second for
+        state group variables.
+    """
+    result = z3_slv.check()
+    if result != z3.sat:
+        print('Failed to generate counterexamples, z3 returned', result)
+        return (collections.OrderedDict(), collections.OrderedDict())
+
+    return get_counterexamples_from_model(z3_slv.model())
+
+
+def get_multiple_counterexamples_from_solver(z3_slv, num_counterexamples):
+    """Returns a list of up to num_counterexamples counterexample tuples, as
+    returned by get_counterexamples_from_solver, for the formulas asserted in
+    z3_slv. Blocking clauses are added to z3_slv, so callers should scope it
+    with push and pop.
+
+    To make counterexamples diverse, each one is first searched with every
+    input different from its values in all earlier counterexamples. Only if
+    there is none, the next one just has to differ in at least one input."""
+    counterexamples = []
+    seen_values = []
+    while len(counterexamples) < num_counterexamples:
+        model = None
+        if seen_values:
+            z3_slv.push()
+            z3_slv.add([var() != value for var, value in seen_values])
+            if z3_slv.check() == z3.sat:
+                model = z3_slv.model()
+            z3_slv.pop()
+        if model is None:
+            result = z3_slv.check()
+            if result != z3.sat:
+                if not counterexamples:
+                    print('Failed to generate counterexamples, z3 returned',
+                          result)
+                break
+            model = z3_slv.model()
+
+        counterexample = get_counterexamples_from_model(model)
+        # Different source variables may map to the same packet field.
+        if counterexample not in counterexamples:
+            counterexamples.append(counterexample)
+        input_values = get_input_values(model)
+        if not input_values:
+            # Nothing to block, the same model would be found again.
+            break
+        seen_values += input_values
+        # Blocking clause, so that no counterexample is found twice.
+        z3_slv.add(z3.Or([var() != value for var, value in input_values]))
+
+    return counterexamples
+
+
+def generate_counterexamples(formula):
+    """Given a z3 formula generated from a sketch, returns counterexample
+    values for the formula.
+
+    Returns:
+        A tuple of two dicts from string to ints, where the first one
+        represents counterexamples for packet variables and the second for
+        state group variables.
+    """
+    # We negate the body of formula, and check whether the new formula is
+    # satisfiable. If so, we extract the input values and they are
+    # counterexamples for the original formula. Otherwise, the original formula
+    # is satisfiable and there is no counterexample.
+    new_formula = negated_body(formula)
+
+    z3_slv = create_solver()
+    z3_slv.add(new_formula)
+    return get_counterexamples_from_solver(z3_slv)
+
+
+class IncrementalVerifier:
+    """Generates counterexamples for a sequence of formulas, e.g., one per
+    CEGIS iteration, with z3 solvers that outlive them. Each formula is
+    checked within a push/pop scope, so the solver and what it learned
+    outlives the formula.
+
+    What all queries of a key have in common, e.g., the spec outputs and
+    input ranges of direct verification at a bit width, can be asserted once
+    in the solver of the key with set_base, so that only the rest of each
+    query is pushed and popped.
+    """
+
+    def __init__(self):
+        # Solvers by key, created on first use, as z3 solvers can't be
+        # pickled and the owning Compiler is sent to other processes by
+        # parallel_codegen. Bases hold z3 expressions, so they go too.
+        self.solvers = {}
+        self.bases = {}
+        self.num_checks = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['solvers'] = {}
+        state['bases'] = {}
+        return state
+
+    def get_base(self, key):
+        """Returns the base set for key, or None if there is none."""
+        return self.bases.get(key)
+
+    def set_base(self, key, base, constraints):
+        """Asserts constraints once in a new solver for key, whose queries
+        are about base, e.g., a z3_pipeline.SpecEncoding."""
+        z3_slv = create_solver()
+        z3_slv.add(constraints)
+        self.solvers[key] = z3_slv
+        self.bases[key] = base
+
+    def generate_counterexamples(self, formula):
+        """Same as generate_counterexamples above, but reuses the solver."""
+        return self.generate_counterexamples_from_query(negated_body(formula))
+
+    def generate_counterexamples_from_query(self, negated_query):
+        """Returns counterexamples from a model of negated_query, e.g., from
+        get_z3_negated_query."""
+        counterexamples = self.generate_multiple_counterexamples_from_query(
+            negated_query, 1)
+        if not counterexamples:
+            return (collections.OrderedDict(), collections.OrderedDict())
+        return counterexamples[0]
+
+    def generate_multiple_counterexamples_from_query(self, negated_query,
+                                                     num_counterexamples,
+                                                     key=None):
+        """Returns a list of up to num_counterexamples diverse
+        counterexamples for negated_query, together with the base of key if
+        there is one. The list is empty if there is no counterexample."""
+        if key not in self.solvers:
+            self.solvers[key] = create_solver()
+        z3_slv = self.solvers[key]
+        self.num_checks += 1
+        z3_slv.push()
+        try:
+            z3_slv.add(negated_query)
+            return get_multiple_counterexamples_from_solver(
+                z3_slv, num_counterexamples)
+        finally:
+            z3_slv.pop()
+
+
 def check_sort(z3_var):
-    assert (z3.is_bool(z3_var) or z3.is_int(z3_var)),\
+    assert (z3.is_bool(z3_var) or z3.is_int(z3_var) or z3.is_bv(z3_var)),\
         str(z3_var) + ' has unsupported type ' + str(type(z3_var))
 
 
-def make_int(z3_var):
+def make_int(z3_var, bv_width=None):
     if z3.is_bool(z3_var):
+        if bv_width is not None:
+            return z3.If(z3_var, z3.BitVecVal(1, bv_width),
+                         z3.BitVecVal(0, bv_width))
         return z3.If(z3_var, 1, 0)
     else:
         return z3_var
 
 
 def make_bool(z3_var):
-    if z3.is_int(z3_var):
+    if not z3.is_bool(z3_var):
         # Use > 0 to convert int to bool as per BooleanNodes.h
         # in the SKETCH code base.
         return z3_var > 0
@@ -114,136 +266,166 @@ def make_bool(z3_var):
         return z3_var
 
 
-def get_z3_formula(sketch_ir: str, input_bits: int) -> z3.QuantifierRef:
-    """Given an intermediate representation of a sketch file and returns a z3
-    formula corresponding to that IR with the specified input bits for source
-    variables."""
-
-    z3_vars = collections.OrderedDict()
-    z3_asserts = []
+def get_z3_constraints(sketch_ir, input_bits: int, bv_width: int = None):
+    """Given an intermediate representation of a sketch file, either as text
+    or as a sketch_dag.SketchDag, returns a tuple
+    of the list of z3 formulas for its asserts, the list of z3 formulas
+    restricting source variables to the specified input bits and the list of
+    source variables. Each DAG node is converted once, so nodes used by
+    multiple other nodes are shared.
+
+    By default, integers are encoded as unbounded z3.Int and source variables
+    are constrained to the input range. If bv_width is given, integers are
+    encoded as signed bit vectors of that width instead, which z3 solves by
+    bit-blasting and which wrap around like fixed-width hardware. Source
+    variables are then input_bits wide bit vectors, zero-extended to bv_width,
+    so their range needs no constraints."""
+    if bv_width is not None:
+        # Leave room for the sign bit, so inputs are non-negative as with
+        # z3.Int.
+        assert input_bits < bv_width, (
+            'Bit vector width %d must be larger than input bits %d' % (
+                bv_width, input_bits))
+
+    def to_int(z3_var):
+        return make_int(z3_var, bv_width)
+
+    operations = Z3Operations(bv_width)
+
+    def make_if(predicate, yes_val, no_val):
+        # z3 converts bools to integers by itself, but not to bit vectors.
+        if bv_width is not None and z3.is_bool(yes_val) != z3.is_bool(no_val):
+            yes_val, no_val = to_int(yes_val), to_int(no_val)
+        return z3.If(predicate, yes_val, no_val)
+
+    if isinstance(sketch_ir, str):
+        sketch_ir = sketch_dag.parse_dag(sketch_ir)
+    dag = sketch_ir
+
+    # z3 formulas of each node, indexed by node id.
+    z3_nodes = [None] * len(dag)
     z3_srcs = []
-    for line in sketch_ir.splitlines():
-        records = line.split()
-        start = records[0]
-        if (start in ['dag', 'TUPLE_DEF']):
+    for node in range(len(dag)):
+        operation = dag.operations[node]
+        operand_ids = dag.get_operands(node)
+        # Unused operands are -1 and not looked up.
+        operands = [z3_nodes[i] for i in operand_ids if i >= 0]
+
+        if operation in sketch_dag.UNARY_OPERATIONS:
+            operand1, = operands
+            check_sort(operand1)
+        elif operation in sketch_dag.BINARY_OPERATIONS:
+            operand1, operand2 = operands
+            check_sort(operand1)
+            check_sort(operand2)
+
+        if operation == sketch_dag.ASSERT:
             continue
-        else:
-            # common processing across all nodes
-            output_var = '_n' + records[0]
-            operation = records[2]
-            if operation in ['NEG', 'NOT']:
-                operand1 = z3_vars['_n' + records[4]]
-                check_sort(operand1)
-            elif operation in ['AND', 'OR', 'XOR', 'PLUS',
-                               'TIMES', 'DIV', 'MOD', 'LT',
-                               'EQ']:
-                operand1 = z3_vars['_n' + records[4]]
-                operand2 = z3_vars['_n' + records[5]]
-                check_sort(operand1)
-                check_sort(operand2)
-
-            # node-specific processing
-            if operation == 'ASSERT':
-                z3_asserts += ['_n' + records[3]]
-            elif operation == 'S':
-                var_type = records[3]
-                source_name = records[4]
-                assert var_type == 'INT', ('Unexpected variable type found in \
-                        sketch IR:', line)
-                z3_vars[source_name] = z3.Int(source_name)
-                z3_vars[output_var] = z3.Int(source_name)
-                z3_srcs += [source_name]
-            elif operation in ['NEG']:
-                z3_vars[output_var] = -make_int(operand1)
-            elif operation in ['NOT']:
-                z3_vars[output_var] = z3.Not(make_bool(operand1))
-            elif operation in [
-                    'AND', 'OR', 'XOR', 'PLUS', 'TIMES', 'DIV', 'MOD', 'LT',
-                    'EQ'
-            ]:
-                if operation == 'AND':
-                    z3_vars[output_var] = z3.And(
-                        make_bool(operand1), make_bool(operand2))
-                elif operation == 'OR':
-                    z3_vars[output_var] = z3.Or(
-                        make_bool(operand1), make_bool(operand2))
-                elif operation == 'XOR':
-                    z3_vars[output_var] = z3.Xor(
-                        make_bool(operand1), make_bool(operand2))
-                elif operation == 'PLUS':
-                    z3_vars[output_var] = make_int(
-                        operand1) + make_int(operand2)
-                elif operation == 'TIMES':
-                    z3_vars[output_var] = make_int(
-                        operand1) * make_int(operand2)
-                elif operation == 'DIV':
-                    z3_vars[output_var] = make_int(
-                        operand1) / make_int(operand2)
-                elif operation == 'MOD':
-                    z3_vars[output_var] = make_int(
-                        operand1) % make_int(operand2)
-                elif operation == 'LT':
-                    z3_vars[output_var] = make_int(
-                        operand1) < make_int(operand2)
-                elif operation == 'EQ':
-                    z3_vars[output_var] = make_int(
-                        operand1) == make_int(operand2)
-                else:
-                    assert False, ('Invalid operation', operation)
-            # One can consider ARRACC and ARRASS as array access and
-            # assignment. For more details please refer this sketchusers
-            # mailing list thread.
-            # https://lists.csail.mit.edu/pipermail/sketchusers/2019-August/000104.html
-            elif operation in ['ARRACC']:
-                predicate = make_bool((z3_vars['_n' + records[4]]))
-                yes_val = z3_vars['_n' + records[7]]
-                no_val = z3_vars['_n' + records[6]]
-                z3_vars[output_var] = z3.If(predicate, yes_val, no_val)
-            elif operation in ['ARRASS']:
-                var_type = type(z3_vars['_n' + records[4]])
-                if var_type == z3.BoolRef:
-                    assert records[6] in ['0', '1']
-                    cmp_constant = records[6] == '1'
-                elif var_type == z3.ArithRef:
-                    cmp_constant = int(records[6])
-                else:
-                    assert False, ('Variable type', var_type, 'not supported')
-                predicate = z3_vars['_n' + records[4]] == cmp_constant
-                yes_val = z3_vars['_n' + records[8]]
-                no_val = z3_vars['_n' + records[7]]
-                z3_vars[output_var] = z3.If(predicate, yes_val, no_val)
-            elif operation in ['CONST']:
-                var_type = records[3]
-                if var_type == 'INT':
-                    z3_vars[output_var] = z3.IntVal(int(records[4]))
-                elif var_type == 'BOOL':
-                    assert records[4] in ['0', '1']
-                    z3_vars[output_var] = z3.BoolVal(records[4] == '1')
-                else:
-                    assert False, ('Constant type', var_type, 'not supported')
+        elif operation == sketch_dag.S:
+            source_name = dag.source_names[len(z3_srcs)]
+            if bv_width is None:
+                z3_src = z3.Int(source_name)
+                z3_nodes[node] = z3_src
+            else:
+                z3_src = z3.BitVec(source_name, input_bits)
+                z3_nodes[node] = z3.ZeroExt(bv_width - input_bits, z3_src)
+            z3_srcs.append(z3_src)
+        elif operation == sketch_dag.NEG:
+            z3_nodes[node] = -to_int(operand1)
+        elif operation == sketch_dag.NOT:
+            z3_nodes[node] = z3.Not(make_bool(operand1))
+        elif operation == sketch_dag.AND:
+            z3_nodes[node] = z3.And(make_bool(operand1), make_bool(operand2))
+        elif operation == sketch_dag.OR:
+            z3_nodes[node] = z3.Or(make_bool(operand1), make_bool(operand2))
+        elif operation == sketch_dag.XOR:
+            z3_nodes[node] = z3.Xor(make_bool(operand1), make_bool(operand2))
+        elif operation == sketch_dag.PLUS:
+            z3_nodes[node] = to_int(operand1) + to_int(operand2)
+        elif operation == sketch_dag.TIMES:
+            z3_nodes[node] = to_int(operand1) * to_int(operand2)
+        elif operation == sketch_dag.DIV:
+            # Sketch divides like C, rounding towards zero, while / on z3.Int
+            # doesn't for negative operands. Same as in direct verification.
+            z3_nodes[node] = operations.divide(to_int(operand1),
+                                               to_int(operand2))
+        elif operation == sketch_dag.MOD:
+            # Takes the sign of the dividend like sketch.
+            z3_nodes[node] = operations.remainder(to_int(operand1),
+                                                  to_int(operand2))
+        elif operation == sketch_dag.LT:
+            # < is signed comparison for bit vectors.
+            z3_nodes[node] = to_int(operand1) < to_int(operand2)
+        elif operation == sketch_dag.EQ:
+            z3_nodes[node] = to_int(operand1) == to_int(operand2)
+        # One can consider ARRACC and ARRASS as array access and
+        # assignment. For more details please refer this sketchusers
+        # mailing list thread.
+        # https://lists.csail.mit.edu/pipermail/sketchusers/2019-August/000104.html
+        elif operation == sketch_dag.ARRACC:
+            predicate, no_val, yes_val = operands
+            z3_nodes[node] = make_if(make_bool(predicate), yes_val, no_val)
+        elif operation == sketch_dag.ARRASS:
+            compared, no_val, yes_val = operands
+            if z3.is_bool(compared):
+                assert dag.values[node] in [0, 1]
+                cmp_constant = dag.values[node] == 1
+            else:
+                cmp_constant = dag.values[node]
+            z3_nodes[node] = make_if(compared == cmp_constant, yes_val,
+                                     no_val)
+        elif operation == sketch_dag.CONST:
+            if dag.types[node] == sketch_dag.BOOL:
+                z3_nodes[node] = z3.BoolVal(dag.values[node] == 1)
+            elif bv_width is not None:
+                z3_nodes[node] = z3.BitVecVal(dag.values[node], bv_width)
             else:
-                assert False, ('Unknown operation:', line)
+                z3_nodes[node] = z3.IntVal(dag.values[node])
+        else:
+            assert False, ('Unknown operation:',
+                           sketch_dag.OPERATIONS[operation])
+
+    # Bit vector source variables can't be out of range.
+    variable_ranges = []
+    for var in z3_srcs if bv_width is None else []:
+        variable_ranges += [0 <= var, var < 2**input_bits]
+
+    return ([z3_nodes[node] for node in dag.asserts], variable_ranges,
+            z3_srcs)
+
+
+def get_z3_formula(sketch_ir, input_bits: int,
+                   bv_width: int = None) -> z3.QuantifierRef:
+    """Given an intermediate representation of a sketch file and returns a z3
+    formula corresponding to that IR with the specified input bits for source
+    variables. See get_z3_constraints for sketch_ir and bv_width."""
+    constraints, variable_ranges, srcs = get_z3_constraints(
+        sketch_ir, input_bits, bv_width)
 
     # To handle cases where we don't have any assert or source variable, add
     # a dummy bool variable.
-    constraints = z3.BoolVal(True)
-    for var in z3_asserts:
-        constraints = z3.And(constraints, z3_vars[var])
-
-    variable_range = z3.BoolVal(True)
-    for var in z3_srcs:
-        variable_range = z3.And(
-            variable_range,
-            z3.And(0 <= z3_vars[var], z3_vars[var] < 2**input_bits))
-
-    final_assert = z3.ForAll([z3_vars[x] for x in z3_srcs],
-                             z3.Implies(variable_range, constraints))
+    final_assert = z3.ForAll(
+        srcs,
+        z3.Implies(z3.And([z3.BoolVal(True)] + variable_ranges),
+                   z3.And([z3.BoolVal(True)] + constraints)))
     # We could use z3.simplify on the final assert, however that could result
     # in a formula that is oversimplified and doesn't have a QuantfierRef which
     # is expected from the negated_body() function above.
     return final_assert
 
 
+def get_z3_negated_query(sketch_ir, input_bits: int,
+                         bv_width: int = None) -> z3.BoolRef:
+    """Same as negated_body(get_z3_formula(sketch_ir, input_bits, bv_width)),
+    but builds the quantifier-free formula directly, with a flat z3.And over
+    the input ranges and the negated asserts. A model of it is a
+    counterexample."""
+    constraints, variable_ranges, _ = get_z3_constraints(
+        sketch_ir, input_bits, bv_width)
+    return z3.And(variable_ranges +
+                  [z3.Not(z3.And([z3.BoolVal(True)] + constraints))])
+
+
 def simple_check(smt2_filename):
     """Given a smt2 file generated from a sketch, parses assertion from the
     file and checks with z3. We assume that the file already has input bit
@@ -0,0 +1,39 @@
+import shutil
+import tempfile
+import unittest
+from os import path
+from pathlib import Path
+
+from chipc.alu_cache import clear_alu_cache
+from chipc.alu_cache import get_alu_parse_tree
+
+BASE_PATH = path.abspath(path.dirname(__file__))
+STATEFUL_ALU_DIR = path.join(BASE_PATH, '../example_alus/stateful_alus/')
+
+
+class GetAluParseTreeTest(unittest.TestCase):
+    def setUp(self):
+        clear_alu_cache()
+
+    def test_same_file_returns_same_tree(self):
+        alu_filename = path.join(STATEFUL_ALU_DIR, 'raw.alu')
+        self.assertIs(get_alu_parse_tree(alu_filename),
+                      get_alu_parse_tree(alu_filename))
+
+    def test_reparse_on_content_change(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        alu_filename = path.join(tmp_dir, 'alu.alu')
+        shutil.copyfile(path.join(STATEFUL_ALU_DIR, 'raw.alu'), alu_filename)
+        first_tree = get_alu_parse_tree(alu_filename)
+
+        Path(alu_filename).write_text(
+            Path(STATEFUL_ALU_DIR, 'pred_raw.alu').read_text())
+        second_tree = get_alu_parse_tree(alu_filename)
+
+        self.assertIsNot(first_tree, second_tree)
+        self.assertNotEqual(first_tree.getText(), second_tree.getText())
+
+
+if __name__ == '__main__':
+    unittest.main()
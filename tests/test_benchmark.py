@@ -0,0 +1,150 @@
+import json
+import tempfile
+import unittest
+from os import path
+from pathlib import Path
+
+from chipc import benchmark
+from chipc.benchmark import compare_results
+from chipc.benchmark import get_cells
+from chipc.benchmark import get_curve
+from chipc.benchmark import load_matrix
+from chipc.benchmark import summarize_trace
+from chipc.benchmark import write_synthetic_specs
+from chipc.utils import get_num_pkt_fields
+
+
+def make_result(spec='simple.sk', return_code=0, iterations=2,
+                total_hole_bits=50, sketch_time=10.0, verify_time=1.0,
+                total_time=12.0):
+    return {'spec': spec, 'stateful_alu': 'raw.alu',
+            'stateless_alu': 'stateless_alu.alu', 'num_pipeline_stages': 2,
+            'num_alus_per_stage': 2, 'return_code': return_code,
+            'iterations': iterations, 'total_hole_bits': total_hole_bits,
+            'sketch_time': sketch_time, 'verify_time': verify_time,
+            'total_time': total_time}
+
+
+class MatrixTest(unittest.TestCase):
+    def test_cells(self):
+        matrix = load_matrix()
+        matrix['num_pipeline_stages'] = [1, 2, 3]
+        cells = get_cells(matrix)
+        self.assertEqual(
+            len(matrix['specs']) * len(matrix['stateful_alus']) *
+            len(matrix['stateless_alus']) * 3 *
+            len(matrix['num_alus_per_stage']), len(cells))
+        self.assertEqual(1, cells[0]['num_pipeline_stages'])
+        self.assertEqual(matrix['specs'][0], cells[0]['spec'])
+
+    def test_matrix_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            matrix_filename = path.join(tmp_dir, 'matrix.json')
+            with open(matrix_filename, 'w') as matrix_file:
+                json.dump({'specs': ['example_specs/times_two.sk']},
+                          matrix_file)
+            matrix = load_matrix(matrix_filename)
+        self.assertEqual(['example_specs/times_two.sk'], matrix['specs'])
+        self.assertEqual(benchmark.DEFAULT_MATRIX['stateful_alus'],
+                         matrix['stateful_alus'])
+
+    def test_synthetic_specs(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            matrix = load_matrix()
+            matrix['synthetic_specs'] = [{'num_fields': 1,
+                                          'num_state_groups': 1},
+                                         {'num_fields': 3,
+                                          'num_state_groups': 1}]
+            matrix['synthetic_spec_dir'] = path.join(tmp_dir, 'specs')
+            specs = write_synthetic_specs(matrix)
+            self.assertEqual(matrix['synthetic_specs'], list(specs.values()))
+            self.assertEqual(
+                [1, 3], [get_num_pkt_fields(Path(spec).read_text())
+                         for spec in specs])
+
+    def test_paths(self):
+        self.assertTrue(path.exists(benchmark.get_path(
+            load_matrix()['specs'][0])))
+
+
+class SummarizeTraceTest(unittest.TestCase):
+    def test_summary(self):
+        records = [
+            {'name': 'synthesize', 'start': 0.0, 'wall_time': 3.0,
+             'args': {'hole_bits': 40, 'sketch_bytes': 900}},
+            {'name': 'verify', 'start': 3.0, 'wall_time': 0.5, 'args': {}},
+            {'name': 'z3_check', 'start': 3.25, 'wall_time': 0.25,
+             'args': {}},
+            {'name': 'iteration', 'start': 0.0, 'wall_time': 3.5,
+             'args': {}},
+            {'name': 'synthesize', 'start': 3.5, 'wall_time': 4.0,
+             'args': {'hole_bits': 42, 'sketch_bytes': 1000}},
+            {'name': 'screen', 'start': 7.5, 'wall_time': 0.25, 'args': {}},
+            {'name': 'iteration', 'start': 3.5, 'wall_time': 4.25,
+             'args': {}}]
+        summary = summarize_trace(records)
+        self.assertEqual(2, summary['iterations'])
+        self.assertEqual(42, summary['total_hole_bits'])
+        self.assertEqual(1000, summary['sketch_bytes'])
+        self.assertEqual(7.0, summary['sketch_time'])
+        self.assertEqual(0.75, summary['verify_time'])
+
+    def test_overlapping_spans(self):
+        # Synthesize spans of parallel_codegen workers running at once.
+        records = [{'name': 'synthesize', 'start': start,
+                    'wall_time': wall_time,
+                    'args': {'hole_bits': 40, 'sketch_bytes': 900}}
+                   for start, wall_time in [(0.0, 2.0), (1.0, 3.0),
+                                            (1.5, 1.0), (5.0, 1.0)]]
+        self.assertEqual(5.0, summarize_trace(records)['sketch_time'])
+
+    def test_empty(self):
+        summary = summarize_trace([])
+        self.assertEqual(0, summary['iterations'])
+        self.assertIsNone(summary['total_hole_bits'])
+
+
+class CompareResultsTest(unittest.TestCase):
+    def test_no_regressions(self):
+        self.assertEqual([], compare_results(
+            [make_result()],
+            [make_result(sketch_time=11.0, verify_time=1.4,
+                         iterations=1)]))
+
+    def test_time(self):
+        regressions = compare_results([make_result()],
+                                      [make_result(sketch_time=13.0)])
+        self.assertEqual(1, len(regressions))
+        self.assertIn('sketch_time', regressions[0])
+
+    def test_counts(self):
+        regressions = compare_results(
+            [make_result()], [make_result(iterations=3,
+                                          total_hole_bits=51)])
+        self.assertEqual(2, len(regressions))
+
+    def test_failure(self):
+        regressions = compare_results(
+            [make_result(), make_result(spec='rcp.sk')],
+            [make_result(return_code=1), make_result(spec='sampling.sk')])
+        self.assertEqual(1, len(regressions))
+        self.assertIn('return code 1', regressions[0])
+
+
+class GetCurveTest(unittest.TestCase):
+    def test_curve(self):
+        results = [make_result(total_hole_bits=bits)
+                   for bits in [30, 10, 20]]
+        for num_fields, result in zip([3, 1, 2], results):
+            result['num_fields'] = num_fields
+        results.append(make_result(spec='rcp.sk'))
+        rows = get_curve(results, 'num_fields', ['total_hole_bits'])
+        self.assertEqual(['num_fields', 'stateful_alu', 'stateless_alu',
+                          'num_pipeline_stages', 'num_alus_per_stage',
+                          'total_hole_bits'], rows[0])
+        self.assertEqual([(1, 10), (2, 20), (3, 30)],
+                         [(row[0], row[-1]) for row in rows[1:]])
+
+
+if __name__ == '__main__':
+    unittest.main()
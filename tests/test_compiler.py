@@ -0,0 +1,182 @@
+import os
+import tempfile
+import unittest
+from collections import namedtuple
+from unittest.mock import patch
+
+from ordered_set import OrderedSet
+
+from chipc.compiler import get_num_workers
+from chipc.compiler import get_spread
+from chipc.compiler import get_verify_bit_schedule
+from tests.utils import ASSERT_FALSE_ALU
+from tests.utils import create_compiler
+from tests.utils import get_simple_solution
+from tests.utils import SKETCH_NAME
+from tests.utils import VERIFY_DAG
+
+VirtualMemory = namedtuple('VirtualMemory', ['available'])
+MB = 1024 * 1024
+
+
+@patch('psutil.virtual_memory', return_value=VirtualMemory(64 * 1024 * MB))
+class GetNumWorkersTest(unittest.TestCase):
+    def test_capped_by_cpu_budget(self, mock_virtual_memory):
+        self.assertEqual(8, get_num_workers(625, 8, 1, 1024))
+
+    def test_capped_by_num_jobs(self, mock_virtual_memory):
+        self.assertEqual(3, get_num_workers(3, 8, 1, 1024))
+
+    def test_threads_per_job(self, mock_virtual_memory):
+        self.assertEqual(2, get_num_workers(625, 8, 4, 1024))
+        self.assertEqual(1, get_num_workers(625, 8, 16, 1024))
+
+    def test_capped_by_memory(self, mock_virtual_memory):
+        mock_virtual_memory.return_value = VirtualMemory(3 * 1024 * MB)
+        self.assertEqual(3, get_num_workers(625, 8, 1, 1024))
+        mock_virtual_memory.return_value = VirtualMemory(100 * MB)
+        self.assertEqual(1, get_num_workers(625, 8, 1, 1024))
+
+
+class GetVerifyBitScheduleTest(unittest.TestCase):
+    def test_schedule(self):
+        self.assertEqual([3, 5, 8, 10], get_verify_bit_schedule(10))
+        self.assertEqual([3, 5], get_verify_bit_schedule(5))
+        self.assertEqual([2, 4, 6], get_verify_bit_schedule(6, [4, 2, 8, 4]))
+        self.assertEqual([10], get_verify_bit_schedule(10, []))
+
+
+class VerifyExhaustivelyTest(unittest.TestCase):
+    def test_auto_selection(self):
+        compiler = create_compiler()
+        # pkt_0 and state_group_0_state_0, 2**20 inputs at 10 bits.
+        self.assertTrue(compiler.can_verify_exhaustively(10))
+        self.assertFalse(compiler.can_verify_exhaustively(11))
+        compiler = create_compiler(exhaustive_verify_limit=0)
+        self.assertFalse(compiler.can_verify_exhaustively(1))
+        compiler = create_compiler(bv_width=16)
+        self.assertFalse(compiler.can_verify_exhaustively(1))
+
+    def test_verify(self):
+        compiler = create_compiler(num_counterexamples=4)
+        hole_assignments = get_simple_solution(compiler)
+        self.assertEqual([], compiler.verify_multiple(hole_assignments, 6))
+        self.assertEqual(({}, {}), compiler.verify(hole_assignments, 6))
+
+        # The new state is the packet field, wrong unless they are equal.
+        hole_assignments[SKETCH_NAME + '_stateful_alu_0_0_Opt_0_global'] = '1'
+        hole_assignments[SKETCH_NAME + '_stateful_alu_0_0_Mux2_0_global'] = \
+            '0'
+        counterexamples = compiler.verify_multiple(hole_assignments, 3)
+        self.assertEqual(4, len(counterexamples))
+        for pkt_fields, state_vars in counterexamples:
+            self.assertNotEqual(state_vars['state_group_0_state_0'],
+                                pkt_fields['pkt_0'])
+
+    def test_assert_false(self):
+        compiler = create_compiler(ASSERT_FALSE_ALU, num_counterexamples=16)
+        self.assertTrue(compiler.can_verify_exhaustively(2))
+        counterexamples = compiler.verify_multiple(
+            get_simple_solution(compiler), 2)
+        # Inputs where the stateful ALU of stage 0 or 1 reads 3, see
+        # test_pipeline_simulator.PipelineSimulatorTest.test_assert_false.
+        self.assertEqual(7, len(counterexamples))
+        for pkt_fields, state_vars in counterexamples:
+            self.assertIn(3, [pkt_fields['pkt_0'],
+                              state_vars['state_group_0_state_0']])
+
+    def test_chunks(self):
+        compiler = create_compiler(cpu_budget=2)
+        hole_assignments = get_simple_solution(compiler)
+        hole_assignments[SKETCH_NAME +
+                         '_stateless_alu_1_0_immediate_operand'] = '0'
+        # Every input is a counterexample.
+        counterexamples = compiler.verify_exhaustively(
+            hole_assignments, 4, 3, chunk_size=64)
+        self.assertEqual(3, len(counterexamples))
+        self.assertEqual(({'pkt_0': 0}, {'state_group_0_state_0': 0}),
+                         counterexamples[0])
+        self.assertEqual(({'pkt_0': 15}, {'state_group_0_state_0': 15}),
+                         counterexamples[-1])
+
+    def test_get_spread(self):
+        self.assertEqual([1, 2], get_spread([1, 2], 3))
+        self.assertEqual([0, 5, 10], get_spread(list(range(11)), 3))
+
+
+class VerifyProgressivelyTest(unittest.TestCase):
+    def test_stops_at_first_failure(self):
+        compiler = create_compiler()
+        hole_assignments = get_simple_solution(compiler)
+        # The new state is the packet field, wrong unless they are equal.
+        hole_assignments[SKETCH_NAME + '_stateful_alu_0_0_Opt_0_global'] = '1'
+        hole_assignments[SKETCH_NAME + '_stateful_alu_0_0_Mux2_0_global'] = \
+            '0'
+        counterexamples, timings = compiler.verify_progressively(
+            hole_assignments, [2, 3, 4, 6])
+        self.assertEqual(1, len(counterexamples))
+        self.assertEqual([2], [input_bits for input_bits, _ in timings])
+
+    def test_correct(self):
+        compiler = create_compiler()
+        counterexamples, timings = compiler.verify_progressively(
+            get_simple_solution(compiler), [2, 4, 6])
+        self.assertEqual([], counterexamples)
+        self.assertEqual([2, 4, 6], [input_bits for input_bits, _ in timings])
+
+
+@patch('chipc.sketch_utils.generate_ir', return_value=VERIFY_DAG)
+class VerifyDagCacheTest(unittest.TestCase):
+    def setUp(self):
+        # Verification writes sketch files to the current directory.
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def test_bit_widths(self, mock_generate_ir):
+        compiler = create_compiler(exhaustive_verify_limit=0,
+                                   verify_mode='sketch')
+        hole_assignments = get_simple_solution(compiler)
+        results = compiler.verify_at_bit_widths(hole_assignments, [2, 3, 8])
+        self.assertEqual([2, 3, 8], list(results))
+        self.assertEqual([], results[2])
+        self.assertEqual(1, len(results[3]))
+        self.assertGreaterEqual(results[8][0][0]['pkt_0'], 5)
+        self.assertEqual(1, mock_generate_ir.call_count)
+
+        compiler.verify(hole_assignments, 4)
+        self.assertEqual(1, mock_generate_ir.call_count)
+
+    def test_new_candidate(self, mock_generate_ir):
+        compiler = create_compiler(exhaustive_verify_limit=0,
+                                   verify_mode='sketch')
+        hole_assignments = get_simple_solution(compiler)
+        compiler.verify(hole_assignments, 2)
+        hole_assignments[SKETCH_NAME +
+                         '_stateless_alu_1_0_immediate_operand'] = '0'
+        compiler.verify(hole_assignments, 2)
+        self.assertEqual(2, mock_generate_ir.call_count)
+        compiler.update_constants_for_synthesis(OrderedSet(['0', '1', '5']))
+        compiler.verify(hole_assignments, 2)
+        self.assertEqual(3, mock_generate_ir.call_count)
+
+    def test_cross_check(self, mock_generate_ir):
+        compiler = create_compiler(exhaustive_verify_limit=0,
+                                   verify_mode='cross-check')
+        hole_assignments = get_simple_solution(compiler)
+        # Neither finds a counterexample at 2 bits.
+        self.assertEqual([], compiler.verify_multiple(hole_assignments, 2))
+        self.assertEqual([], compiler.verify_disagreements)
+        # Only the DAG has one at 3 bits, which is reported and returned.
+        counterexamples = compiler.verify_multiple(hole_assignments, 3)
+        self.assertEqual(1, len(counterexamples))
+        self.assertEqual([(3, [], counterexamples)],
+                         compiler.verify_disagreements)
+
+
+if __name__ == '__main__':
+    unittest.main()
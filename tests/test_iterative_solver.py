@@ -1,5 +1,8 @@
+import os
+import tempfile
 import unittest
 from os import path
+from unittest.mock import patch
 
 from chipc import iterative_solver
 from chipc.iterative_solver import generate_hole_elimination_assert
@@ -25,6 +28,33 @@ class GenerateHoleEliminationTest(unittest.TestCase):
         )
 
 
+class VerifyDisagreementsTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    @patch('chipc.compiler.Compiler.verify_directly', return_value=[])
+    @patch('chipc.compiler.Compiler.verify_with_sketch')
+    def test_failure_code(self, mock_verify_with_sketch,
+                          mock_verify_directly):
+        # Only the first candidate is rejected by sketch.
+        mock_verify_with_sketch.side_effect = [
+            [({'pkt_0': 1}, {'state_group_0_state_0': 2})], []]
+        self.assertEqual(1, iterative_solver.main([
+            'iterative_solver', path.join(SPEC_DIR, 'simple.sk'),
+            path.join(STATEFUL_ALU_DIR, 'raw.alu'),
+            path.join(STATELESS_ALU_DIR, 'stateless_alu_arith.alu'),
+            '2', '1', '0,1', '10', '--synthesis-backend', 'z3',
+            '--verify-mode', 'cross-check', '--exhaustive-verify-limit', '0',
+            '--verify-bit-schedule']))
+        self.assertEqual(2, mock_verify_with_sketch.call_count)
+
+
 class IterativeSolverTest(unittest.TestCase):
     def test_sampling_2_1_if_else_raw_cex_mode(self):
         self.assertEqual(
@@ -0,0 +1,171 @@
+import pickle
+import unittest
+from os import path
+
+import numpy as np
+
+from chipc.pipeline_simulator import AluSimulator
+from chipc.pipeline_simulator import get_counterexample
+from tests.utils import ASSERT_FALSE_ALU
+from tests.utils import create_compiler
+from tests.utils import get_simple_solution
+from tests.utils import SKETCH_NAME
+from tests.utils import STATEFUL_ALU_DIR
+from tests.utils import STATELESS_ALU_DIR
+
+
+def get_inputs():
+    pkt_0, state = np.meshgrid(np.arange(8), np.arange(8))
+    return ({'pkt_0': pkt_0.ravel()},
+            {'state_group_0_state_0': state.ravel()})
+
+
+class PipelineSimulatorTest(unittest.TestCase):
+    def test_simple_solution(self):
+        compiler = create_compiler()
+        pkt_fields, state_vars = get_inputs()
+        result_pkt_fields, result_state_vars = compiler.simulate(
+            get_simple_solution(compiler), pkt_fields, state_vars)
+        np.testing.assert_array_equal(
+            state_vars['state_group_0_state_0'] + 1,
+            result_pkt_fields['pkt_0'])
+        np.testing.assert_array_equal(
+            state_vars['state_group_0_state_0'],
+            result_state_vars['state_group_0_state_0'])
+
+    def test_mismatches(self):
+        compiler = create_compiler()
+        hole_assignments = get_simple_solution(compiler)
+        pkt_fields, state_vars = get_inputs()
+        expected_pkt_fields = {
+            'pkt_0': state_vars['state_group_0_state_0'] + 1}
+        simulator = compiler.pipeline_simulator
+        self.assertEqual(0, len(simulator.get_mismatches(
+            hole_assignments, compiler.constant_set, pkt_fields, state_vars,
+            expected_pkt_fields, state_vars)))
+
+        # Updating the state makes every input with a non-zero packet field
+        # fail.
+        hole_assignments[SKETCH_NAME +
+                         '_stateful_alu_0_0_Mux2_0_global'] = '0'
+        mismatches = simulator.get_mismatches(
+            hole_assignments, compiler.constant_set, pkt_fields, state_vars,
+            expected_pkt_fields, state_vars)
+        self.assertEqual(56, len(mismatches))
+        pkt_counterexample, state_counterexample = get_counterexample(
+            pkt_fields, state_vars, mismatches[0])
+        self.assertNotEqual(0, pkt_counterexample['pkt_0'])
+        self.assertIn('state_group_0_state_0', state_counterexample)
+
+    def test_assert_false(self):
+        compiler = create_compiler(ASSERT_FALSE_ALU)
+        pkt_fields, state_vars = get_inputs()
+        expected_pkt_fields = {
+            'pkt_0': state_vars['state_group_0_state_0'] + 1}
+        mismatches = compiler.pipeline_simulator.get_mismatches(
+            get_simple_solution(compiler), compiler.constant_set, pkt_fields,
+            state_vars, expected_pkt_fields, state_vars)
+        # Only inputs reaching assert(false) fail. Like in sketch, the
+        # unallocated stateful ALU of stage 1 runs too, on the old state_0
+        # from stage 0 as packet field.
+        pkt_0 = pkt_fields['pkt_0']
+        state_0 = state_vars['state_group_0_state_0']
+        np.testing.assert_array_equal(
+            np.flatnonzero((pkt_0 == 3) | (state_0 == 3) |
+                           (pkt_0 - state_0 <= -4)), mismatches)
+
+    def test_scalar_inputs(self):
+        compiler = create_compiler()
+        result_pkt_fields, _ = compiler.simulate(
+            get_simple_solution(compiler), {'pkt_0': 5},
+            {'state_group_0_state_0': 3})
+        self.assertEqual([4], list(result_pkt_fields['pkt_0']))
+
+    def test_pickle(self):
+        compiler = create_compiler()
+        pkt_fields, state_vars = get_inputs()
+        compiler.simulate(get_simple_solution(compiler), pkt_fields,
+                          state_vars)
+        pickle.dumps(compiler.pipeline_simulator)
+
+
+class ScreenTest(unittest.TestCase):
+    def test_screen(self):
+        compiler = create_compiler(num_screening_inputs=100,
+                                   num_counterexamples=3)
+        hole_assignments = get_simple_solution(compiler)
+        self.assertEqual([], compiler.screen(hole_assignments, 10))
+
+        hole_assignments[SKETCH_NAME +
+                         '_stateless_alu_1_0_immediate_operand'] = '0'
+        counterexamples = compiler.screen(hole_assignments, 10)
+        self.assertEqual(3, len(counterexamples))
+        for pkt_fields, state_vars in counterexamples:
+            self.assertEqual(['pkt_0'], list(pkt_fields))
+            self.assertEqual(['state_group_0_state_0'], list(state_vars))
+            self.assertLess(pkt_fields['pkt_0'], 2**10)
+
+    def test_screening_off(self):
+        compiler = create_compiler()
+        hole_assignments = get_simple_solution(compiler)
+        hole_assignments[SKETCH_NAME +
+                         '_stateless_alu_1_0_immediate_operand'] = '0'
+        self.assertEqual([], compiler.screen(hole_assignments, 10))
+
+
+class AluSimulatorTest(unittest.TestCase):
+    def test_signature(self):
+        alu = AluSimulator(path.join(STATEFUL_ALU_DIR, 'pair.alu'))
+        self.assertTrue(alu.is_stateful)
+        self.assertEqual(['state_0', 'state_1'], alu.state_vars)
+        self.assertEqual(['pkt_1', 'pkt_2', 'pkt_3', 'pkt_4', 'pkt_5'],
+                         alu.packet_fields)
+
+    def test_if_else(self):
+        # if (rel_op(Opt(state_0), Mux3(pkt_0, pkt_1, C()))) updates state_0
+        # with Opt(state_0) + Mux3(pkt_0, pkt_1, C()), otherwise with the
+        # second Opt and Mux3.
+        alu = AluSimulator(path.join(STATEFUL_ALU_DIR, 'if_else_raw.alu'))
+        holes = {'Opt_0': 0, 'Mux3_0': 0, 'const_0': 0, 'rel_op_0': 1,
+                 'Opt_1': 0, 'Mux3_1': 1, 'const_1': 0,
+                 'Opt_2': 1, 'Mux3_2': 2, 'const_2': 1, 'Mux2_0': 1}
+        state = np.array([1, 5, 2])
+        pkt_0 = np.array([3, 3, 3])
+        pkt_1 = np.array([10, 20, 30])
+        return_value, (new_state,) = alu.evaluate(
+            holes.get, [0, 7], [pkt_0, pkt_1], [state], 3)
+        # state_0 < pkt_0 adds pkt_1, else the state is set to 7.
+        np.testing.assert_array_equal([11, 7, 32], new_state)
+        np.testing.assert_array_equal(new_state, return_value)
+
+    def test_assert_false(self):
+        alu = AluSimulator(ASSERT_FALSE_ALU)
+        holes = {'Opt_0': 0, 'Mux2_0': 1, 'const_0': 0, 'Mux2_1': 0}
+        pkt_0 = np.array([3, 0, 1, 2])
+        state = np.array([0, 3, 3, 3])
+        return_value, _ = alu.evaluate(holes.get, [0], [pkt_0], [state], 4)
+        # Division rounds towards zero, so (0 - 3) / 2 is -1.
+        np.testing.assert_array_equal([True, False, False, False],
+                                      alu.failed)
+        np.testing.assert_array_equal(state, return_value)
+
+    def test_stateless_opcodes(self):
+        alu = AluSimulator(path.join(STATELESS_ALU_DIR, 'stateless_alu.alu'))
+        pkt_0 = np.array([0, 2, 4])
+        pkt_1 = np.array([1, 2, 3])
+        pkt_2 = np.array([7, 8, 9])
+
+        def evaluate(opcode):
+            holes = {'opcode': opcode, 'immediate_operand': 1}
+            return list(alu.evaluate(holes.get, [0, 3],
+                                     [pkt_0, pkt_1, pkt_2], [], 3)[0])
+
+        self.assertEqual([3, 3, 3], evaluate(0))
+        self.assertEqual([1, 4, 7], evaluate(1))
+        self.assertEqual([0, 1, 0], evaluate(8))
+        self.assertEqual([7, 2, 3], evaluate(14))
+        self.assertEqual([1, 0, 0], evaluate(20))
+
+
+if __name__ == '__main__':
+    unittest.main()
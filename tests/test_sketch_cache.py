@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from chipc import sketch_utils
+from chipc.sketch_cache import SketchCache
+
+
+class SketchCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = SketchCache(os.path.join(self.tmp_dir.name, 'cache'))
+        self.sketch_file_name = os.path.join(self.tmp_dir.name, 'foo.sk')
+        Path(self.sketch_file_name).write_text('int foo() { return 1; }')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    @patch('subprocess.getstatusoutput', return_value=(0, 'holes'))
+    def test_synthesize_hit(self, mock_getstatusoutput):
+        for _ in range(2):
+            self.assertEqual((0, 'holes'), sketch_utils.synthesize(
+                self.sketch_file_name, 2, 1, cache=self.cache))
+        mock_getstatusoutput.assert_called_once()
+        self.assertDictEqual({'hits': 1, 'misses': 1, 'evictions': 0},
+                             self.cache.get_stats())
+
+    @patch('subprocess.getstatusoutput', return_value=(0, 'holes'))
+    def test_synthesize_miss_on_different_input(self, mock_getstatusoutput):
+        sketch_utils.synthesize(self.sketch_file_name, 2, 1, cache=self.cache)
+        sketch_utils.synthesize(self.sketch_file_name, 2, 2, cache=self.cache)
+        Path(self.sketch_file_name).write_text('int foo() { return 2; }')
+        sketch_utils.synthesize(self.sketch_file_name, 2, 1, cache=self.cache)
+        self.assertEqual(3, mock_getstatusoutput.call_count)
+        self.assertEqual(0, self.cache.get_stats()['hits'])
+
+    @patch('subprocess.getstatusoutput', return_value=(143, 'Terminated'))
+    def test_synthesize_does_not_cache_killed_runs(self,
+                                                   mock_getstatusoutput):
+        for _ in range(2):
+            sketch_utils.synthesize(self.sketch_file_name, 2, 1,
+                                    cache=self.cache)
+        self.assertEqual(2, mock_getstatusoutput.call_count)
+
+    def test_evict_least_recently_used(self):
+        value = {'output': 'x' * 100}
+        self.cache.max_size_bytes = 250
+        self.cache.put('a', value)
+        self.cache.put('b', value)
+        # Make 'a' older than 'b' and then use it, so 'b' gets evicted.
+        os.utime(str(self.cache.get_entry_path('a')), (0, 0))
+        os.utime(str(self.cache.get_entry_path('b')), (1, 1))
+        self.assertEqual(value, self.cache.get('a'))
+        self.cache.put('c', value)
+
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('c'))
+        self.assertEqual(1, self.cache.get_stats()['evictions'])
+
+
+if __name__ == '__main__':
+    unittest.main()
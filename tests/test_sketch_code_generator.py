@@ -0,0 +1,118 @@
+import unittest
+
+from ordered_set import OrderedSet
+
+from chipc.mode import Mode
+from tests.utils import create_compiler
+from tests.utils import RCP_PIPELINE
+
+
+def generate_codegen_sketch(compiler):
+    return compiler.sketch_code_generator.generate_sketch(
+        spec_filename=compiler.spec_filename,
+        mode=Mode.CODEGEN,
+        synthesized_allocation=compiler.synthesized_allocation)
+
+
+class SharedAluDefinitionsTest(unittest.TestCase):
+    def check_same_holes(self, synthesized_allocation):
+        per_slot = create_compiler(
+            synthesized_allocation=synthesized_allocation, **RCP_PIPELINE)
+        shared = create_compiler(
+            synthesized_allocation=synthesized_allocation,
+            shared_alu_definitions=True, **RCP_PIPELINE)
+        per_slot_sketch = generate_codegen_sketch(per_slot)
+        shared_sketch = generate_codegen_sketch(shared)
+
+        per_slot_generator = per_slot.sketch_code_generator
+        shared_generator = shared.sketch_code_generator
+        self.assertListEqual(per_slot_generator.hole_names_,
+                             shared_generator.hole_names_)
+        self.assertEqual(per_slot_generator.hole_preamble_,
+                         shared_generator.hole_preamble_)
+        self.assertEqual(per_slot_generator.asserts_,
+                         shared_generator.asserts_)
+        self.assertLess(len(shared_sketch), len(per_slot_sketch))
+        return shared_sketch
+
+    def test_canonical_allocation(self):
+        sketch = self.check_same_holes(synthesized_allocation=False)
+        self.assertEqual(
+            1, sketch.count('int rcp_if_else_raw_stateless_alu_3_2_'
+                            'stateless_alu('))
+        self.assertEqual(
+            1, sketch.count('int rcp_if_else_raw_stateless_alu_3_2_'
+                            'stateful_alu('))
+        self.assertNotIn('stateless_alu_0_0(', sketch)
+        self.assertNotIn('stateful_alu_0_0(', sketch)
+
+    def test_synthesized_allocation(self):
+        sketch = self.check_same_holes(synthesized_allocation=True)
+        self.assertNotIn('stateful_alu_0_0(', sketch)
+
+
+class MuxDeduplicationTest(unittest.TestCase):
+    def test_one_mux_definition_per_arity(self):
+        compiler = create_compiler(**RCP_PIPELINE)
+        sketch = generate_codegen_sketch(compiler)
+        sketch_name = compiler.sketch_name
+        # Operand muxes have 2 inputs, output muxes and Mux3 in if_else_raw
+        # have 3 inputs.
+        for n in [2, 3]:
+            self.assertEqual(
+                1, sketch.count('int ' + sketch_name + '_mux' + str(n) + '('))
+        self.assertNotIn('_operand_mux_0(', sketch)
+        self.assertNotIn('_output_mux_phv_0_0(', sketch)
+        self.assertNotIn('_Mux3_0(', sketch)
+        # Control holes are still per mux instance.
+        self.assertIn(
+            sketch_name + '_output_mux_phv_0_0_ctrl',
+            compiler.sketch_code_generator.hole_names_)
+        self.assertIn(
+            sketch_name + '_stateful_alu_0_0_Mux3_0_global',
+            compiler.sketch_code_generator.hole_names_)
+
+
+class IncrementalSketchGenerationTest(unittest.TestCase):
+    def test_same_output_across_iterations(self):
+        compiler = create_compiler(**RCP_PIPELINE)
+        generator = compiler.sketch_code_generator
+        first_sketch = generator.generate_sketch(
+            spec_filename=compiler.spec_filename,
+            mode=Mode.CODEGEN,
+            synthesized_allocation=False,
+            additional_constraints=['a == 1'],
+            additional_testcases='// first')
+        first_hole_names = generator.hole_names_.copy()
+
+        second_sketch = generator.generate_sketch(
+            spec_filename=compiler.spec_filename,
+            mode=Mode.CODEGEN,
+            synthesized_allocation=False,
+            additional_constraints=['b == 2'],
+            additional_testcases='// second')
+
+        self.assertListEqual(first_hole_names, generator.hole_names_)
+        self.assertEqual(
+            first_sketch.replace('assert(a == 1);', 'assert(b == 2);')
+            .replace('// first', '// second'),
+            second_sketch)
+
+    def test_update_constants(self):
+        constant_set = OrderedSet(['0', '1', '2', '3', '4', '5'])
+        compiler = create_compiler(**RCP_PIPELINE)
+        generate_codegen_sketch(compiler)
+        compiler.update_constants_for_synthesis(constant_set)
+        updated_sketch = generate_codegen_sketch(compiler)
+
+        fresh_compiler = create_compiler(**RCP_PIPELINE)
+        fresh_compiler.update_constants_for_synthesis(constant_set)
+        self.assertEqual(generate_codegen_sketch(fresh_compiler),
+                         updated_sketch)
+        self.assertListEqual(
+            [hole.max for hole in fresh_compiler.sketch_code_generator.holes_],
+            [hole.max for hole in compiler.sketch_code_generator.holes_])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+from pathlib import Path
+
+from chipc import sketch_dag
+
+DATA_DIR = Path(__file__).parent / 'data'
+
+
+class ParseDagTest(unittest.TestCase):
+    def test_sampling(self):
+        dag_filename = str(DATA_DIR / 'sampling.dag')
+        dag = sketch_dag.load_dag(dag_filename)
+        self.assertEqual(
+            len(dag), len(sketch_dag.parse_dag(Path(dag_filename)
+                                               .read_text())))
+        self.assertListEqual(['state_group_0_state_0_4_6_0', 'pkt_0_3_5_0'],
+                             dag.source_names)
+        self.assertListEqual([0, 18], list(dag.sources))
+        self.assertEqual(sketch_dag.ASSERT, dag.operations[12])
+        self.assertIn(11, dag.asserts)
+
+    def test_node_table(self):
+        dag = sketch_dag.parse_dag('\n'.join([
+            'dag main__WrapperNospec :',
+            'TUPLE_DEF Fprogram_ANONYMOUS INT INT',
+            '0 = S INT pkt_0_0_0_0 2',
+            '1 = CONST INT 5',
+            '2 = LT BOOL 0 1',
+            '3 = ARRACC INT 2 2 0 1',
+            '4 = ARRASS INT 3 == 5 0 1',
+            '5 = NOT BOOL 2',
+            '6 = ASSERT 5 "x >= 5"']))
+        self.assertEqual(7, len(dag))
+        self.assertListEqual(
+            ['S', 'CONST', 'LT', 'ARRACC', 'ARRASS', 'NOT', 'ASSERT'],
+            [sketch_dag.OPERATIONS[op] for op in dag.operations])
+        self.assertEqual(5, dag.values[1])
+        self.assertEqual(sketch_dag.BOOL, dag.types[2])
+        self.assertListEqual([0, 1, -1], list(dag.get_operands(2)))
+        # Predicate, value if false and value if true.
+        self.assertListEqual([2, 0, 1], list(dag.get_operands(3)))
+        self.assertListEqual([3, 0, 1], list(dag.get_operands(4)))
+        self.assertEqual(5, dag.values[4])
+        self.assertListEqual([5], list(dag.asserts))
+
+    def test_raise_assert_for_unknown_operation(self):
+        with self.assertRaisesRegex(AssertionError, 'Unknown operation'):
+            sketch_dag.parse_dag('0 = FOO INT 1')
+
+
+if __name__ == '__main__':
+    unittest.main()
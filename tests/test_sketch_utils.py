@@ -0,0 +1,174 @@
+import os
+import subprocess
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from chipc import sketch_utils
+from chipc.sketch_utils import ReplayRunner
+from chipc.sketch_utils import SketchRunner
+from tests.utils import create_compiler
+from tests.utils import get_simple_solution
+from tests.utils import VERIFY_DAG
+
+PARSE_ERROR_OUTPUT = 'Program Parse Error: foo.sk:1: unexpected token'
+
+
+class SynthesizeTest(unittest.TestCase):
+    @patch('subprocess.getstatusoutput', return_value=(0, 'holes'))
+    def test_single_sketch_invocation(self, mock_getstatusoutput):
+        self.assertEqual((0, 'holes'),
+                         sketch_utils.synthesize('foo.sk', 2, 1))
+        mock_getstatusoutput.assert_called_once()
+
+    @patch('subprocess.getstatusoutput',
+           return_value=(1, PARSE_ERROR_OUTPUT))
+    def test_raise_on_syntax_error(self, mock_getstatusoutput):
+        with self.assertRaisesRegex(Exception, 'contains a syntax error'):
+            sketch_utils.synthesize('foo.sk', 2, 1)
+        mock_getstatusoutput.assert_called_once()
+
+
+def fake_synthesis_command(sketch_file_name, flags):
+    # Seed 1 is slow and fails, seed 2 succeeds and seed 3 fails right away.
+    if '--slv-seed=1' in flags:
+        return 'sleep 30; exit 1'
+    if '--slv-seed=2' in flags:
+        return 'echo holes'
+    return 'echo no solution; exit 1'
+
+
+@patch('chipc.sketch_utils.get_synthesis_command',
+       side_effect=fake_synthesis_command)
+class SynthesizePortfolioTest(unittest.TestCase):
+    def test_first_success_wins(self, mock_get_synthesis_command):
+        start = time.time()
+        self.assertEqual(
+            (0, 'holes', (2, 2)),
+            sketch_utils.synthesize_portfolio(
+                'foo.sk', [(2, 1), (2, 2), (3, 3)]))
+        # The slow seed was killed rather than waited for.
+        self.assertLess(time.time() - start, 10)
+
+    def test_all_fail(self, mock_get_synthesis_command):
+        self.assertEqual(
+            (1, 'no solution', (2, 3)),
+            sketch_utils.synthesize_portfolio('foo.sk', [(2, 3), (3, 3)]))
+
+    def test_failure_drops_more_input_bits(self, mock_get_synthesis_command):
+        start = time.time()
+        # Seed 3 fails with 2 bits, so the slow runs with 2 and 3 bits are
+        # killed and there is nothing left to wait for.
+        self.assertEqual(
+            (1, 'no solution', (2, 3)),
+            sketch_utils.synthesize_portfolio(
+                'foo.sk', [(2, 1), (3, 1), (2, 3)]))
+        self.assertLess(time.time() - start, 10)
+
+
+class GenerateIrTest(unittest.TestCase):
+    def test_raise_on_syntax_error(self):
+        completed_process = subprocess.CompletedProcess(
+            args=[], returncode=1, stdout=PARSE_ERROR_OUTPUT)
+        with patch('subprocess.run',
+                   return_value=completed_process) as mock_run:
+            with self.assertRaisesRegex(Exception,
+                                        'contains a syntax error'):
+                sketch_utils.generate_ir('foo.sk')
+            mock_run.assert_called_once()
+
+
+class FakeRunner(SketchRunner):
+    # Only seed 2 succeeds, and IRs are VERIFY_DAG. start would run sketch.
+    concurrent = False
+
+    def __init__(self):
+        self.calls = 0
+
+    def synthesize(self, sketch_file_name, flags):
+        self.calls += 1
+        if '--slv-seed=2' in flags:
+            return (0, 'holes')
+        return (1, 'no solution')
+
+    def generate_ir(self, sketch_file_name, flags, dag_file_name):
+        self.calls += 1
+        Path(dag_file_name).write_text(VERIFY_DAG)
+        return (0, '')
+
+
+class ReplayRunnerTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+        self.fixture_dir = os.path.join(self.tmp_dir.name, 'fixtures')
+        Path('foo.sk').write_text('int foo() { return 1; }')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def test_record_and_replay(self):
+        fake_runner = FakeRunner()
+        runner = ReplayRunner(self.fixture_dir, fake_runner)
+        for _ in range(2):
+            self.assertEqual((0, 'holes'), sketch_utils.synthesize(
+                'foo.sk', 2, 2, runner=runner))
+        self.assertEqual(1, fake_runner.calls)
+        self.assertDictEqual({'replays': 1, 'recordings': 1},
+                             runner.get_stats())
+        # Replaying doesn't need sketch.
+        self.assertEqual((0, 'holes'), sketch_utils.synthesize(
+            'foo.sk', 2, 2, runner=ReplayRunner(self.fixture_dir)))
+
+    def test_missing_fixture(self):
+        runner = ReplayRunner(self.fixture_dir, FakeRunner())
+        sketch_utils.synthesize('foo.sk', 2, 2, runner=runner)
+        Path('foo.sk').write_text('int foo() { return 2; }')
+        with self.assertRaisesRegex(Exception, 'No recorded sketch run'):
+            sketch_utils.synthesize('foo.sk', 2, 2,
+                                    runner=ReplayRunner(self.fixture_dir))
+
+    def test_portfolio(self):
+        fake_runner = FakeRunner()
+        runner = ReplayRunner(self.fixture_dir, fake_runner)
+        # Configs are run in order until one succeeds, skipping those with
+        # at least as many input bits as a failed one.
+        self.assertEqual(
+            (0, 'holes', (2, 2)),
+            sketch_utils.synthesize_portfolio(
+                'foo.sk', [(3, 1), (3, 3), (2, 2)], runner=runner))
+        self.assertEqual(2, fake_runner.calls)
+        self.assertEqual(
+            (1, 'no solution', (2, 1)),
+            sketch_utils.synthesize_portfolio(
+                'foo.sk', [(2, 1), (2, 2)], runner=runner))
+        self.assertEqual(3, fake_runner.calls)
+
+    def test_generate_ir(self):
+        runner = ReplayRunner(self.fixture_dir, FakeRunner())
+        self.assertEqual(VERIFY_DAG,
+                         sketch_utils.generate_ir('foo.sk', runner=runner))
+        os.remove('foo.dag')
+        self.assertEqual(VERIFY_DAG, sketch_utils.generate_ir(
+            'foo.sk', runner=ReplayRunner(self.fixture_dir)))
+        self.assertEqual(VERIFY_DAG, Path('foo.dag').read_text())
+
+    def test_compiler(self):
+        fake_runner = FakeRunner()
+        for runner in [ReplayRunner(self.fixture_dir, fake_runner),
+                       ReplayRunner(self.fixture_dir)]:
+            compiler = create_compiler(exhaustive_verify_limit=0,
+                                       verify_mode='sketch',
+                                       sketch_runner=runner)
+            # VERIFY_DAG asserts pkt_0 < 5.
+            pkt_fields, _ = compiler.verify(get_simple_solution(compiler), 3)
+            self.assertGreaterEqual(pkt_fields['pkt_0'], 5)
+        self.assertEqual(1, fake_runner.calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import itertools
+import unittest
+from os import path
+from pathlib import Path
+
+from chipc import spec_analysis
+
+BASE_PATH = path.abspath(path.dirname(__file__))
+SPEC_DIR = path.join(BASE_PATH, '../example_specs/')
+
+
+def read_spec(spec_name):
+    return Path(SPEC_DIR, spec_name).read_text()
+
+
+class GetDependenciesTest(unittest.TestCase):
+    def test_condition_and_packet_field_dependencies(self):
+        statements = spec_analysis.get_statements(
+            spec_analysis.get_program_body(read_spec('test.sk')))
+        group_deps, pkt_deps = spec_analysis.get_dependencies(statements)
+        self.assertDictEqual({0: set(), 1: {0}}, dict(group_deps))
+        self.assertDictEqual({0: {0}, 1: set(), 2: {0, 1}}, pkt_deps)
+
+    def test_else_branch(self):
+        statements = spec_analysis.get_statements(
+            spec_analysis.get_program_body(read_spec('marple_tcp_nmo.sk')))
+        self.assertEqual(2, len(statements))
+        self.assertEqual(statements[0][0], statements[1][0])
+        group_deps, _ = spec_analysis.get_dependencies(statements)
+        self.assertDictEqual({0: {1}, 1: set()}, dict(group_deps))
+
+
+class GetStateGroupAssignmentsTest(unittest.TestCase):
+    def test_dependency_order(self):
+        self.assertListEqual(
+            [(1, 0), (2, 0), (2, 1)],
+            spec_analysis.get_state_group_assignments(
+                read_spec('blue_increase.sk'), 3, 2, [0, 1], [0, 1]))
+
+    def test_unchecked_state_group_is_not_ordered(self):
+        # Only pkt_0, which is not computed from any state, is checked.
+        self.assertEqual(
+            9, len(spec_analysis.get_state_group_assignments(
+                read_spec('blue_increase.sk'), 3, 2, [0], [])))
+
+    def test_interchangeable_state_groups(self):
+        assignments = spec_analysis.get_state_group_assignments(
+            read_spec('learn_filter_modified_for_test.sk'), 3, 3, [0],
+            [0, 1, 2])
+        self.assertEqual(10, len(assignments))
+        for assignment in assignments:
+            self.assertListEqual(sorted(assignment), list(assignment))
+
+    def test_independent_state_groups(self):
+        self.assertListEqual(
+            list(itertools.product(range(2), repeat=3)),
+            spec_analysis.get_state_group_assignments(
+                read_spec('rcp.sk'), 2, 3, [0, 1], [0, 1, 2]))
+
+    def test_fall_back_to_all_assignments(self):
+        # Not enough stages to satisfy the dependency.
+        self.assertEqual(
+            1, len(spec_analysis.get_state_group_assignments(
+                read_spec('blue_increase.sk'), 1, 2, [0, 1], [0, 1])))
+        self.assertEqual(
+            4, len(spec_analysis.get_state_group_assignments(
+                'not a spec', 2, 2, [0], [0, 1])))
+
+
+if __name__ == '__main__':
+    unittest.main()
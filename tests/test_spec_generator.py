@@ -0,0 +1,122 @@
+import os
+import re
+import tempfile
+import unittest
+from os import path
+from pathlib import Path
+
+from ordered_set import OrderedSet
+
+from chipc import spec_generator
+from chipc.compiler import Compiler
+from chipc.mode import Mode
+from chipc.spec_generator import generate_spec
+from chipc.spec_interpreter import Spec
+from chipc.utils import get_num_pkt_fields
+from chipc.utils import get_state_group_info
+
+BASE_PATH = path.abspath(path.join(path.dirname(__file__), '..'))
+ALU_DIR = path.join(BASE_PATH, 'example_alus')
+
+
+def get_chain_length(program):
+    """Returns the length of the longest chain of statements of a generated
+    spec, each reading a variable written by the previous one."""
+    lengths = {}
+    conditions = []
+    longest = 0
+    for line in program.splitlines():
+        line = line.strip()
+        if line.startswith('if ('):
+            conditions.append(line)
+        elif line == '}':
+            conditions = conditions[:-1]
+        elif ' = ' in line:
+            target, expression = line.split(' = ', 1)
+            names = re.findall(r'state_and_packet\.\w+',
+                               ' '.join(conditions + [expression]))
+            lengths[target] = 1 + max(
+                [lengths.get(name, 0) for name in names] + [0])
+            longest = max(longest, lengths[target])
+    return longest
+
+
+class GenerateSpecTest(unittest.TestCase):
+    def test_sizes(self):
+        for num_fields, num_state_groups, group_size, depth in [
+                (1, 0, 1, 1), (2, 3, 1, 1), (3, 2, 2, 4), (8, 6, 1, 3)]:
+            program = generate_spec(num_fields, num_state_groups, group_size,
+                                    depth)
+            self.assertEqual(num_fields, get_num_pkt_fields(program))
+            state_group_info = get_state_group_info(program)
+            self.assertEqual(num_state_groups, len(state_group_info))
+            for state_vars in state_group_info.values():
+                self.assertEqual(group_size, len(state_vars))
+            # The spec interpreter supports all generated specs.
+            Spec(program)
+
+    def test_deterministic(self):
+        self.assertEqual(generate_spec(3, 2, depth=2, seed=4),
+                         generate_spec(3, 2, depth=2, seed=4))
+        self.assertNotEqual(generate_spec(3, 2, depth=2, seed=4),
+                            generate_spec(3, 2, depth=2, seed=5))
+
+    def test_depth(self):
+        spec = Spec(generate_spec(3, 0, depth=3, operators=['add']))
+        pkt_fields, _ = spec.evaluate({'pkt_0': 0, 'pkt_1': 0, 'pkt_2': 0},
+                                      {})
+        changed_pkt_fields, _ = spec.evaluate(
+            {'pkt_0': 10, 'pkt_1': 0, 'pkt_2': 0}, {})
+        # pkt_2 is computed from pkt_1, which is computed from pkt_0.
+        self.assertNotEqual(pkt_fields['pkt_2'], changed_pkt_fields['pkt_2'])
+
+    def test_chain_length(self):
+        for num_fields, num_state_groups, depth in [
+                (1, 0, 1), (1, 0, 3), (2, 0, 4), (1, 1, 3), (3, 2, 2),
+                (2, 4, 2), (8, 6, 3)]:
+            for seed in range(1, 4):
+                self.assertEqual(depth, get_chain_length(generate_spec(
+                    num_fields, num_state_groups, depth=depth, seed=seed)),
+                    (num_fields, num_state_groups, depth, seed))
+
+    def test_operators(self):
+        program = generate_spec(2, 4, operators=['mul'])
+        self.assertIn('*', program)
+        self.assertNotIn('if', program)
+        self.assertNotIn(' + ', program)
+        program = generate_spec(2, 4, operators=['add', 'if'], seed=2)
+        self.assertIn('if', program)
+        with self.assertRaises(AssertionError):
+            generate_spec(2, 1, operators=['div'])
+
+    def test_codegen(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            spec_filename = path.join(tmp_dir, 'synthetic.sk')
+            Path(spec_filename).write_text(generate_spec(2, 2, depth=2))
+            compiler = Compiler(
+                spec_filename,
+                path.join(ALU_DIR, 'stateful_alus', 'raw.alu'),
+                path.join(ALU_DIR, 'stateless_alus', 'stateless_alu.alu'),
+                2, 2, 'synthetic_raw_stateless_alu_2_2', False,
+                OrderedSet(['0', '1', '2', '3']))
+            sketch = compiler.sketch_code_generator.generate_sketch(
+                spec_filename=spec_filename, mode=Mode.CODEGEN,
+                synthesized_allocation=False)
+        self.assertIn('state_group_1_state_0', sketch)
+        self.assertGreater(
+            compiler.sketch_code_generator.total_hole_bits_, 0)
+
+    def test_main(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            spec_filename = os.path.join(tmp_dir, 'spec.sk')
+            self.assertEqual(0, spec_generator.main([
+                'spec_generator', spec_filename, '--fields', '3',
+                '--state-groups', '2', '--depth', '2', '--operators', 'add',
+                'sub']))
+            self.assertEqual(
+                generate_spec(3, 2, depth=2, operators=['add', 'sub']),
+                Path(spec_filename).read_text())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import glob
+import pickle
+import unittest
+from os import path
+
+import numpy as np
+
+from chipc.spec_interpreter import load_spec
+from chipc.spec_interpreter import Spec
+
+BASE_PATH = path.abspath(path.dirname(__file__))
+SPEC_DIR = path.join(BASE_PATH, '../example_specs/')
+
+
+def make_program(body):
+    return ('|StateAndPacket| program(|StateAndPacket| state_and_packet) {\n'
+            + body + '\n  return state_and_packet;\n}\n')
+
+
+def split_values(values):
+    return ({name: value for name, value in values.items()
+             if name.startswith('pkt_')},
+            {name: value for name, value in values.items()
+             if not name.startswith('pkt_')})
+
+
+class SpecTest(unittest.TestCase):
+    def test_sampling(self):
+        spec = load_spec(path.join(SPEC_DIR, 'sampling.sk'))
+        self.assertEqual(
+            ({'pkt_0': 1}, {'state_group_0_state_0': 0}),
+            spec.evaluate({'pkt_0': 5}, {'state_group_0_state_0': 2}))
+        self.assertEqual(
+            ({'pkt_0': 0}, {'state_group_0_state_0': 4}),
+            spec.evaluate({'pkt_0': 5}, {'state_group_0_state_0': 3}))
+
+    def test_batch(self):
+        spec = load_spec(path.join(SPEC_DIR, 'rcp.sk'))
+        pkt_fields, state_vars = spec.evaluate_batch(
+            {'pkt_0': np.array([1, 2]), 'pkt_1': np.array([1, 3])},
+            {'state_group_0_state_0': np.array([10, 10]),
+             'state_group_1_state_0': np.array([10, 10]),
+             'state_group_2_state_0': np.array([10, 10])})
+        self.assertEqual([11, 12], list(state_vars['state_group_0_state_0']))
+        self.assertEqual([11, 10], list(state_vars['state_group_1_state_0']))
+        self.assertEqual([11, 10], list(state_vars['state_group_2_state_0']))
+        self.assertEqual([1, 3], list(pkt_fields['pkt_1']))
+
+    def test_expressions(self):
+        spec = Spec(make_program('''
+  state_and_packet.pkt_0 = state_and_packet.pkt_1 < 3 &&
+      !(state_and_packet.pkt_2 == 0) ? 1 + 2 * 3 : -7 / 2;
+  if (state_and_packet.pkt_1 > 10) {
+    state_and_packet.pkt_1 -= 10;
+  } else if (state_and_packet.pkt_1 >= 5) {
+    state_and_packet.pkt_1 = state_and_packet.pkt_1 % 3;
+  }'''))
+        for pkt_1, pkt_2, expected in [(1, 1, (7, 1)), (1, 0, (-3, 1)),
+                                       (12, 1, (-3, 2)), (7, 1, (-3, 1))]:
+            pkt_fields, _ = spec.evaluate(
+                {'pkt_0': 0, 'pkt_1': pkt_1, 'pkt_2': pkt_2}, {})
+            self.assertEqual(expected,
+                             (pkt_fields['pkt_0'], pkt_fields['pkt_1']))
+
+    def test_unsupported(self):
+        with self.assertRaises(ValueError):
+            Spec(make_program('int x = 1;'))
+        with self.assertRaises(ValueError):
+            Spec('int foo() { return 1; }')
+
+    def test_batch_matches_scalar(self):
+        random_state = np.random.RandomState(0)
+        for spec_filename in glob.glob(path.join(SPEC_DIR, '*.sk')):
+            spec = load_spec(spec_filename)
+            values = {name: random_state.randint(0, 64, 100)
+                      for name in spec.variables}
+            pkt_fields, state_vars = spec.evaluate_batch(
+                *split_values(values))
+            for i in range(100):
+                scalar_pkt_fields, scalar_state_vars = spec.evaluate(
+                    *split_values({name: int(value[i])
+                                   for name, value in values.items()}))
+                for name, value in scalar_pkt_fields.items():
+                    self.assertEqual(value, pkt_fields[name][i])
+                for name, value in scalar_state_vars.items():
+                    self.assertEqual(value, state_vars[name][i])
+
+    def test_pickle(self):
+        spec = pickle.loads(pickle.dumps(
+            load_spec(path.join(SPEC_DIR, 'simple.sk'))))
+        self.assertEqual(
+            ({'pkt_0': 4}, {'state_group_0_state_0': 3}),
+            spec.evaluate({'pkt_0': 0}, {'state_group_0_state_0': 3}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import json
+import subprocess
+import sys
+import tempfile
+import unittest
+from os import path
+
+from chipc.trace import get_child_usage
+from chipc.trace import load_trace
+from chipc.trace import Tracer
+from chipc.trace import write_chrome_trace
+from tests.utils import create_compiler
+from tests.utils import get_simple_solution
+
+
+class TracerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.trace_filename = path.join(self.tmp_dir.name, 'trace.jsonl')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_nested_spans(self):
+        tracer = Tracer(self.trace_filename)
+        # A child process using more memory than all earlier ones.
+        _, max_rss_kb = get_child_usage()
+        with tracer.span('iteration', iteration=1):
+            with tracer.span('synthesize'):
+                subprocess.run([sys.executable, '-c', 'b"1" * %d' % (
+                    (max_rss_kb + 65536) * 1024)])
+        records = load_trace(self.trace_filename)
+        # Inner spans finish first.
+        self.assertEqual(['synthesize', 'iteration'],
+                         [record['name'] for record in records])
+        self.assertEqual([1, 0], [record['depth'] for record in records])
+        self.assertEqual({'iteration': 1}, records[1]['args'])
+        synthesize = records[0]
+        self.assertGreater(synthesize['child_cpu_time'], 0)
+        self.assertGreater(synthesize['peak_child_rss_kb'], max_rss_kb)
+        self.assertGreaterEqual(records[1]['wall_time'],
+                                synthesize['wall_time'])
+
+    def test_peak_child_rss_not_grown(self):
+        tracer = Tracer(self.trace_filename)
+        with tracer.span('z3_check'):
+            pass
+        self.assertIsNone(
+            load_trace(self.trace_filename)[0]['peak_child_rss_kb'])
+
+    def test_exception(self):
+        tracer = Tracer(self.trace_filename)
+        with self.assertRaises(ValueError):
+            with tracer.span('z3_check'):
+                raise ValueError()
+        self.assertEqual(1, len(load_trace(self.trace_filename)))
+        self.assertEqual(0, tracer.depth)
+
+    def test_new_trace(self):
+        with Tracer(self.trace_filename).span('screen'):
+            pass
+        Tracer(self.trace_filename)
+        self.assertEqual([], load_trace(self.trace_filename))
+
+    def test_disabled(self):
+        tracer = Tracer()
+        with tracer.span('screen'):
+            pass
+        self.assertEqual(0, tracer.depth)
+
+    def test_chrome_trace(self):
+        tracer = Tracer(self.trace_filename)
+        with tracer.span('verify', input_bits=3):
+            pass
+        chrome_trace_filename = path.join(self.tmp_dir.name, 'trace.json')
+        write_chrome_trace(self.trace_filename, chrome_trace_filename)
+        with open(chrome_trace_filename) as chrome_trace_file:
+            event, = json.load(chrome_trace_file)['traceEvents']
+        record, = load_trace(self.trace_filename)
+        self.assertEqual('verify', event['name'])
+        self.assertEqual('X', event['ph'])
+        self.assertAlmostEqual(record['start'] * 1e6, event['ts'])
+        self.assertEqual(3, event['args']['input_bits'])
+        self.assertIn('child_cpu_time', event['args'])
+
+    def test_compiler_phases(self):
+        compiler = create_compiler(exhaustive_verify_limit=2**4,
+                                   tracer=Tracer(self.trace_filename))
+        compiler.verify_progressively(get_simple_solution(compiler), [2, 4])
+        self.assertEqual(
+            ['verify_exhaustively', 'verify', 'z3_query', 'z3_check',
+             'verify'],
+            [record['name'] for record in load_trace(self.trace_filename)])
+
+
+if __name__ == '__main__':
+    unittest.main()
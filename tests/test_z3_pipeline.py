@@ -0,0 +1,196 @@
+import itertools
+import os
+import tempfile
+import unittest
+from os import path
+from pathlib import Path
+from unittest.mock import patch
+
+import z3
+
+from chipc.z3_pipeline import Z3Operations
+from tests.utils import ASSERT_FALSE_ALU
+from tests.utils import create_compiler
+from tests.utils import DATA_DIR
+from tests.utils import get_simple_solution
+from tests.utils import SKETCH_NAME
+
+
+def evaluate(expression):
+    return z3.simplify(expression).as_long()
+
+
+class Z3OperationsTest(unittest.TestCase):
+    def test_divide(self):
+        for bv_width in [None, 8]:
+            ops = Z3Operations(bv_width)
+            for dividend, divisor in itertools.product([-7, 0, 7], [-2, 0, 2]):
+                if divisor == 0:
+                    expected = 0
+                else:
+                    # Rounds towards zero.
+                    expected = int(dividend / divisor)
+                quotient = ops.divide(dividend, divisor)
+                remainder = ops.remainder(dividend, divisor)
+                if bv_width is not None:
+                    quotient = z3.SignExt(64 - bv_width, quotient)
+                    remainder = z3.SignExt(64 - bv_width, remainder)
+                    expected_remainder = (
+                        dividend - expected * divisor) % 2**64
+                    expected = expected % 2**64
+                else:
+                    expected_remainder = dividend - expected * divisor
+                self.assertEqual(expected, evaluate(quotient),
+                                 (dividend, divisor, bv_width))
+                self.assertEqual(expected_remainder, evaluate(remainder),
+                                 (dividend, divisor, bv_width))
+
+    def test_conversions(self):
+        ops = Z3Operations()
+        self.assertEqual(1, evaluate(ops.to_int(True)))
+        self.assertEqual(0, evaluate(ops.to_int(z3.BoolVal(False))))
+        self.assertTrue(z3.is_true(z3.simplify(ops.to_bool(3))))
+        self.assertEqual(
+            4, evaluate(ops.where(ops.logical_and(True, 2), 4, 5)))
+
+
+class VerifyDirectlyTest(unittest.TestCase):
+    def test_simple_solution(self):
+        for bv_width in [None, 16]:
+            compiler = create_compiler(exhaustive_verify_limit=0,
+                                       bv_width=bv_width)
+            self.assertEqual([], compiler.verify_multiple(
+                get_simple_solution(compiler), 10))
+
+    def test_counterexample(self):
+        compiler = create_compiler(exhaustive_verify_limit=0,
+                                   num_counterexamples=3)
+        hole_assignments = get_simple_solution(compiler)
+        hole_assignments[SKETCH_NAME +
+                         '_stateless_alu_1_0_immediate_operand'] = '0'
+        counterexamples = compiler.verify_multiple(hole_assignments, 10)
+        self.assertEqual(3, len(counterexamples))
+        for pkt_fields, state_vars in counterexamples:
+            # pkt_0 is the old state instead of the old state plus one.
+            self.assertLess(state_vars.get('state_group_0_state_0', 0),
+                            2**10)
+
+    def test_spec_asserted_once(self):
+        compiler = create_compiler(exhaustive_verify_limit=0)
+        hole_assignments = get_simple_solution(compiler)
+        self.assertEqual([], compiler.verify_multiple(hole_assignments, 10))
+        key = ('direct', 10)
+        solver = compiler.verifier.solvers[key]
+        hole_assignments[SKETCH_NAME +
+                         '_stateless_alu_1_0_immediate_operand'] = '0'
+        self.assertNotEqual(
+            [], compiler.verify_multiple(hole_assignments, 10))
+        # The same solver, with only the spec side left after the checks.
+        self.assertIs(solver, compiler.verifier.solvers[key])
+        self.assertEqual(len(compiler.verifier.get_base(key).constraints),
+                         len(solver.assertions()))
+
+    def test_same_as_exhaustive(self):
+        compiler = create_compiler(exhaustive_verify_limit=0)
+        solution = get_simple_solution(compiler)
+        num_correct = 0
+        # Candidates differing from the solution in one hole, some of which
+        # are still correct.
+        for hole in compiler.sketch_code_generator.holes_:
+            if hole.name.endswith('immediate_operand') or \
+                    '_const_' in hole.name:
+                # Indices into the two constants.
+                max_value = 1
+            else:
+                max_value = min(hole.max, 3)
+            for value in range(max_value + 1):
+                hole_assignments = dict(solution)
+                hole_assignments[hole.name] = str(value)
+                num_correct += self.check_same_as_exhaustive(
+                    compiler, hole_assignments)
+        self.assertGreater(num_correct, 0)
+
+    def check_same_as_exhaustive(self, compiler, hole_assignments):
+        direct = compiler.verify_multiple(hole_assignments, 3)
+        exhaustive = compiler.verify_exhaustively(hole_assignments, 3, 1)
+        self.assertEqual(bool(direct), bool(exhaustive), hole_assignments)
+        for pkt_fields, state_vars in direct:
+            # Inputs z3 didn't need a value for can be anything.
+            pkt_fields.setdefault('pkt_0', 0)
+            state_vars.setdefault('state_group_0_state_0', 0)
+            result = compiler.simulate(hole_assignments, pkt_fields,
+                                       state_vars)
+            expected = compiler.spec.evaluate(pkt_fields, state_vars)
+            self.assertNotEqual(
+                (expected[0]['pkt_0'], expected[1]['state_group_0_state_0']),
+                (result[0]['pkt_0'][0],
+                 result[1]['state_group_0_state_0'][0]))
+        return not direct
+
+
+# IR of the verify sketch of get_simple_solution with ASSERT_FALSE_ALU, with
+# the asserts of the stateful ALUs of both stages. The one of stage 1 reads
+# the old state_0 as its packet field and 0 as its state.
+ASSERT_FALSE_VERIFY_DAG = Path(
+    path.join(DATA_DIR, 'assert_false_raw_verify.dag')).read_text()
+
+
+@patch('chipc.sketch_utils.generate_ir', return_value=ASSERT_FALSE_VERIFY_DAG)
+class SameAsSketchTest(unittest.TestCase):
+    def setUp(self):
+        # Verification writes sketch files to the current directory.
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def get_inputs(self, counterexamples, input_bits):
+        # Inputs z3 didn't need a value for can be anything.
+        values = range(2**input_bits)
+        return {(pkt, state)
+                for pkt_fields, state_vars in counterexamples
+                for pkt in ([pkt_fields['pkt_0']] if 'pkt_0' in pkt_fields
+                            else values)
+                for state in ([state_vars['state_group_0_state_0']]
+                              if 'state_group_0_state_0' in state_vars
+                              else values)}
+
+    def test_assert_false(self, mock_generate_ir):
+        for bv_width in [None, 16]:
+            compiler = create_compiler(ASSERT_FALSE_ALU,
+                                       exhaustive_verify_limit=0,
+                                       bv_width=bv_width)
+            hole_assignments = get_simple_solution(compiler)
+            for input_bits in [2, 3]:
+                direct = compiler.verify_directly(hole_assignments,
+                                                  input_bits, 64)
+                sketch = compiler.verify_with_sketch(hole_assignments,
+                                                     input_bits, 1, 64)
+                self.assertEqual(self.get_inputs(sketch, input_bits),
+                                 self.get_inputs(direct, input_bits),
+                                 (bv_width, input_bits))
+                self.assertGreater(len(direct), 0)
+            # With 2 bits, only 3 reaches assert(false), pkt_0 - state_0 is
+            # at least -3 and (0 - 3) / 2 rounds towards zero to -1.
+            self.assertEqual(
+                {(3, state) for state in range(4)} |
+                {(pkt, 3) for pkt in range(4)},
+                self.get_inputs(compiler.verify_directly(hole_assignments, 2,
+                                                         64), 2))
+
+    def test_cross_check(self, mock_generate_ir):
+        compiler = create_compiler(ASSERT_FALSE_ALU,
+                                   exhaustive_verify_limit=0,
+                                   verify_mode='cross-check')
+        hole_assignments = get_simple_solution(compiler)
+        for input_bits in [2, 3, 6]:
+            self.assertNotEqual(
+                [], compiler.verify_multiple(hole_assignments, input_bits))
+        self.assertEqual([], compiler.verify_disagreements)
+
+
+if __name__ == '__main__':
+    unittest.main()
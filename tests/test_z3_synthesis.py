@@ -0,0 +1,123 @@
+import os
+import tempfile
+import unittest
+from os import path
+
+import z3
+
+from chipc import iterative_solver
+from chipc.z3_pipeline import Z3Operations
+from chipc.z3_synthesis import get_predicate
+from chipc.z3_synthesis import Z3Backend
+from tests.utils import ASSERT_FALSE_ALU
+from tests.utils import create_compiler
+from tests.utils import SPEC_DIR
+from tests.utils import STATEFUL_ALU_DIR
+from tests.utils import STATELESS_ALU_DIR
+
+
+def run_cegis(compiler, max_iterations=20):
+    """Returns the number of iterations until a candidate is verified, or
+    None if synthesis fails."""
+    for i in range(1, max_iterations + 1):
+        ret, output, hole_assignments = compiler.serial_codegen(iter_cnt=i)
+        if ret != 0:
+            return None
+        counterexamples = compiler.verify_multiple(hole_assignments, 10)
+        if not counterexamples:
+            return i
+        compiler.add_counterexamples(counterexamples)
+    raise AssertionError('No candidate verified')
+
+
+class GetPredicateTest(unittest.TestCase):
+    def test_hole_elimination(self):
+        ops = Z3Operations(None)
+        values = {'a': z3.Int('a'), 'b': z3.Int('b')}
+        predicate = get_predicate('!((a == 1) && (b == 2))', values, ops)
+        solver = z3.Solver()
+        solver.add(predicate, values['a'] == 1)
+        solver.push()
+        solver.add(values['b'] == 2)
+        self.assertEqual(z3.unsat, solver.check())
+        solver.pop()
+        self.assertEqual(z3.sat, solver.check())
+
+    def test_sum(self):
+        ops = Z3Operations(8)
+        values = {'a': z3.BitVec('a', 8), 'b': z3.BitVec('b', 8)}
+        solver = z3.Solver()
+        solver.add(get_predicate('(a + b + 0) <= 1', values, ops),
+                   values['a'] == 1, values['b'] == 1)
+        self.assertEqual(z3.unsat, solver.check())
+
+
+class Z3BackendTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def test_cegis(self):
+        for bv_width in [None, 16]:
+            compiler = create_compiler(synthesis_backend=Z3Backend(),
+                                       bv_width=bv_width)
+            self.assertIsNotNone(run_cegis(compiler), bv_width)
+
+    def test_counterexamples(self):
+        # With only the all zero input to start from, candidates must be
+        # refined with counterexamples.
+        backend = Z3Backend(input_bits=0)
+        compiler = create_compiler(synthesis_backend=backend)
+        self.assertGreater(run_cegis(compiler), 1)
+        self.assertGreater(len(backend.testcases), 1)
+
+    def test_assert_false(self):
+        # The stateful ALU of stage 0 can only read pkt_0 and reaches
+        # assert(false) for 3, which is among the initial inputs, so there
+        # is no candidate.
+        compiler = create_compiler(ASSERT_FALSE_ALU,
+                                   synthesis_backend=Z3Backend())
+        ret, output, _ = compiler.serial_codegen()
+        self.assertNotEqual(0, ret)
+        self.assertIn('unsat', output)
+
+    def test_unsat(self):
+        compiler = create_compiler(synthesis_backend=Z3Backend())
+        compiler.sketch_code_generator.generate_hardware()
+        # Without a stateful ALU, state_0 can't be updated.
+        constraints = [hole + ' == 0' for hole in
+                       compiler.sketch_code_generator.hole_names_
+                       if '_salu_config_' in hole]
+        ret, output, hole_assignments = compiler.parallel_codegen(
+            constraints)
+        self.assertNotEqual(0, ret)
+        self.assertEqual({}, hole_assignments)
+
+    def test_iterative_solver(self):
+        self.assertEqual(0, iterative_solver.main([
+            'iterative_solver', path.join(SPEC_DIR, 'simple.sk'),
+            path.join(STATEFUL_ALU_DIR, 'raw.alu'),
+            path.join(STATELESS_ALU_DIR, 'stateless_alu_arith.alu'),
+            '2', '1', '0,1', '10', '--synthesis-backend', 'z3']))
+
+    def test_update_constants(self):
+        backend = Z3Backend()
+        compiler = create_compiler(synthesis_backend=backend)
+        self.assertIsNotNone(run_cegis(compiler))
+        solver = backend.solver
+        # Appended constants keep the solver, replaced ones don't.
+        compiler.update_constants_for_synthesis(['0', '1', '2'])
+        self.assertEqual(0, compiler.serial_codegen()[0])
+        self.assertIs(solver, backend.solver)
+        compiler.update_constants_for_synthesis(['1', '0'])
+        self.assertEqual(0, compiler.serial_codegen()[0])
+        self.assertIsNot(solver, backend.solver)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,5 @@
+import itertools
+import pickle
 import unittest
 from pathlib import Path
 from unittest.mock import patch
@@ -70,6 +72,39 @@ class GenerateCounterexamplesTest(unittest.TestCase):
         self.assertDictEqual(pkt_fields, {})
         self.assertTrue('state_group_1_state_0' in state_vars)
 
+
+class IncrementalVerifierTest(unittest.TestCase):
+    def test_same_results_across_checks(self):
+        base_path = Path(__file__).parent
+        verifier = z3_utils.IncrementalVerifier()
+        for dag_name in ['hello.dag', 'sampling.dag', 'hello.dag']:
+            sketch_ir = Path(base_path / 'data' / dag_name).read_text()
+            formula = z3_utils.get_z3_formula(sketch_ir, input_bits=2)
+            self.assertTupleEqual(
+                z3_utils.generate_counterexamples(formula),
+                verifier.generate_counterexamples(formula))
+        self.assertEqual(3, verifier.num_checks)
+
+    def test_formulas_do_not_accumulate(self):
+        x = z3.Int('pkt_0_0_0_0')
+        verifier = z3_utils.IncrementalVerifier()
+        pkt_fields, _ = verifier.generate_counterexamples(
+            z3.ForAll([x], x < 5))
+        self.assertGreaterEqual(pkt_fields['pkt_0'], 5)
+        # Wouldn't have a counterexample if x >= 5 was still asserted.
+        pkt_fields, _ = verifier.generate_counterexamples(
+            z3.ForAll([x], x >= 5))
+        self.assertLess(pkt_fields['pkt_0'], 5)
+
+    def test_pickle(self):
+        verifier = z3_utils.IncrementalVerifier()
+        x = z3.Int('x')
+        verifier.generate_counterexamples(z3.ForAll([x], x == x))
+        copied_verifier = pickle.loads(pickle.dumps(verifier))
+        self.assertDictEqual({}, copied_verifier.solvers)
+        self.assertEqual(1, copied_verifier.num_checks)
+
+
 class GetZ3FormulaTest(unittest.TestCase):
     def test_conversion(self):
         # Smoke test for bool-to-int and int-to-bool conversion
@@ -119,6 +154,158 @@ class GetZ3FormulaTest(unittest.TestCase):
         self.assertDictEqual(ir_pkt_fields, smt_pkt_fields)
         self.assertDictEqual(ir_state_vars, smt_state_vars)
 
+    def test_division(self):
+        # -pkt_0 / (pkt_1 - 2) and -pkt_0 % (pkt_1 - 2), with negative
+        # operands and a zero divisor among the inputs.
+        sketch_ir = '''0 = S INT pkt_0_0_0_0 2
+                       1 = S INT pkt_1_0_0_0 2
+                       2 = NEG INT 0
+                       3 = CONST INT -2
+                       4 = PLUS INT 1 3
+                       5 = DIV INT 2 4
+                       6 = MOD INT 2 4
+                       7 = EQ BOOL 5 6
+                       8 = ASSERT 7 "q == r"'''
+        for bv_width in [None, 8]:
+            asserts, _, source_vars = z3_utils.get_z3_constraints(
+                sketch_ir, 2, bv_width=bv_width)
+            quotient, remainder = asserts[0].arg(0), asserts[0].arg(1)
+            for pkt_0, pkt_1 in itertools.product(range(4), repeat=2):
+                dividend, divisor = -pkt_0, pkt_1 - 2
+                # Like sketch, rounds towards zero and divides by zero to 0.
+                expected = int(dividend / divisor) if divisor != 0 else 0
+                values = [(var, z3.IntVal(value) if bv_width is None
+                           else z3.BitVecVal(value, 2))
+                          for var, value in zip(source_vars, [pkt_0, pkt_1])]
+                results = [z3.simplify(z3.substitute(value, *values))
+                           for value in [quotient, remainder]]
+                if bv_width is not None:
+                    results = [result.as_signed_long() for result in results]
+                else:
+                    results = [result.as_long() for result in results]
+                self.assertListEqual(
+                    [expected, dividend - expected * divisor], results,
+                    (pkt_0, pkt_1, bv_width))
+
+
+class GetZ3NegatedQueryTest(unittest.TestCase):
+    def test_quantifier_free(self):
+        sketch_ir = '''0 = S INT pkt_0_0_0_0 2
+                       1 = CONST INT 3
+                       2 = LT BOOL 0 1
+                       3 = ASSERT 2 "x < 3"'''
+        query = z3_utils.get_z3_negated_query(sketch_ir, 2)
+        self.assertFalse(z3.is_quantifier(query))
+        # Range predicates and the negated asserts are in a single And.
+        self.assertTrue(z3.is_and(query))
+        self.assertEqual(3, query.num_args())
+        self.assertTupleEqual(
+            ({'pkt_0': 3}, {}),
+            z3_utils.IncrementalVerifier()
+            .generate_counterexamples_from_query(query))
+
+    def test_same_as_negated_body(self):
+        base_path = Path(__file__).parent
+        for dag_name in ['hello.dag', 'sampling.dag']:
+            sketch_ir = Path(base_path / 'data' / dag_name).read_text()
+            for bv_width in [None, 16]:
+                solver = z3.Solver()
+                # Both formulas are equivalent if their difference is unsat.
+                solver.add(z3.Xor(
+                    z3_utils.negated_body(z3_utils.get_z3_formula(
+                        sketch_ir, 2, bv_width=bv_width)),
+                    z3_utils.get_z3_negated_query(
+                        sketch_ir, 2, bv_width=bv_width)))
+                self.assertEqual(z3.unsat, solver.check())
+
+    def test_no_source_variables(self):
+        query = z3_utils.get_z3_negated_query(
+            '0 = CONST BOOL 1\n1 = ASSERT 0 "true"', 2)
+        self.assertEqual(z3.unsat, z3.Solver().check(query))
+
+
+class MultipleCounterexamplesTest(unittest.TestCase):
+    def test_diverse_counterexamples(self):
+        pkt_0 = z3.Int('pkt_0_0_0_0')
+        state = z3.Int('state_group_0_state_0_0_0_0')
+        # Fails whenever pkt_0 + state > 2 with inputs in [0, 3].
+        query = z3.And(0 <= pkt_0, pkt_0 < 4, 0 <= state, state < 4,
+                       z3.Not(pkt_0 + state <= 2))
+        counterexamples = z3_utils.IncrementalVerifier() \
+            .generate_multiple_counterexamples_from_query(query, 3)
+        self.assertEqual(3, len(counterexamples))
+        for pkt_fields, state_vars in counterexamples:
+            self.assertGreater(
+                pkt_fields['pkt_0'] + state_vars['state_group_0_state_0'], 2)
+        # All values differ between the first two, as there are such
+        # counterexamples.
+        first, second = counterexamples[0], counterexamples[1]
+        self.assertNotEqual(first[0]['pkt_0'], second[0]['pkt_0'])
+        self.assertNotEqual(first[1]['state_group_0_state_0'],
+                            second[1]['state_group_0_state_0'])
+
+    def test_fewer_counterexamples_than_asked(self):
+        pkt_0 = z3.Int('pkt_0_0_0_0')
+        query = z3.And(0 <= pkt_0, pkt_0 < 4, z3.Not(pkt_0 < 2))
+        verifier = z3_utils.IncrementalVerifier()
+        counterexamples = \
+            verifier.generate_multiple_counterexamples_from_query(query, 5)
+        self.assertListEqual([2, 3], sorted(
+            pkt_fields['pkt_0'] for pkt_fields, _ in counterexamples))
+        # Blocking clauses don't outlive the query.
+        self.assertEqual(
+            2, len(verifier.generate_multiple_counterexamples_from_query(
+                query, 5)))
+        self.assertListEqual(
+            [], verifier.generate_multiple_counterexamples_from_query(
+                z3.And(pkt_0 > 0, pkt_0 < 0), 5))
+
+
+class BitVectorFormulaTest(unittest.TestCase):
+    def test_same_counterexample_as_int(self):
+        sketch_ir = '''0 = S INT pkt_0_0_0_0 2
+                       1 = CONST INT 3
+                       2 = LT BOOL 0 1
+                       3 = ASSERT 2 "x < 3"'''
+        self.assertTupleEqual(
+            ({'pkt_0': 3}, {}),
+            z3_utils.generate_counterexamples(
+                z3_utils.get_z3_formula(sketch_ir, 2, bv_width=10)))
+        self.assertTupleEqual(
+            z3_utils.generate_counterexamples(
+                z3_utils.get_z3_formula(sketch_ir, 2)),
+            z3_utils.generate_counterexamples(
+                z3_utils.get_z3_formula(sketch_ir, 2, bv_width=10)))
+
+    def test_overflow(self):
+        sketch_ir = '''0 = S INT pkt_0_0_0_0 2
+                       1 = CONST INT 8
+                       2 = PLUS INT 0 1
+                       3 = LT BOOL 0 2
+                       4 = ASSERT 3 "x < x + 8"'''
+        # x + 8 wraps around with 4 bits, but not with 5 bits or integers.
+        pkt_fields, _ = z3_utils.generate_counterexamples(
+            z3_utils.get_z3_formula(sketch_ir, 3, bv_width=4))
+        self.assertIn('pkt_0', pkt_fields)
+        for bv_width in [None, 5]:
+            self.assertTupleEqual(
+                ({}, {}), z3_utils.generate_counterexamples(
+                    z3_utils.get_z3_formula(sketch_ir, 3, bv_width=bv_width)))
+
+    def test_same_results_as_int(self):
+        base_path = Path(__file__).parent
+        for dag_name in ['hello.dag', 'sampling.dag']:
+            sketch_ir = Path(base_path / 'data' / dag_name).read_text()
+            self.assertTupleEqual(
+                z3_utils.generate_counterexamples(
+                    z3_utils.get_z3_formula(sketch_ir, 10)),
+                z3_utils.generate_counterexamples(
+                    z3_utils.get_z3_formula(sketch_ir, 10, bv_width=32)))
+
+    def test_raise_assert_for_narrow_width(self):
+        with self.assertRaisesRegex(AssertionError, 'must be larger'):
+            z3_utils.get_z3_formula('0 = S INT pkt_0_0_0_0 2', 8, bv_width=8)
+
 
 class SimpleCheckTest(unittest.TestCase):
     def test_success(self):
@@ -0,0 +1,83 @@
+"""Fixtures shared by the tests"""
+from os import path
+
+from ordered_set import OrderedSet
+
+from chipc.compiler import Compiler
+
+BASE_PATH = path.abspath(path.dirname(__file__))
+
+STATELESS_ALU_DIR = path.join(BASE_PATH, '../example_alus/stateless_alus/')
+STATEFUL_ALU_DIR = path.join(BASE_PATH, '../example_alus/stateful_alus/')
+SPEC_DIR = path.join(BASE_PATH, '../example_specs/')
+DATA_DIR = path.join(BASE_PATH, 'data')
+
+# raw.alu with assert(false) for pkt_0 == 3 and a division, see the file.
+ASSERT_FALSE_ALU = path.join(DATA_DIR, 'assert_false_raw.alu')
+
+# Sketch name of the default pipeline of create_compiler.
+SKETCH_NAME = 'simple_raw_stateless_alu_arith_2_1'
+
+# Arguments of create_compiler for rcp.sk on a larger pipeline.
+RCP_PIPELINE = {'spec': 'rcp.sk', 'stateful_alu': 'if_else_raw.alu',
+                'stateless_alu': 'stateless_alu.alu',
+                'num_pipeline_stages': 3, 'num_alus_per_stage': 2,
+                'constants': ['0', '1', '2', '3']}
+
+# Asserts pkt_0 < 5.
+VERIFY_DAG = '''dag main__WrapperNospec :
+0 = S INT pkt_0_0_0_0 2
+1 = CONST INT 5
+2 = LT BOOL 0 1
+3 = ASSERT 2 "pkt_0 < 5"
+'''
+
+
+def get_name(filename):
+    return path.splitext(path.basename(filename))[0]
+
+
+def create_compiler(stateful_alu='raw.alu', spec='simple.sk',
+                    stateless_alu='stateless_alu_arith.alu',
+                    num_pipeline_stages=2, num_alus_per_stage=1,
+                    constants=['0', '1'], **kwargs):
+    """Returns a Compiler for simple.sk with raw.alu and
+    stateless_alu_arith.alu on 2 stages of 1 ALU by default. ALUs and specs
+    are file names in the example directories or paths. Other keyword
+    arguments are passed to the Compiler."""
+    return Compiler(path.join(SPEC_DIR, spec),
+                    path.join(STATEFUL_ALU_DIR, stateful_alu),
+                    path.join(STATELESS_ALU_DIR, stateless_alu),
+                    num_pipeline_stages, num_alus_per_stage,
+                    '_'.join([get_name(spec), get_name(stateful_alu),
+                              get_name(stateless_alu),
+                              str(num_pipeline_stages),
+                              str(num_alus_per_stage)]),
+                    False, OrderedSet(constants), **kwargs)
+
+
+def get_simple_solution(compiler):
+    """Returns hole value assignments computing pkt_0 = 1 + state_0, as in
+    simple.sk, with the stateful ALU in stage 0 and the stateless ALU in
+    stage 1, for a compiler of create_compiler with raw.alu or an ALU with
+    the same holes."""
+    compiler.sketch_code_generator.generate_hardware()
+    hole_assignments = {
+        hole: '0' for hole in compiler.sketch_code_generator.hole_names_}
+    for hole, value in [
+            # state_0 = state_0 + C(), with C() == 0, returns old state_0.
+            ('stateful_alu_0_0_Opt_0_global', 0),
+            ('stateful_alu_0_0_Mux2_0_global', 1),
+            ('stateful_alu_0_0_const_0_global', 0),
+            ('stateful_alu_0_0_Mux2_1_global', 0),
+            ('salu_config_0_0', 1),
+            ('output_mux_phv_0_0_ctrl', 0),
+            # pkt_0 + immediate_operand, with immediate_operand == 1.
+            ('stateless_alu_1_0_opcode', 2),
+            ('stateless_alu_1_0_immediate_operand', 1),
+            ('stateless_alu_1_0_operand_mux_0_ctrl', 0),
+            ('output_mux_phv_1_0_ctrl', 1)]:
+        hole = compiler.sketch_name + '_' + hole
+        assert hole in hole_assignments, hole
+        hole_assignments[hole] = str(value)
+    return hole_assignments